@@ -0,0 +1,330 @@
+"""基准测试 - 在本机搭建完整链路并压测 /tools/call
+
+拓扑：bridge-server 在本进程内启动（uvicorn，仅监听 127.0.0.1），N 个 bridge-client 以子进程启动，
+每个 client 通过 stdio 运行 simple_server.py。压测端以固定并发调用 /tools/call，
+报告吞吐与 p50/p95/p99 延迟，并可与保存的基线对比。
+
+用法:
+    python benchmarks/bench.py                          # 运行全部场景
+    python benchmarks/bench.py small large -c 64        # 指定场景与并发
+    python benchmarks/bench.py --save-baseline          # 结果写入 baseline.json
+    python benchmarks/bench.py --compare                # 与 baseline.json 对比，有退化时退出码为 1
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import platform
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from dataclasses import dataclass, asdict, field, replace
+from pathlib import Path
+from typing import Dict, Any, List, Optional, Tuple
+
+import httpx
+import uvicorn
+
+ROOT = Path(__file__).resolve().parent.parent
+SERVER_DIR = ROOT / "mcp-bridge-server"
+CLIENT_DIR = ROOT / "mcp-bridge-client"
+BASELINE_PATH = Path(__file__).resolve().parent / "baseline.json"
+
+logger = logging.getLogger("bench")
+
+
+@dataclass
+class Scenario:
+    """压测场景"""
+    name: str
+    description: str
+    clients: int = 1  # bridge-client 数量（注册同名工具，构成副本集）
+    servers_per_client: int = 1  # 每个 client 运行的 MCP Server 数
+    server_script: str = "simple_server.py"  # mcp-bridge-client 下的 stdio MCP Server 脚本
+    tool: str = "echo"  # 调用的工具（每个 server 上的同名工具轮转）
+    arguments: Dict[str, Any] = field(default_factory=dict)  # 附加的调用参数
+    payload_size: int = 32  # echo 参数字节数（结果大小相同）
+    concurrency: int = 32  # 并发请求数
+    requests: int = 2000  # 计入统计的请求数（另有预热请求）
+
+
+SCENARIOS: Dict[str, Scenario] = {
+    s.name: s for s in [
+        Scenario("small", "小调用：1 个客户端，32 字节参数", requests=5000),
+        Scenario("large", "大负载：512KB 参数与结果（结果分块传输）", payload_size=512 * 1024, concurrency=8, requests=200),
+        Scenario("many_clients", "多客户端：8 个客户端注册同一组工具", clients=8, concurrency=128, requests=5000),
+        Scenario("many_tools", "多工具：每个客户端 20 个 server（40 个工具），调用轮转", servers_per_client=20, requests=3000),
+        Scenario(
+            "slow_tools", "慢工具：合成 server 固定 20ms 延迟，考察链路并发", server_script="synthetic_server.py",
+            tool="sleep", arguments={"latency_ms": 20}, concurrency=128, requests=5000
+        ),
+        Scenario(
+            "images", "图片结果：合成 server 返回 256KB 图片内容", server_script="synthetic_server.py",
+            tool="image", payload_size=0, concurrency=16, requests=500
+        ),
+    ]
+}
+
+
+@dataclass
+class Result:
+    """单个场景的压测结果"""
+    scenario: str
+    requests: int
+    errors: int
+    duration: float  # 秒
+    throughput: float  # 请求/秒
+    mean_ms: float
+    p50_ms: float
+    p95_ms: float
+    p99_ms: float
+
+
+def _free_port() -> int:
+    """获取一个本机空闲端口"""
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+class Topology:
+    """本机压测拓扑：进程内 bridge-server + 子进程 bridge-client"""
+
+    def __init__(self, scenario: Scenario, workdir: Path):
+        self.scenario = scenario
+        self.workdir = workdir
+        self.port = _free_port()
+        self.base_url = f"http://127.0.0.1:{self.port}"
+        self._server: Optional[uvicorn.Server] = None
+        self._server_task: Optional[asyncio.Task] = None
+        self._clients: List[asyncio.subprocess.Process] = []
+
+    async def start(self) -> None:
+        """启动 bridge-server 与所有 bridge-client，等待工具全部注册"""
+        if str(SERVER_DIR) not in sys.path:
+            sys.path.insert(0, str(SERVER_DIR))
+        from main import app
+        # 服务端每次调用都有INFO日志，压测时只保留警告
+        logging.getLogger().setLevel(logging.WARNING)
+
+        self._server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=self.port, log_level="warning"))
+        self._server_task = asyncio.create_task(self._server.serve())
+        while not self._server.started:
+            if self._server_task.done():
+                raise RuntimeError("bridge-server 启动失败")
+            await asyncio.sleep(0.05)
+
+        env = {k: v for k, v in os.environ.items() if k not in ("BRIDGE_SERVER_URL", "CLIENT_ID", "METRICS_PORT")}
+        for index in range(self.scenario.clients):
+            client_dir = self.workdir / f"client-{index}"
+            client_dir.mkdir()
+            config = {
+                "bridge_server_url": f"ws://127.0.0.1:{self.port}/ws",
+                "client_id": f"bench-client-{index}",
+                "servers": [
+                    {"name": f"s{n}", "command": sys.executable, "args": [str(CLIENT_DIR / self.scenario.server_script)]}
+                    for n in range(self.scenario.servers_per_client)
+                ]
+            }
+            config_path = client_dir / "config.json"
+            config_path.write_text(json.dumps(config), encoding="utf-8")
+            log = open(client_dir / "client.log", "wb")
+            process = await asyncio.create_subprocess_exec(
+                sys.executable, str(CLIENT_DIR / "main.py"), str(config_path),
+                cwd=client_dir, env=env, stdout=subprocess.DEVNULL, stderr=log
+            )
+            log.close()
+            self._clients.append(process)
+
+        await self._wait_registered()
+
+    async def _wait_registered(self, timeout: float = 60.0) -> None:
+        """等待所有 client 连接并注册工具（client 在全部 server 启动后才首次注册）"""
+        deadline = time.monotonic() + timeout
+        async with httpx.AsyncClient(base_url=self.base_url) as client:
+            while time.monotonic() < deadline:
+                clients = (await client.get("/clients")).json()["clients"]
+                ready = [c for c in clients if c["connected"] and c["tool_count"] > 0]
+                if len(ready) == self.scenario.clients:
+                    return
+                await asyncio.sleep(0.2)
+        raise RuntimeError(f"等待 bridge-client 注册超时，日志见 {self.workdir}")
+
+    async def stop(self) -> None:
+        """停止所有 client 与 bridge-server"""
+        for process in self._clients:
+            if process.returncode is None:
+                process.terminate()
+        for process in self._clients:
+            try:
+                await asyncio.wait_for(process.wait(), timeout=10.0)
+            except asyncio.TimeoutError:
+                process.kill()
+        if self._server:
+            self._server.should_exit = True
+            await self._server_task
+        # 注册表是进程内单例，清掉本场景的客户端（含断线宽限期内的会话），避免影响下一个场景
+        from registry import registry
+        for client_id in list(registry.clients):
+            registry.unregister_client(client_id)
+
+
+async def drive(base_url: str, scenario: Scenario) -> Result:
+    """以 scenario.concurrency 个并发 worker 调用场景的工具，统计延迟与吞吐"""
+    limits = httpx.Limits(max_connections=scenario.concurrency, max_keepalive_connections=scenario.concurrency)
+    async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=60.0) as client:
+        catalog = (await client.get("/tools")).json()["tools"]
+        tools = sorted(t["name"] for t in catalog if t["name"].endswith(f"__{scenario.tool}"))
+        payload = "x" * scenario.payload_size
+
+        async def run(count: int) -> Tuple[List[float], int]:
+            latencies: List[float] = []
+            errors: List[int] = []
+            sequence = iter(range(count))
+
+            async def worker() -> None:
+                for i in sequence:
+                    # 参数带序号，避免相同调用被请求合并
+                    arguments = {**scenario.arguments, "message": f"{i}:{payload}"}
+                    body = {"name": tools[i % len(tools)], "arguments": arguments}
+                    started = time.perf_counter()
+                    try:
+                        response = await client.post("/tools/call", json=body)
+                        ok = response.status_code == 200 and response.json().get("success")
+                    except httpx.HTTPError:
+                        ok = False
+                    latencies.append(time.perf_counter() - started)
+                    if not ok:
+                        errors.append(i)
+
+            await asyncio.gather(*(worker() for _ in range(scenario.concurrency)))
+            return latencies, len(errors)
+
+        # 预热：建立连接、填充各层缓存
+        await run(min(200, max(scenario.concurrency, scenario.requests // 10)))
+
+        started = time.perf_counter()
+        latencies, errors = await run(scenario.requests)
+        duration = time.perf_counter() - started
+
+    cuts = statistics.quantiles(latencies, n=100)
+    return Result(
+        scenario=scenario.name,
+        requests=len(latencies),
+        errors=errors,
+        duration=round(duration, 3),
+        throughput=round(len(latencies) / duration, 1),
+        mean_ms=round(statistics.fmean(latencies) * 1000, 2),
+        p50_ms=round(cuts[49] * 1000, 2),
+        p95_ms=round(cuts[94] * 1000, 2),
+        p99_ms=round(cuts[98] * 1000, 2)
+    )
+
+
+async def run_scenario(scenario: Scenario) -> Result:
+    """搭建拓扑、压测一个场景后清理"""
+    with tempfile.TemporaryDirectory(prefix=f"bench-{scenario.name}-") as workdir:
+        topology = Topology(scenario, Path(workdir))
+        try:
+            await topology.start()
+            return await drive(topology.base_url, scenario)
+        finally:
+            await topology.stop()
+
+
+def compare(results: List[Result], baseline: Dict[str, Any], tolerance: float) -> List[str]:
+    """与基线对比，返回退化项描述（吞吐下降或 p50/p95 延迟上升超过 tolerance）"""
+    regressions = []
+    for result in results:
+        base = baseline.get("results", {}).get(result.scenario)
+        if not base:
+            continue
+        if result.throughput < base["throughput"] * (1 - tolerance):
+            regressions.append(f"{result.scenario}: 吞吐 {result.throughput}/s < 基线 {base['throughput']}/s")
+        for key in ("p50_ms", "p95_ms"):
+            if getattr(result, key) > base[key] * (1 + tolerance):
+                regressions.append(f"{result.scenario}: {key} {getattr(result, key)} > 基线 {base[key]}")
+        if result.errors > base.get("errors", 0):
+            regressions.append(f"{result.scenario}: 错误数 {result.errors} > 基线 {base.get('errors', 0)}")
+    return regressions
+
+
+def _environment() -> Dict[str, Any]:
+    """记录在基线中的机器信息，对比时环境不同会给出提示"""
+    return {"python": platform.python_version(), "machine": platform.machine(), "cpus": os.cpu_count()}
+
+
+def _print_table(results: List[Result]) -> None:
+    """打印结果表"""
+    header = f"{'scenario':<14}{'requests':>10}{'errors':>8}{'req/s':>10}{'mean':>9}{'p50':>9}{'p95':>9}{'p99':>9}"
+    print(header)
+    print("-" * len(header))
+    for r in results:
+        print(
+            f"{r.scenario:<14}{r.requests:>10}{r.errors:>8}{r.throughput:>10}"
+            f"{r.mean_ms:>9}{r.p50_ms:>9}{r.p95_ms:>9}{r.p99_ms:>9}"
+        )
+    print("（延迟单位：毫秒）")
+
+
+async def main() -> int:
+    parser = argparse.ArgumentParser(description="MCP Bridge 本机基准测试")
+    parser.add_argument("scenarios", nargs="*", help=f"要运行的场景（默认全部）: {', '.join(SCENARIOS)}")
+    parser.add_argument("-c", "--concurrency", type=int, help="覆盖场景的并发数")
+    parser.add_argument("-n", "--requests", type=int, help="覆盖场景的请求数")
+    parser.add_argument("--save-baseline", action="store_true", help=f"把结果保存为基线（{BASELINE_PATH.name}）")
+    parser.add_argument("--compare", action="store_true", help="与基线对比，有退化时退出码为 1")
+    parser.add_argument("--tolerance", type=float, default=0.15, help="允许的相对退化幅度（默认 0.15）")
+    parser.add_argument("--json", dest="json_path", help="同时把结果写入该 JSON 文件")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] %(name)s: %(message)s")
+    unknown = [name for name in args.scenarios if name not in SCENARIOS]
+    if unknown:
+        parser.error(f"未知场景: {', '.join(unknown)}")
+
+    results = []
+    for name in args.scenarios or list(SCENARIOS):
+        scenario = SCENARIOS[name]
+        if args.concurrency:
+            scenario = replace(scenario, concurrency=args.concurrency)
+        if args.requests:
+            scenario = replace(scenario, requests=args.requests)
+        logger.info(f"场景 {scenario.name}: {scenario.description}")
+        results.append(await run_scenario(scenario))
+
+    _print_table(results)
+    report = {"environment": _environment(), "results": {r.scenario: asdict(r) for r in results}}
+    if args.json_path:
+        Path(args.json_path).write_text(json.dumps(report, indent=2, ensure_ascii=False), encoding="utf-8")
+
+    if args.compare:
+        if not BASELINE_PATH.exists():
+            logger.error(f"基线不存在，先用 --save-baseline 生成: {BASELINE_PATH}")
+            return 1
+        baseline = json.loads(BASELINE_PATH.read_text(encoding="utf-8"))
+        if baseline.get("environment") != report["environment"]:
+            logger.warning(f"基线环境不同，对比结果仅供参考: {baseline.get('environment')}")
+        regressions = compare(results, baseline, args.tolerance)
+        for line in regressions:
+            print(f"退化: {line}")
+        if regressions:
+            return 1
+        print("未发现退化")
+
+    if args.save_baseline:
+        if BASELINE_PATH.exists():
+            # 只更新本次运行的场景，保留其他场景的基线
+            saved = json.loads(BASELINE_PATH.read_text(encoding="utf-8"))
+            report["results"] = {**saved.get("results", {}), **report["results"]}
+        BASELINE_PATH.write_text(json.dumps(report, indent=2, ensure_ascii=False) + "\n", encoding="utf-8")
+        logger.info(f"基线已保存: {BASELINE_PATH}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main()))
@@ -0,0 +1,188 @@
+"""工具筛选基准 - 评估 web-agent 工具检索索引（tool_index.py）的召回率与耗时
+
+用合成目录（多个 server × 资源 × 操作，描述与参数风格接近常见 MCP Server）和带答案的自然语言查询，
+报告各目录规模下 recall@k、查询延迟、全量构建与增量更新耗时，以及筛选后发给 LLM 的工具 schema 体积。
+只依赖标准库，无需启动任何服务。
+
+用法:
+    python benchmarks/tool_selection.py                        # 默认规模 100 / 500 / 2000
+    python benchmarks/tool_selection.py --sizes 1000 --queries 2000 --json out.json
+"""
+import argparse
+import json
+import random
+import statistics
+import sys
+import time
+from pathlib import Path
+from typing import Dict, Any, List, Tuple
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "web-agent"))
+
+from tool_index import ToolIndex  # noqa: E402
+
+SERVERS = {
+    "github": ("GitHub", ["repository", "issue", "pull request", "branch", "release", "workflow run", "commit"]),
+    "jira": ("Jira", ["ticket", "sprint", "board", "epic", "comment", "project"]),
+    "slack": ("Slack", ["channel", "message", "user", "reaction", "reminder"]),
+    "gdrive": ("Google Drive", ["file", "folder", "permission", "spreadsheet", "document"]),
+    "postgres": ("PostgreSQL", ["table", "index", "query", "schema", "role"]),
+    "k8s": ("Kubernetes", ["pod", "deployment", "service", "namespace", "config map", "node"]),
+    "aws": ("AWS", ["s3 bucket", "ec2 instance", "lambda function", "security group", "cloudwatch alarm"]),
+    "calendar": ("Calendar", ["event", "meeting room", "attendee", "availability"]),
+    "email": ("Mail", ["email", "draft", "label", "attachment", "contact"]),
+    "weather": ("Weather", ["forecast", "alert", "observation station"]),
+    "crm": ("Salesforce", ["lead", "opportunity", "account", "invoice", "quote"]),
+    "docs": ("Confluence", ["page", "space", "attachment", "template"]),
+}
+
+# 操作 -> (描述动词, 描述中的同义说法, 查询中的说法)
+VERBS = {
+    "list": ("List", "Enumerate all", ["show all", "what are the", "list my", "give me every"]),
+    "get": ("Get", "Fetch details of a", ["fetch", "look up the", "show details of the", "what is in the"]),
+    "create": ("Create", "Add a new", ["make a new", "open a", "add a", "create a"]),
+    "update": ("Update", "Modify an existing", ["change the", "edit the", "rename the", "modify the"]),
+    "delete": ("Delete", "Remove a", ["remove the", "drop the", "get rid of the", "delete the"]),
+    "search": ("Search", "Find matching", ["find", "search for", "look for any", "which"]),
+}
+
+FILLERS = ["", "", "quickly", "for the team", "from yesterday", "that mentions billing", "for project apollo", "asap"]
+
+
+def build_catalog(size: int, rng: random.Random) -> List[Dict[str, Any]]:
+    """生成 size 个工具；超出基础组合数时以 server 副本（名称加序号）补足，模拟多 bridge-client"""
+    base = []
+    for server, (display, nouns) in SERVERS.items():
+        for noun in nouns:
+            for verb, (word, synonym, _) in VERBS.items():
+                base.append((server, display, noun, verb, word, synonym))
+    rng.shuffle(base)
+
+    tools = []
+    for i in range(size):
+        server, display, noun, verb, word, synonym = base[i % len(base)]
+        replica = i // len(base)
+        prefix = server if replica == 0 else f"{server}{replica}"
+        name = f"{prefix}__{verb}_{noun.replace(' ', '_')}"
+        plural = noun + "s" if verb in ("list", "search") else noun
+        properties: Dict[str, Any] = {
+            f"{noun.split()[-1]}_id": {"type": "string", "description": f"The {noun} identifier"}
+        }
+        if verb in ("list", "search"):
+            properties["query"] = {"type": "string", "description": f"Filter {plural} by text"}
+            properties["limit"] = {"type": "integer", "description": "Maximum number of results"}
+        if verb in ("create", "update"):
+            properties["title"] = {"type": "string", "description": f"Title of the {noun}"}
+        tools.append({
+            "name": name,
+            "description": f"{word} {plural} in {display}. {synonym} {noun} using the {display} API.",
+            "inputSchema": {"type": "object", "properties": properties},
+            "_truth": (server, noun, verb)
+        })
+    return tools
+
+
+def build_queries(tools: List[Dict[str, Any]], count: int, rng: random.Random) -> List[Tuple[str, set]]:
+    """生成查询及其正确答案集合（同一 server/资源/操作 的所有副本都算命中）"""
+    by_truth: Dict[Tuple[str, str, str], set] = {}
+    for tool in tools:
+        by_truth.setdefault(tool["_truth"], set()).add(tool["name"])
+    truths = sorted(by_truth)
+
+    queries = []
+    for _ in range(count):
+        server, noun, verb = rng.choice(truths)
+        display = SERVERS[server][0]
+        phrase = rng.choice(VERBS[verb][2])
+        where = rng.choice(["", f"in {display}", f"on {display}", ""])
+        noun_text = noun + "s" if phrase.startswith(("show all", "what are", "list my", "give me", "look for", "which")) else noun
+        text = " ".join(part for part in (phrase, noun_text, where, rng.choice(FILLERS)) if part)
+        queries.append((text, by_truth[(server, noun, verb)]))
+    return queries
+
+
+def run(size: int, query_count: int, ks: List[int], seed: int) -> Dict[str, Any]:
+    """对一个目录规模运行全部测量"""
+    rng = random.Random(seed)
+    tools = build_catalog(size, rng)
+    catalog = [{k: v for k, v in tool.items() if k != "_truth"} for tool in tools]
+    queries = build_queries(tools, query_count, rng)
+
+    index = ToolIndex()
+    started = time.perf_counter()
+    index.update(catalog)
+    build_ms = (time.perf_counter() - started) * 1000
+
+    # 增量更新：改动 1% 工具的描述并新增 1% 工具
+    changed = [dict(tool) for tool in catalog]
+    for tool in rng.sample(changed, max(1, size // 100)):
+        tool["description"] += " (v2)"
+    changed += [
+        {**tool, "name": f"extra{i}__{tool['name'].split('__', 1)[1]}"}
+        for i, tool in enumerate(rng.sample(catalog, max(1, size // 100)))
+    ]
+    started = time.perf_counter()
+    added, removed = index.update(changed)
+    update_ms = (time.perf_counter() - started) * 1000
+    index.update(catalog)
+
+    max_k = max(ks)
+    hits = {k: 0 for k in ks}
+    latencies = []
+    for text, answers in queries:
+        started = time.perf_counter()
+        ranked = [name for name, _ in index.search(text, max_k)]
+        latencies.append(time.perf_counter() - started)
+        for k in ks:
+            if answers & set(ranked[:k]):
+                hits[k] += 1
+
+    schema_bytes = {tool["name"]: len(json.dumps(tool, ensure_ascii=False)) for tool in catalog}
+    full_bytes = sum(schema_bytes.values())
+    mean_tool_bytes = full_bytes / len(catalog)
+    cuts = statistics.quantiles(latencies, n=100)
+    return {
+        "tools": size,
+        "queries": query_count,
+        "recall": {f"@{k}": round(hits[k] / query_count, 3) for k in ks},
+        "search_p50_us": round(cuts[49] * 1e6, 1),
+        "search_p99_us": round(cuts[98] * 1e6, 1),
+        "build_ms": round(build_ms, 2),
+        "update_ms": round(update_ms, 2),
+        "update_changes": added + removed,
+        "schema_kb_all": round(full_bytes / 1024, 1),
+        "schema_kb_top": {f"@{k}": round(min(k, size) * mean_tool_bytes / 1024, 1) for k in ks}
+    }
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="工具筛选索引的召回率与耗时基准")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[100, 500, 2000], help="目录规模")
+    parser.add_argument("--queries", type=int, default=1000, help="每个规模的查询数")
+    parser.add_argument("-k", type=int, nargs="+", default=[5, 10, 32], help="评估的 top-k")
+    parser.add_argument("--seed", type=int, default=7, help="随机种子")
+    parser.add_argument("--json", dest="json_path", help="同时把结果写入该 JSON 文件")
+    args = parser.parse_args()
+
+    ks = sorted(args.k)
+    results = [run(size, args.queries, ks, args.seed) for size in args.sizes]
+
+    recall_cols = "".join(f"{'R@' + str(k):>8}" for k in ks)
+    header = f"{'tools':>6}{recall_cols}{'p50 µs':>9}{'p99 µs':>9}{'build ms':>10}{'update ms':>11}{'schema KB':>11}{'@' + str(ks[-1]) + ' KB':>9}"
+    print(header)
+    print("-" * len(header))
+    for r in results:
+        recall = "".join(f"{r['recall'][f'@{k}']:>8}" for k in ks)
+        print(
+            f"{r['tools']:>6}{recall}{r['search_p50_us']:>9}{r['search_p99_us']:>9}"
+            f"{r['build_ms']:>10}{r['update_ms']:>11}{r['schema_kb_all']:>11}{r['schema_kb_top'][f'@{ks[-1]}']:>9}"
+        )
+    print("（update 为改动 1% 并新增 1% 工具后的增量更新耗时；schema KB 为发给 LLM 的工具定义体积）")
+
+    if args.json_path:
+        Path(args.json_path).write_text(json.dumps(results, indent=2, ensure_ascii=False), encoding="utf-8")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
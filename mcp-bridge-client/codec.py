@@ -0,0 +1,100 @@
+"""消息编解码模块 - bridge-client 与 bridge-server 之间的线路协议
+
+注册握手（register / registered）始终使用 JSON 文本帧，握手中协商后续编码：
+- json: JSON 文本帧（默认，兼容旧版本）
+- msgpack / orjson: 二进制帧，首字节为压缩标志，超过阈值的负载可用 zlib 压缩
+
+接收端按帧类型解码：文本帧总是 JSON，二进制帧使用协商好的编码。
+
+bridge-client 与 bridge-server 各有一份相同的副本（各自独立构建镜像），修改时两边同步，
+由 mcp-bridge-server/tests/test_wire_compat.py 校验互通。
+"""
+import json
+import zlib
+from typing import Any, List, Optional, Union
+
+try:
+    import msgpack
+except ImportError:  # 可选依赖
+    msgpack = None
+
+try:
+    import orjson
+except ImportError:  # 可选依赖
+    orjson = None
+
+COMPRESS_THRESHOLD = 16 * 1024  # 超过该字节数的二进制负载才压缩
+
+_FLAG_RAW = 0
+_FLAG_ZLIB = 1
+
+
+class CodecError(ValueError):
+    """消息解码失败"""
+
+
+def available_encodings() -> List[str]:
+    """本端支持的编码，按优先级排列"""
+    encodings = []
+    if msgpack is not None:
+        encodings.append("msgpack")
+    if orjson is not None:
+        encodings.append("orjson")
+    encodings.append("json")
+    return encodings
+
+
+def negotiate(offered: Optional[List[str]], compression: Optional[List[str]] = None) -> "Codec":
+    """根据对端提供的编码/压缩选项选出双方都支持的组合（对端未提供则为JSON）"""
+    supported = available_encodings()
+    encoding = next((e for e in offered or [] if e in supported), "json")
+    use_zlib = encoding != "json" and "zlib" in (compression or [])
+    return Codec(encoding, "zlib" if use_zlib else None)
+
+
+class Codec:
+    """一种编码 + 可选压缩的组合"""
+
+    def __init__(self, encoding: str = "json", compression: Optional[str] = None):
+        self.encoding = encoding
+        self.compression = compression
+
+    @property
+    def binary(self) -> bool:
+        """是否使用二进制帧"""
+        return self.encoding != "json"
+
+    def encode(self, data: Any) -> Union[str, bytes]:
+        """编码消息，JSON 返回 str（文本帧），其余返回 bytes（二进制帧）"""
+        if self.encoding == "msgpack":
+            body = msgpack.packb(data, use_bin_type=True)
+        elif self.encoding == "orjson":
+            body = orjson.dumps(data)
+        else:
+            return json.dumps(data)
+
+        if self.compression == "zlib" and len(body) >= COMPRESS_THRESHOLD:
+            return bytes([_FLAG_ZLIB]) + zlib.compress(body, 1)
+        return bytes([_FLAG_RAW]) + body
+
+    def decode(self, payload: Union[str, bytes]) -> Any:
+        """解码消息，文本帧总是按JSON解析"""
+        try:
+            if isinstance(payload, str):
+                return json.loads(payload)
+
+            body = memoryview(payload)[1:]
+            if payload[0] == _FLAG_ZLIB:
+                body = zlib.decompress(body)
+            if self.encoding == "msgpack":
+                return msgpack.unpackb(body, raw=False)
+            if self.encoding == "orjson":
+                return orjson.loads(body)
+            return json.loads(bytes(body))
+        except Exception as e:
+            # JSON/msgpack/zlib 的解码错误类型各不相同，统一包装
+            raise CodecError(str(e)) from e
+
+
+# 默认JSON编解码器（握手阶段及旧版本对端）
+JSON_CODEC = Codec()
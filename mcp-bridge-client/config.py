@@ -2,8 +2,8 @@
 import json
 import os
 from pathlib import Path
-from dataclasses import dataclass
-from typing import List
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional
 
 
 @dataclass
@@ -12,6 +12,14 @@ class ServerConfig:
     name: str
     command: str
     args: List[str]
+    max_concurrency: Optional[int] = None  # 该server的最大并发调用数，None表示不限制
+    cache_ttl: Dict[str, float] = field(default_factory=dict)  # tool_name -> 结果缓存TTL（秒）
+    coalesce: Dict[str, bool] = field(default_factory=dict)  # tool_name -> 是否允许合并相同的在途调用
+    startup_timeout: float = 30.0  # 启动（进程+initialize+list_tools）超时（秒）
+    lazy: bool = False  # 懒启动：有缓存的工具schema时先注册缓存，首次调用时才启动进程
+    replicas: int = 1  # 进程实例数下限
+    max_replicas: Optional[int] = None  # 进程实例数上限，None表示等于replicas（不伸缩）
+    idle_timeout: float = 60.0  # 多余实例空闲超过该时间（秒）后回收
 
 
 @dataclass
@@ -20,6 +28,12 @@ class Config:
     bridge_server_url: str
     client_id: str
     servers: List[ServerConfig]
+    max_concurrency: int = 64  # 全局最大并发调用数
+    ws_deflate: bool = True  # 是否启用WebSocket permessage-deflate（关闭时对大负载做应用层zlib压缩）
+    startup_wait: Optional[float] = None  # 首次注册前最多等待server启动的时间（秒），None表示等待全部
+    tool_cache_path: str = ".tool_cache.json"  # 工具schema缓存文件（供懒启动使用）
+    reconnect_max_delay: float = 30.0  # 断线重连的最大退避时间（秒）
+    metrics_port: Optional[int] = None  # 本地 Prometheus 指标端口，None表示不开启
 
 
 def load_config(config_path: str = "config.json") -> Config:
@@ -35,7 +49,15 @@ def load_config(config_path: str = "config.json") -> Config:
         ServerConfig(
             name=s["name"],
             command=s["command"],
-            args=s["args"]
+            args=s["args"],
+            max_concurrency=s.get("max_concurrency"),
+            cache_ttl=s.get("cache_ttl", {}),
+            coalesce=s.get("coalesce", {}),
+            startup_timeout=s.get("startup_timeout", 30.0),
+            lazy=s.get("lazy", False),
+            replicas=s.get("replicas", 1),
+            max_replicas=s.get("max_replicas"),
+            idle_timeout=s.get("idle_timeout", 60.0)
         )
         for s in data.get("servers", [])
     ]
@@ -43,9 +65,18 @@ def load_config(config_path: str = "config.json") -> Config:
     # 环境变量优先
     bridge_server_url = os.getenv("BRIDGE_SERVER_URL") or data["bridge_server_url"]
     client_id = os.getenv("CLIENT_ID") or data.get("client_id", "default-client")
+    max_concurrency = int(os.getenv("MAX_CONCURRENCY") or data.get("max_concurrency", 64))
+    ws_deflate = os.getenv("WS_DEFLATE", str(data.get("ws_deflate", True))).lower() in ("1", "true", "yes")
+    metrics_port = os.getenv("METRICS_PORT") or data.get("metrics_port")
     
     return Config(
         bridge_server_url=bridge_server_url,
         client_id=client_id,
-        servers=servers
+        servers=servers,
+        max_concurrency=max_concurrency,
+        ws_deflate=ws_deflate,
+        startup_wait=data.get("startup_wait"),
+        tool_cache_path=data.get("tool_cache_path", ".tool_cache.json"),
+        reconnect_max_delay=data.get("reconnect_max_delay", 30.0),
+        metrics_port=int(metrics_port) if metrics_port else None
     )
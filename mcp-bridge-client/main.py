@@ -6,6 +6,7 @@ from pathlib import Path
 
 from config import load_config
 from mcp_manager import MCPServerManager
+from metrics import start_metrics_server
 from ws_client import BridgeWSClient
 from router import RequestRouter
 
@@ -31,12 +32,12 @@ async def main():
         logger.info(f"创建sandbox目录: {sandbox_path.absolute()}")
     
     # 初始化MCP Server管理器
-    mcp_manager = MCPServerManager()
+    mcp_manager = MCPServerManager(tool_cache_path=config.tool_cache_path)
     router = RequestRouter(mcp_manager)
     
-    # 启动所有本地MCP Server
+    # 并发启动所有本地MCP Server（延迟就绪的server稍后增量注册）
     logger.info("启动本地MCP Server...")
-    await mcp_manager.start_all(config.servers)
+    await mcp_manager.start_all(config.servers, startup_wait=config.startup_wait)
     
     # 获取所有工具列表
     tools = mcp_manager.get_all_tools()
@@ -48,28 +49,32 @@ async def main():
     ws_client = BridgeWSClient(
         server_url=config.bridge_server_url,
         client_id=config.client_id,
-        on_call=router.route_call
+        on_call=router.route_call,
+        max_concurrency=config.max_concurrency,
+        ws_deflate=config.ws_deflate,
+        reconnect_max_delay=config.reconnect_max_delay
     )
     
-    # 连接到bridge-server
+    async def on_tools_changed():
+        """server延迟就绪或懒启动后工具有变化，重新注册完整工具列表"""
+        if ws_client.connected:
+            await ws_client.register_tools(mcp_manager.get_all_tools())
+    
+    mcp_manager.on_tools_changed = on_tools_changed
+    
+    # 可选：本地指标端口
+    start_metrics_server(config.metrics_port, mcp_manager, ws_client)
+    if config.metrics_port:
+        logger.info(f"指标端口: http://0.0.0.0:{config.metrics_port}/metrics")
+    
+    # 连接到bridge-server，断线后自动重连（本地MCP Server保持运行）
     try:
-        await ws_client.connect()
-        
-        # 注册工具
-        await ws_client.register_tools(tools)
-        
-        # 监听消息
-        logger.info("开始监听远程调用...")
-        await ws_client.listen()
-        
-    except Exception as e:
-        logger.error(f"连接错误: {e}")
+        await ws_client.run(mcp_manager.get_all_tools)
     finally:
         # 清理
         await ws_client.close()
         await mcp_manager.stop_all()
 
-
 if __name__ == "__main__":
     try:
         asyncio.run(main())
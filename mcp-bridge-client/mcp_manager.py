@@ -1,81 +1,217 @@
 """MCP Server进程管理模块"""
+import asyncio
+import json
 import logging
-from typing import Dict, Any, List, Optional
-from contextlib import AsyncExitStack
+import time
+from contextlib import nullcontext
+from pathlib import Path
+from typing import Dict, Any, AsyncContextManager, Awaitable, Callable, List, Optional
 
-from mcp import ClientSession
+from mcp import ClientSession, types
 from mcp.client.stdio import stdio_client, StdioServerParameters
 
 from config import ServerConfig
+from metrics import observe_mcp_call
+from server_pool import ServerPool
+from tracing import span
 
 logger = logging.getLogger(__name__)
 
+_request_id_warned = False
+
 
 class MCPServerManager:
     """管理多个本地MCP Server进程"""
     
-    def __init__(self):
-        self.sessions: Dict[str, ClientSession] = {}
+    def __init__(self, tool_cache_path: Optional[str] = None):
+        self.pools: Dict[str, ServerPool] = {}  # server_name -> 进程池
         self.tools: Dict[str, Dict[str, Any]] = {}  # server_name -> {tool_name: tool_schema}
-        self._exit_stack: Optional[AsyncExitStack] = None
+        self._limits: Dict[str, asyncio.Semaphore] = {}  # server_name -> 并发限制
+        self._cache_ttl: Dict[str, Dict[str, float]] = {}  # server_name -> {tool_name: 缓存TTL}
+        self._coalesce: Dict[str, Dict[str, bool]] = {}  # server_name -> {tool_name: 是否可合并}
+        self._configs: Dict[str, ServerConfig] = {}
+        self._starting: Dict[str, asyncio.Task] = {}  # server_name -> 启动任务
+        self._initial_done = False
+        self.tool_cache_path = tool_cache_path
+        # 首次注册之后工具列表发生变化（server延迟就绪、懒启动）时的回调
+        self.on_tools_changed: Optional[Callable[[], Awaitable[None]]] = None
     
-    async def start_server(self, config: ServerConfig) -> None:
-        """启动单个MCP Server"""
-        logger.info(f"启动MCP Server: {config.name}")
+    async def _run_server(self, config: ServerConfig, ready: asyncio.Future, stop: asyncio.Event) -> None:
+        """单个MCP Server进程实例的生命周期任务：启动、初始化，然后保持运行直到 stop 被设置
         
+        stdio_client/ClientSession 的上下文必须在同一任务中进入和退出，因此每个实例独占一个任务。
+        """
         server_params = StdioServerParameters(
             command=config.command,
             args=config.args
         )
         
-        # 使用stdio_client连接MCP Server
-        stdio_transport = await self._exit_stack.enter_async_context(
-            stdio_client(server_params)
-        )
-        read_stream, write_stream = stdio_transport
+        try:
+            # 使用stdio_client连接MCP Server
+            async with stdio_client(server_params) as (read_stream, write_stream):
+                async with ClientSession(read_stream, write_stream) as session:
+                    # 初始化会话
+                    await session.initialize()
+                    
+                    # 获取工具列表
+                    tools_response = await session.list_tools()
+                    tools = {
+                        tool.name: {
+                            "name": tool.name,
+                            "description": tool.description,
+                            "inputSchema": tool.inputSchema,
+                            "annotations": self._dump_annotations(tool)
+                        }
+                        for tool in tools_response.tools
+                    }
+                    ready.set_result((session, tools))
+                    
+                    await stop.wait()
+        except Exception as e:
+            if not ready.done():
+                ready.set_exception(e)
+            else:
+                logger.error(f"MCP Server {config.name} 实例异常退出: {e}")
+    
+    async def start_server(self, config: ServerConfig) -> None:
+        """启动单个MCP Server（replicas 个进程实例），超过 startup_timeout 则终止"""
+        logger.info(f"启动MCP Server: {config.name}")
         
-        session = await self._exit_stack.enter_async_context(
-            ClientSession(read_stream, write_stream)
+        pool = ServerPool(
+            name=config.name,
+            run=lambda ready, stop: self._run_server(config, ready, stop),
+            min_size=config.replicas,
+            max_size=config.max_replicas or config.replicas,
+            startup_timeout=config.startup_timeout,
+            idle_timeout=config.idle_timeout
         )
+        await pool.start()
+        self.pools[config.name] = pool
+        self.tools[config.name] = pool.tools
         
-        # 初始化会话
-        await session.initialize()
-        
-        # 获取工具列表
-        tools_response = await session.list_tools()
-        
-        self.sessions[config.name] = session
-        self.tools[config.name] = {
-            tool.name: {
-                "name": tool.name,
-                "description": tool.description,
-                "inputSchema": tool.inputSchema
-            }
-            for tool in tools_response.tools
-        }
-        
-        logger.info(f"MCP Server {config.name} 启动成功，工具数: {len(self.tools[config.name])}")
+        self._save_tool_cache(config.name)
+        logger.info(
+            f"MCP Server {config.name} 启动成功，工具数: {len(self.tools[config.name])}，"
+            f"实例数: {len(pool.instances)}（上限 {pool.max_size}）"
+        )
     
-    async def start_all(self, configs: List[ServerConfig]) -> None:
-        """启动所有配置的MCP Server"""
-        self._exit_stack = AsyncExitStack()
-        await self._exit_stack.__aenter__()
-        
-        for config in configs:
+    def _apply_config(self, config: ServerConfig) -> None:
+        """记录server配置及其并发/缓存/合并策略"""
+        self._configs[config.name] = config
+        if config.max_concurrency:
+            self._limits[config.name] = asyncio.Semaphore(config.max_concurrency)
+        self._cache_ttl[config.name] = config.cache_ttl
+        self._coalesce[config.name] = config.coalesce
+    
+    async def _start_and_notify(self, config: ServerConfig) -> None:
+        """启动server；若首次注册已完成，则通知工具列表变化"""
+        try:
+            await self.start_server(config)
+        except asyncio.TimeoutError:
+            logger.error(f"启动MCP Server {config.name} 超时（{config.startup_timeout}s）")
+            return
+        except Exception as e:
+            logger.error(f"启动MCP Server {config.name} 失败: {e}")
+            return
+        await self._notify_tools_changed()
+    
+    async def _notify_tools_changed(self) -> None:
+        """首次注册之后的工具变化通知"""
+        if self._initial_done and self.on_tools_changed:
             try:
-                await self.start_server(config)
+                await self.on_tools_changed()
             except Exception as e:
-                logger.error(f"启动MCP Server {config.name} 失败: {e}")
+                logger.error(f"工具列表更新通知失败: {e}")
+    
+    async def start_all(self, configs: List[ServerConfig], startup_wait: Optional[float] = None) -> None:
+        """并发启动所有配置的MCP Server
+        
+        lazy 且有缓存schema的server只登记缓存的工具，首次调用时再启动。
+        最多等待 startup_wait 秒（None表示等待全部）后返回，之后就绪的server通过 on_tools_changed 增量通知。
+        """
+        self._initial_done = False
+        cached_tools = self._load_tool_cache()
+        
+        pending = []
+        for config in configs:
+            self._apply_config(config)
+            if config.lazy and config.name in cached_tools:
+                self.tools[config.name] = cached_tools[config.name]
+                logger.info(f"MCP Server {config.name} 懒启动，使用缓存的工具schema: {len(self.tools[config.name])} 个")
+                continue
+            pending.append(asyncio.create_task(self._start_and_notify(config)))
+        
+        if pending:
+            await asyncio.wait(pending, timeout=startup_wait)
+        self._initial_done = True
     
     async def stop_all(self) -> None:
         """停止所有MCP Server"""
-        if self._exit_stack:
-            await self._exit_stack.aclose()
-            self._exit_stack = None
-        self.sessions.clear()
+        pools = list(self.pools.values())
+        if pools:
+            await asyncio.gather(*(pool.stop() for pool in pools), return_exceptions=True)
+        self.pools.clear()
         self.tools.clear()
+        self._limits.clear()
+        self._cache_ttl.clear()
+        self._coalesce.clear()
+        self._configs.clear()
         logger.info("所有MCP Server已停止")
     
+    def has_server(self, server_name: str) -> bool:
+        """是否存在该server（已启动，或懒启动尚未启动）"""
+        return server_name in self.tools
+    
+    async def _ensure_started(self, server_name: str) -> ServerPool:
+        """懒启动的server（或全部实例已退出的server）在调用时启动"""
+        pool = self.pools.get(server_name)
+        if pool and pool.instances:
+            return pool
+        if server_name not in self._configs:
+            raise ValueError(f"未知的MCP Server: {server_name}")
+        
+        starting = self._starting.get(server_name)
+        if starting is None:
+            # 并发的首次调用共享同一个启动任务
+            starting = asyncio.create_task(self._start_lazy(server_name))
+            self._starting[server_name] = starting
+            starting.add_done_callback(lambda _: self._starting.pop(server_name, None))
+        await asyncio.shield(starting)
+        return self.pools[server_name]
+    
+    async def _start_lazy(self, server_name: str) -> None:
+        """按需启动server，工具与缓存不一致时重新注册"""
+        cached = self.tools.get(server_name)
+        await self.start_server(self._configs[server_name])
+        if self.tools.get(server_name) != cached:
+            await self._notify_tools_changed()
+    
+    def _load_tool_cache(self) -> Dict[str, Dict[str, Any]]:
+        """读取工具schema缓存"""
+        if not self.tool_cache_path:
+            return {}
+        path = Path(self.tool_cache_path)
+        if not path.exists():
+            return {}
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError) as e:
+            logger.warning(f"读取工具缓存失败: {e}")
+            return {}
+    
+    def _save_tool_cache(self, server_name: str) -> None:
+        """将server的工具schema写入缓存"""
+        if not self.tool_cache_path:
+            return
+        cache = self._load_tool_cache()
+        cache[server_name] = self.tools[server_name]
+        try:
+            with open(self.tool_cache_path, "w", encoding="utf-8") as f:
+                json.dump(cache, f, ensure_ascii=False, indent=2)
+        except OSError as e:
+            logger.warning(f"写入工具缓存失败: {e}")
+    
     def get_all_tools(self) -> List[Dict[str, Any]]:
         """获取所有已注册的工具列表（带server前缀）"""
         all_tools = []
@@ -83,20 +219,112 @@ class MCPServerManager:
             for tool_name, tool_schema in tools.items():
                 # 添加server前缀，格式: server__tool
                 prefixed_name = f"{server_name}__{tool_name}"
-                all_tools.append({
+                tool_info = {
                     "name": prefixed_name,
                     "description": tool_schema.get("description", ""),
                     "inputSchema": tool_schema.get("inputSchema", {}),
                     "_server": server_name,
                     "_original_name": tool_name
-                })
+                }
+                if tool_schema.get("annotations"):
+                    tool_info["annotations"] = tool_schema["annotations"]
+                # 配置中声明的缓存/合并策略，由bridge-server据此处理
+                ttl = self._cache_ttl.get(server_name, {}).get(tool_name)
+                if ttl is not None:
+                    tool_info["cache"] = {"ttl": ttl}
+                coalesce = self._coalesce.get(server_name, {}).get(tool_name)
+                if coalesce is not None:
+                    tool_info["coalesce"] = coalesce
+                all_tools.append(tool_info)
         return all_tools
     
-    async def call_tool(self, server_name: str, tool_name: str, arguments: Dict[str, Any]) -> Any:
-        """调用指定server的工具"""
-        if server_name not in self.sessions:
-            raise ValueError(f"未知的MCP Server: {server_name}")
+    @staticmethod
+    def _dump_annotations(tool: Any) -> Optional[Dict[str, Any]]:
+        """提取MCP工具注解（readOnlyHint等），旧版本SDK没有该字段"""
+        annotations = getattr(tool, "annotations", None)
+        if annotations is None:
+            return None
+        return annotations.model_dump(exclude_none=True)
+    
+    async def call_tool(
+        self,
+        server_name: str,
+        tool_name: str,
+        arguments: Dict[str, Any],
+        progress_callback: Optional[Callable] = None,
+        call_slot: Optional[AsyncContextManager] = None
+    ) -> Any:
+        """调用指定server的工具，progress_callback 接收MCP进度通知
         
-        session = self.sessions[server_name]
-        result = await session.call_tool(tool_name, arguments)
-        return result
+        call_slot 为调用方的全局并发名额，在懒启动和按server排队之后才获取。
+        """
+        if not self.has_server(server_name):
+            raise ValueError(f"未知的MCP Server: {server_name}")
+        # 开启追踪时记录本地MCP调用耗时（含懒启动、按server排队）
+        with span("mcp.call_tool", server=server_name, tool=tool_name):
+            pool = await self._ensure_started(server_name)
+            started = time.monotonic()
+            ok = False
+            try:
+                result = await self._call_limited(server_name, pool, tool_name, arguments, progress_callback, call_slot)
+                ok = not getattr(result, "isError", False)
+                return result
+            finally:
+                observe_mcp_call(server_name, time.monotonic() - started, ok)
+    
+    async def _call_limited(
+        self,
+        server_name: str,
+        pool: ServerPool,
+        tool_name: str,
+        arguments: Dict[str, Any],
+        progress_callback: Optional[Callable],
+        call_slot: Optional[AsyncContextManager]
+    ) -> Any:
+        """按server并发限制调用，取得server名额后再占用全局名额"""
+        # 仅在需要时传递progress_callback，兼容不支持该参数的旧版本SDK
+        kwargs = {"progress_callback": progress_callback} if progress_callback else {}
+        # 按server限制并发，避免单个stdio进程被压垮
+        limit = self._limits.get(server_name) or nullcontext()
+        async with limit:
+            async with call_slot or nullcontext():
+                return await self._call_on_pool(pool, tool_name, arguments, kwargs)
+    
+    @staticmethod
+    async def _call_on_pool(pool: ServerPool, tool_name: str, arguments: Dict[str, Any], kwargs: Dict[str, Any]) -> Any:
+        """分派到池中最空闲的实例执行"""
+        session = pool.acquire()
+        # SDK 在 call_tool 首次挂起前就分配请求ID（递增计数器），先记下以便取消时通知MCP Server。
+        # 依赖私有属性，已在 requirements.txt 固定的 mcp 1.x 范围内验证
+        request_id = getattr(session, "_request_id", None)
+        if not isinstance(request_id, int):
+            _warn_no_request_id()
+            request_id = None
+        try:
+            return await session.call_tool(tool_name, arguments, **kwargs)
+        except asyncio.CancelledError:
+            if request_id is not None:
+                await _notify_cancelled(session, request_id, f"调用已取消: {tool_name}")
+            raise
+        finally:
+            pool.release(session)
+
+
+def _warn_no_request_id() -> None:
+    """SDK 不再提供 _request_id 时告警一次：取消的调用将无法通知MCP Server"""
+    global _request_id_warned
+    if not _request_id_warned:
+        _request_id_warned = True
+        logger.warning("当前 mcp SDK 的 ClientSession 没有 _request_id，取消调用时不会发送 notifications/cancelled")
+
+
+async def _notify_cancelled(session: ClientSession, request_id: int, reason: str) -> None:
+    """向MCP Server发送 notifications/cancelled，让其停止执行该请求（尽力而为）"""
+    notification = types.ClientNotification(types.CancelledNotification(
+        method="notifications/cancelled",
+        params=types.CancelledNotificationParams(requestId=request_id, reason=reason)
+    ))
+    try:
+        await asyncio.wait_for(session.send_notification(notification), timeout=1.0)
+    except Exception as e:
+        logger.debug(f"发送取消通知失败: {e}")
@@ -0,0 +1,79 @@
+"""指标模块 - Prometheus 格式的运行指标（可选，通过 metrics_port 开启本地端口）
+
+热路径上只做预绑定标签的计数/观测；进程池实例数、待补发结果等状态量在抓取时读取。
+"""
+from typing import Any, Iterator, Optional
+
+from prometheus_client import REGISTRY, Counter, Histogram, start_http_server
+from prometheus_client.core import GaugeMetricFamily
+from prometheus_client.registry import Collector
+
+# MCP调用耗时分桶（秒）
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+MCP_CALL_SECONDS = Histogram(
+    "bridge_client_mcp_call_duration_seconds",
+    "本地MCP Server的工具调用耗时",
+    ["server"],
+    buckets=LATENCY_BUCKETS
+)
+MCP_CALLS = Counter(
+    "bridge_client_mcp_calls_total",
+    "本地MCP Server的工具调用次数（按结果：ok / error）",
+    ["server", "outcome"]
+)
+WS_FRAMES = Counter("bridge_client_ws_frames_total", "WebSocket帧数", ["direction"])
+WS_BYTES = Counter("bridge_client_ws_bytes_total", "WebSocket负载字节数", ["direction"])
+
+# 预绑定标签，避免每帧查找子指标
+_FRAMES_IN = WS_FRAMES.labels("in")
+_FRAMES_OUT = WS_FRAMES.labels("out")
+_BYTES_IN = WS_BYTES.labels("in")
+_BYTES_OUT = WS_BYTES.labels("out")
+
+
+def observe_mcp_call(server: str, elapsed: float, ok: bool) -> None:
+    """记录一次本地MCP调用"""
+    MCP_CALL_SECONDS.labels(server).observe(elapsed)
+    MCP_CALLS.labels(server, "ok" if ok else "error").inc()
+
+
+def observe_frame_in(payload) -> None:
+    """记录收到的一帧（str 按字符数近似字节数）"""
+    _FRAMES_IN.inc()
+    _BYTES_IN.inc(len(payload))
+
+
+def observe_frame_out(payload) -> None:
+    """记录发出的一帧"""
+    _FRAMES_OUT.inc()
+    _BYTES_OUT.inc(len(payload))
+
+
+class ClientCollector(Collector):
+    """抓取时读取进程池与WebSocket客户端的状态量"""
+
+    def __init__(self, manager: Any, ws_client: Any):
+        self.manager = manager
+        self.ws_client = ws_client
+
+    def collect(self) -> Iterator:
+        instances = GaugeMetricFamily("bridge_client_pool_instances", "MCP Server进程实例数", labels=["server"])
+        inflight = GaugeMetricFamily("bridge_client_pool_inflight", "MCP Server的在途调用数", labels=["server"])
+        for name, pool in list(self.manager.pools.items()):
+            instances.add_metric([name], len(pool.instances))
+            inflight.add_metric([name], sum(i.inflight for i in pool.instances))
+        yield instances
+        yield inflight
+
+        yield GaugeMetricFamily("bridge_client_connected", "是否已连接bridge-server", value=1 if self.ws_client.connected else 0)
+        yield GaugeMetricFamily("bridge_client_calls_pending", "执行中或结果尚未送达的调用数", value=self.ws_client.pending_calls)
+        yield GaugeMetricFamily("bridge_client_outbox", "断线期间待补发的结果消息数", value=self.ws_client.outbox_size)
+
+
+def start_metrics_server(port: Optional[int], manager: Any, ws_client: Any) -> None:
+    """在本地端口上暴露 /metrics（port 为空则不开启）"""
+    if not port:
+        return
+    REGISTRY.register(ClientCollector(manager, ws_client))
+    start_http_server(port)
@@ -1,6 +1,6 @@
 """请求路由模块 - 将远程调用路由到正确的本地MCP Server"""
 import logging
-from typing import Dict, Any
+from typing import Dict, Any, AsyncContextManager, Callable, Optional
 
 from mcp_manager import MCPServerManager
 
@@ -13,12 +13,19 @@ class RequestRouter:
     def __init__(self, mcp_manager: MCPServerManager):
         self.mcp_manager = mcp_manager
     
-    async def route_call(self, server: str, method: str, args: Dict[str, Any]) -> Any:
+    async def route_call(
+        self,
+        server: str,
+        method: str,
+        args: Dict[str, Any],
+        progress_callback: Optional[Callable] = None,
+        call_slot: Optional[AsyncContextManager] = None
+    ) -> Any:
         """路由工具调用到对应的MCP Server"""
         logger.debug(f"路由调用: {server}/{method}")
         
-        if server not in self.mcp_manager.sessions:
+        if not self.mcp_manager.has_server(server):
             raise ValueError(f"未知的MCP Server: {server}")
         
-        result = await self.mcp_manager.call_tool(server, method, args)
+        result = await self.mcp_manager.call_tool(server, method, args, progress_callback, call_slot)
         return result
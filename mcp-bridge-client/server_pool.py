@@ -0,0 +1,151 @@
+"""进程池模块 - 同一MCP Server配置的多个stdio进程实例"""
+import asyncio
+import logging
+import time
+from typing import Any, Awaitable, Callable, List, Optional, Set
+
+from mcp import ClientSession
+
+logger = logging.getLogger(__name__)
+
+# 实例生命周期函数: run(ready, stop)，就绪时 ready.set_result((session, tools))，stop 被设置后退出
+RunInstance = Callable[[asyncio.Future, asyncio.Event], Awaitable[None]]
+
+
+class _Instance:
+    """一个进程实例"""
+
+    def __init__(self, session: ClientSession, task: asyncio.Task, stop: asyncio.Event):
+        self.session = session
+        self.task = task
+        self.stop = stop
+        self.inflight = 0
+        self.idle_since = time.monotonic()
+
+
+class ServerPool:
+    """进程池：调用分派到在途请求最少的实例，并按排队深度在 [min_size, max_size] 之间伸缩
+
+    - 所有实例都有在途请求且未达上限时，后台启动新实例（当前调用仍分派到最空闲的实例）
+    - 实例空闲超过 idle_timeout 且数量多于 min_size 时停止该实例
+    """
+
+    def __init__(
+        self,
+        name: str,
+        run: RunInstance,
+        min_size: int = 1,
+        max_size: int = 1,
+        startup_timeout: float = 30.0,
+        idle_timeout: float = 60.0
+    ):
+        self.name = name
+        self.min_size = max(1, min_size)
+        self.max_size = max(self.min_size, max_size)
+        self.startup_timeout = startup_timeout
+        self.idle_timeout = idle_timeout
+        self.instances: List[_Instance] = []
+        self.tools: Optional[Any] = None  # 首个实例报告的工具列表
+        self._run = run
+        self._spawning = 0
+        self._closed = False
+        self._background: Set[asyncio.Task] = set()  # 后台扩容任务
+
+    @property
+    def size(self) -> int:
+        """当前实例数（含启动中）"""
+        return len(self.instances) + self._spawning
+
+    async def start(self) -> None:
+        """并发启动 min_size 个实例，至少一个成功即可"""
+        results = await asyncio.gather(
+            *(self._spawn() for _ in range(self.min_size)),
+            return_exceptions=True
+        )
+        if not self.instances:
+            raise next(r for r in results if isinstance(r, BaseException))
+        for r in results:
+            if isinstance(r, BaseException):
+                logger.warning(f"MCP Server {self.name} 部分实例启动失败: {r}")
+
+    async def _spawn(self) -> _Instance:
+        """启动一个实例，超过 startup_timeout 则终止"""
+        self._spawning += 1
+        ready = asyncio.get_running_loop().create_future()
+        stop = asyncio.Event()
+        task = asyncio.create_task(self._run(ready, stop))
+        try:
+            session, tools = await asyncio.wait_for(asyncio.shield(ready), timeout=self.startup_timeout)
+        except BaseException:
+            task.cancel()
+            raise
+        finally:
+            self._spawning -= 1
+
+        instance = _Instance(session, task, stop)
+        if self.tools is None:
+            self.tools = tools
+        self.instances.append(instance)
+        task.add_done_callback(lambda _: self._on_exit(instance))
+        if self._closed:
+            stop.set()
+        return instance
+
+    def _on_exit(self, instance: _Instance) -> None:
+        """实例退出（正常停止或异常）后移出池"""
+        if instance in self.instances:
+            self.instances.remove(instance)
+
+    def acquire(self) -> ClientSession:
+        """选择在途请求最少的实例；全部繁忙时触发扩容"""
+        if not self.instances:
+            raise RuntimeError(f"MCP Server {self.name} 没有可用实例")
+
+        instance = min(self.instances, key=lambda i: i.inflight)
+        if instance.inflight > 0 and self.size < self.max_size:
+            # 排队深度 > 0：后台扩容，当前调用不等待新实例
+            task = asyncio.create_task(self._scale_up())
+            self._background.add(task)
+            task.add_done_callback(self._background.discard)
+        instance.inflight += 1
+        return instance.session
+
+    def release(self, session: ClientSession) -> None:
+        """调用结束，空闲实例在超时后可能被回收"""
+        for instance in self.instances:
+            if instance.session is session:
+                instance.inflight -= 1
+                if instance.inflight == 0:
+                    instance.idle_since = time.monotonic()
+                    if len(self.instances) > self.min_size:
+                        asyncio.get_running_loop().call_later(self.idle_timeout, self._scale_down)
+                return
+
+    async def _scale_up(self) -> None:
+        """扩容一个实例"""
+        try:
+            await self._spawn()
+            logger.info(f"MCP Server {self.name} 扩容，实例数: {len(self.instances)}")
+        except Exception as e:
+            logger.warning(f"MCP Server {self.name} 扩容失败: {e}")
+
+    def _scale_down(self) -> None:
+        """回收空闲超时的实例，保留至少 min_size 个"""
+        now = time.monotonic()
+        for instance in list(self.instances):
+            if len(self.instances) <= self.min_size:
+                return
+            if instance.inflight == 0 and now - instance.idle_since >= self.idle_timeout:
+                self.instances.remove(instance)
+                instance.stop.set()
+                logger.info(f"MCP Server {self.name} 缩容，实例数: {len(self.instances)}")
+
+    async def stop(self) -> None:
+        """停止所有实例"""
+        self._closed = True
+        tasks = [instance.task for instance in self.instances]
+        for instance in self.instances:
+            instance.stop.set()
+        if tasks:
+            await asyncio.gather(*tasks, return_exceptions=True)
+        self.instances.clear()
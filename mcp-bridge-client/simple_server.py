@@ -36,7 +36,8 @@ async def handle_request(request):
                                 "message": {"type": "string", "description": "Message to echo"}
                             },
                             "required": ["message"]
-                        }
+                        },
+                        "annotations": {"readOnlyHint": True, "idempotentHint": True}
                     },
                     {
                         "name": "get_time",
@@ -44,7 +45,8 @@ async def handle_request(request):
                         "inputSchema": {
                             "type": "object",
                             "properties": {}
-                        }
+                        },
+                        "annotations": {"readOnlyHint": True, "idempotentHint": False}
                     }
                 ]
             }
@@ -83,7 +85,7 @@ async def handle_request(request):
 
 async def main():
     """主循环 - 从stdin读取请求，写响应到stdout"""
-    reader = asyncio.StreamReader()
+    reader = asyncio.StreamReader(limit=64 * 1024 * 1024)
     protocol = asyncio.StreamReaderProtocol(reader)
     await asyncio.get_event_loop().connect_read_pipe(lambda: protocol, sys.stdin)
     
@@ -92,37 +94,29 @@ async def main():
     )
     writer = asyncio.StreamWriter(writer_transport, writer_protocol, reader, asyncio.get_event_loop())
     
-    buffer = ""
-    
     while True:
         try:
-            chunk = await reader.read(4096)
-            if not chunk:
+            # 按行读取JSON-RPC消息
+            line = await reader.readline()
+            if not line:
                 break
+            line = line.strip()
+            if not line:
+                continue
             
-            buffer += chunk.decode()
-            
-            # 尝试解析JSON-RPC消息
-            while "\n" in buffer:
-                line, buffer = buffer.split("\n", 1)
-                line = line.strip()
-                if not line:
-                    continue
-                
-                try:
-                    request = json.loads(line)
-                    response = await handle_request(request)
-                    if response:
-                        response_str = json.dumps(response) + "\n"
-                        writer.write(response_str.encode())
-                        await writer.drain()
-                except json.JSONDecodeError:
-                    pass
+            try:
+                request = json.loads(line)
+                response = await handle_request(request)
+                if response:
+                    response_str = json.dumps(response) + "\n"
+                    writer.write(response_str.encode())
+                    await writer.drain()
+            except json.JSONDecodeError:
+                pass
                     
         except Exception as e:
             sys.stderr.write(f"Error: {e}\n")
             break
 
-
 if __name__ == "__main__":
     asyncio.run(main())
@@ -0,0 +1,277 @@
+"""合成负载 MCP Server - 用于基准测试与浸泡测试
+
+工具行为可配置：延迟分布、CPU 消耗、输出大小（文本 / 图片 / 二进制资源）、失败率、进度通知。
+请求并发处理（每个 tools/call 一个任务），按行读取 JSON-RPC 消息，自身不会成为瓶颈。
+
+用法:
+    python synthetic_server.py                       # 使用内置工具集
+    python synthetic_server.py --config tools.json   # 从文件加载工具定义
+    python synthetic_server.py --seed 42             # 固定随机种子
+
+工具定义（JSON 列表，字段均可省略）:
+    {
+      "name": "search",
+      "description": "...",
+      "latency": {"dist": "lognormal", "mean_ms": 80, "sigma": 0.5},  # fixed / uniform / exponential / lognormal
+      "cpu_ms": 5,              # 每次调用的 CPU 消耗（毫秒）
+      "output_bytes": 2048,     # 输出大小
+      "output_type": "text",    # text / image / blob
+      "failure_rate": 0.01,     # 返回 isError 的概率
+      "progress_steps": 0       # 调用方提供 progressToken 时发送的进度通知数
+    }
+
+调用参数可覆盖同名字段（latency_ms 直接指定本次延迟），echo 工具原样返回 message。
+"""
+import argparse
+import asyncio
+import base64
+import hashlib
+import json
+import math
+import os
+import random
+import sys
+import time
+from typing import Dict, Any, Optional
+
+# 单行消息上限（大参数也按一行传输）
+MAX_LINE = 64 * 1024 * 1024
+
+DEFAULT_TOOLS = [
+    {"name": "echo", "description": "Echo back the input message"},
+    {"name": "sleep", "description": "Wait for a sampled latency", "latency": {"dist": "lognormal", "mean_ms": 50, "sigma": 0.5}},
+    {"name": "cpu", "description": "Burn CPU for cpu_ms milliseconds", "cpu_ms": 10},
+    {"name": "payload", "description": "Return output_bytes of text", "output_bytes": 64 * 1024},
+    {"name": "image", "description": "Return an image of output_bytes", "output_bytes": 256 * 1024, "output_type": "image"},
+    {"name": "flaky", "description": "Fail with failure_rate", "failure_rate": 0.1, "latency": {"dist": "fixed", "mean_ms": 5}},
+    {
+        "name": "progress",
+        "description": "Report progress while working",
+        "progress_steps": 10,
+        "latency": {"dist": "fixed", "mean_ms": 500}
+    },
+]
+
+# 可由调用参数覆盖的字段
+_OVERRIDABLE = ("cpu_ms", "output_bytes", "output_type", "failure_rate", "progress_steps")
+
+
+def _input_schema() -> Dict[str, Any]:
+    """所有合成工具共用的参数schema"""
+    return {
+        "type": "object",
+        "properties": {
+            "message": {"type": "string", "description": "Message to echo"},
+            "latency_ms": {"type": "number", "description": "Override sampled latency"},
+            "cpu_ms": {"type": "number"},
+            "output_bytes": {"type": "integer"},
+            "output_type": {"type": "string", "enum": ["text", "image", "blob"]},
+            "failure_rate": {"type": "number"},
+            "progress_steps": {"type": "integer"}
+        }
+    }
+
+
+class SyntheticServer:
+    """按工具定义模拟负载的 stdio MCP Server"""
+
+    def __init__(self, tools: list, seed: Optional[int] = None):
+        self.tools = {tool["name"]: tool for tool in tools}
+        self.random = random.Random(seed)
+        self._writer: Optional[asyncio.StreamWriter] = None
+        self._write_lock = asyncio.Lock()
+        self._tasks: Dict[Any, asyncio.Task] = {}  # 请求id -> 执行中的tools/call
+        self._payloads: Dict[tuple, Any] = {}  # (类型, 大小) -> 预生成的输出
+        self._burn_block = os.urandom(64 * 1024)
+
+    async def serve(self) -> None:
+        """主循环：从stdin按行读取请求，tools/call 并发执行"""
+        loop = asyncio.get_running_loop()
+        reader = asyncio.StreamReader(limit=MAX_LINE)
+        await loop.connect_read_pipe(lambda: asyncio.StreamReaderProtocol(reader), sys.stdin)
+        transport, protocol = await loop.connect_write_pipe(asyncio.streams.FlowControlMixin, sys.stdout)
+        self._writer = asyncio.StreamWriter(transport, protocol, reader, loop)
+
+        while True:
+            line = await reader.readline()
+            if not line:
+                break
+            if not line.strip():
+                continue
+            try:
+                request = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            await self._dispatch(request)
+
+        for task in list(self._tasks.values()):
+            task.cancel()
+
+    async def _dispatch(self, request: Dict[str, Any]) -> None:
+        """处理一条消息；tools/call 交给独立任务，其余同步应答"""
+        method = request.get("method")
+        req_id = request.get("id")
+
+        if method == "tools/call":
+            task = asyncio.create_task(self._call(req_id, request.get("params") or {}))
+            self._tasks[req_id] = task
+            task.add_done_callback(lambda _: self._tasks.pop(req_id, None))
+        elif method == "notifications/cancelled":
+            task = self._tasks.get((request.get("params") or {}).get("requestId"))
+            if task:
+                task.cancel()
+        elif method == "initialize":
+            await self._send({
+                "jsonrpc": "2.0",
+                "id": req_id,
+                "result": {
+                    "protocolVersion": "2024-11-05",
+                    "capabilities": {"tools": {}},
+                    "serverInfo": {"name": "synthetic-server", "version": "1.0.0"}
+                }
+            })
+        elif method == "tools/list":
+            await self._send({
+                "jsonrpc": "2.0",
+                "id": req_id,
+                "result": {
+                    "tools": [
+                        {
+                            "name": tool["name"],
+                            "description": tool.get("description", ""),
+                            "inputSchema": _input_schema(),
+                            "annotations": {"readOnlyHint": True, "idempotentHint": tool.get("failure_rate", 0) == 0}
+                        }
+                        for tool in self.tools.values()
+                    ]
+                }
+            })
+        elif method == "ping":
+            await self._send({"jsonrpc": "2.0", "id": req_id, "result": {}})
+        elif req_id is not None:
+            await self._send({
+                "jsonrpc": "2.0",
+                "id": req_id,
+                "error": {"code": -32601, "message": f"Method not found: {method}"}
+            })
+
+    async def _call(self, req_id: Any, params: Dict[str, Any]) -> None:
+        """执行一次合成工具调用"""
+        name = params.get("name")
+        args = params.get("arguments") or {}
+        tool = self.tools.get(name)
+        if tool is None:
+            await self._send({"jsonrpc": "2.0", "id": req_id, "error": {"code": -32602, "message": f"Unknown tool: {name}"}})
+            return
+
+        spec = {**tool, **{key: args[key] for key in _OVERRIDABLE if key in args}}
+        try:
+            latency = float(args["latency_ms"]) / 1000 if "latency_ms" in args else self._sample_latency(spec.get("latency"))
+            progress_token = (params.get("_meta") or {}).get("progressToken")
+            steps = int(spec.get("progress_steps", 0)) if progress_token is not None else 0
+            cpu = float(spec.get("cpu_ms") or 0) / 1000
+            failure_rate = float(spec.get("failure_rate", 0))
+            output_type = str(spec.get("output_type", "text"))
+            output_bytes = int(spec.get("output_bytes", 0))
+            if output_bytes < 0:
+                raise ValueError(f"output_bytes must be >= 0: {output_bytes}")
+        except (TypeError, ValueError, AttributeError) as e:
+            await self._send({"jsonrpc": "2.0", "id": req_id, "error": {"code": -32602, "message": f"Invalid arguments: {e}"}})
+            return
+
+        try:
+            if steps:
+                for step in range(1, steps + 1):
+                    await asyncio.sleep(latency / steps)
+                    await self._send({
+                        "jsonrpc": "2.0",
+                        "method": "notifications/progress",
+                        "params": {"progressToken": progress_token, "progress": step, "total": steps}
+                    })
+            elif latency > 0:
+                await asyncio.sleep(latency)
+
+            if cpu > 0:
+                await self._burn(cpu)
+        except asyncio.CancelledError:
+            # 调用方已取消，按MCP约定不再响应
+            return
+
+        if self.random.random() < failure_rate:
+            result = {"content": [{"type": "text", "text": f"Synthetic failure: {name}"}], "isError": True}
+        elif name == "echo":
+            result = {"content": [{"type": "text", "text": f"Echo: {args.get('message', '')}"}]}
+        else:
+            result = {"content": [self._payload(output_type, output_bytes)]}
+        await self._send({"jsonrpc": "2.0", "id": req_id, "result": result})
+
+    def _sample_latency(self, latency: Optional[Dict[str, Any]]) -> float:
+        """按分布采样一次延迟（秒）"""
+        if not latency:
+            return 0.0
+        dist = latency.get("dist", "fixed")
+        mean = latency.get("mean_ms", 0) / 1000
+        if dist == "uniform":
+            value = self.random.uniform(latency.get("min_ms", 0) / 1000, latency.get("max_ms", 2 * mean * 1000) / 1000)
+        elif dist == "exponential":
+            value = self.random.expovariate(1 / mean) if mean > 0 else 0.0
+        elif dist == "lognormal":
+            # 取 mu 使分布均值等于 mean_ms
+            sigma = latency.get("sigma", 0.5)
+            value = self.random.lognormvariate(math.log(mean) - sigma ** 2 / 2, sigma) if mean > 0 else 0.0
+        else:
+            value = mean
+        return max(0.0, value)
+
+    async def _burn(self, seconds: float) -> None:
+        """在线程池中消耗CPU；hashlib 处理大块数据时释放GIL，多个调用可并行"""
+        def burn() -> None:
+            deadline = time.perf_counter() + seconds
+            digest = hashlib.sha256()
+            while time.perf_counter() < deadline:
+                digest.update(self._burn_block)
+
+        await asyncio.get_running_loop().run_in_executor(None, burn)
+
+    def _payload(self, output_type: str, size: int) -> Dict[str, Any]:
+        """生成（并缓存）指定类型与大小的输出内容"""
+        key = (output_type, size)
+        content = self._payloads.get(key)
+        if content is None:
+            if output_type == "image":
+                data = base64.b64encode(os.urandom(size)).decode()
+                content = {"type": "image", "data": data, "mimeType": "image/png"}
+            elif output_type == "blob":
+                data = base64.b64encode(os.urandom(size)).decode()
+                content = {
+                    "type": "resource",
+                    "resource": {"uri": f"synthetic://blob/{size}", "mimeType": "application/octet-stream", "blob": data}
+                }
+            else:
+                content = {"type": "text", "text": "x" * size}
+            self._payloads[key] = content
+        return content
+
+    async def _send(self, message: Dict[str, Any]) -> None:
+        """写一行JSON-RPC消息；并发任务共用stdout，串行写入"""
+        data = (json.dumps(message) + "\n").encode()
+        async with self._write_lock:
+            self._writer.write(data)
+            await self._writer.drain()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="合成负载 MCP Server")
+    parser.add_argument("--config", help="工具定义 JSON 文件（列表）")
+    parser.add_argument("--seed", type=int, help="随机种子")
+    args = parser.parse_args()
+
+    tools = DEFAULT_TOOLS
+    if args.config:
+        with open(args.config, "r", encoding="utf-8") as f:
+            tools = json.load(f)
+    asyncio.run(SyntheticServer(tools, seed=args.seed).serve())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,50 @@
+"""大结果分块发送：已发出部分分块后中断时中止调用，而不是改为整体重发"""
+import asyncio
+import json
+
+import ws_client
+from ws_client import BridgeWSClient
+
+
+class FakeWebSocket:
+    """记录发出的帧，不回复分块确认"""
+
+    def __init__(self):
+        self.frames = []
+
+    async def send(self, payload):
+        self.frames.append(json.loads(payload))
+
+
+async def _run_call(result: str) -> BridgeWSClient:
+    client = BridgeWSClient("ws://unused", "test", on_call=None)
+    client._ws = FakeWebSocket()
+    client._features = {"result_chunk"}
+
+    async def execute(data):
+        return {"request_id": "r1", "result": result, "error": None}
+
+    client._execute_call = execute
+    client._pending_ids.add("r1")
+    await client._handle_call({})
+    return client
+
+
+def test_ack_timeout_after_first_chunk_aborts(monkeypatch):
+    monkeypatch.setattr(ws_client, "CHUNK_SIZE", 10)
+    monkeypatch.setattr(ws_client, "CHUNK_WINDOW", 1)
+    monkeypatch.setattr(ws_client, "CHUNK_ACK_TIMEOUT", 0.05)
+    client = asyncio.run(_run_call("x" * 50))
+
+    frames = client._ws.frames
+    assert [frame["type"] for frame in frames] == ["result_chunk", "result_chunk"]
+    assert frames[0]["seq"] == 0 and "error" not in frames[0]
+    assert frames[1]["final"] and frames[1]["error"]
+    assert not client._pending_ids
+
+
+def test_small_result_sent_whole(monkeypatch):
+    monkeypatch.setattr(ws_client, "CHUNK_SIZE", 1000)
+    client = asyncio.run(_run_call("x" * 50))
+
+    assert [frame["type"] for frame in client._ws.frames] == ["result"]
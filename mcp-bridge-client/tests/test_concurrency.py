@@ -0,0 +1,49 @@
+"""并发执行：某个server排队饱和时，其他server的调用不被全局并发上限阻塞"""
+import asyncio
+import sys
+import time
+from pathlib import Path
+
+from config import ServerConfig
+from mcp_manager import MCPServerManager
+from router import RequestRouter
+from ws_client import BridgeWSClient
+
+SYNTHETIC_SERVER = str(Path(__file__).resolve().parent.parent / "synthetic_server.py")
+
+
+def _server(name: str, max_concurrency=None) -> ServerConfig:
+    return ServerConfig(name=name, command=sys.executable, args=[SYNTHETIC_SERVER], max_concurrency=max_concurrency)
+
+
+def _call(request_id: str, server: str, method: str, args: dict) -> dict:
+    return {"request_id": request_id, "server": server, "method": method, "args": args, "deadline_ms": 10000}
+
+
+async def _fast_call_latency() -> float:
+    manager = MCPServerManager(tool_cache_path=None)
+    await manager.start_all([_server("slow", max_concurrency=1), _server("fast")])
+    client = BridgeWSClient("ws://unused", "test", on_call=RequestRouter(manager).route_call, max_concurrency=4)
+    try:
+        # slow 每次只能执行一个调用，6个调用中5个在 server 名额上排队
+        slow = [
+            asyncio.create_task(client._execute_call(_call(f"slow-{i}", "slow", "echo", {"latency_ms": 300})))
+            for i in range(6)
+        ]
+        await asyncio.sleep(0.1)
+
+        started = time.monotonic()
+        item = await client._execute_call(_call("fast", "fast", "echo", {"message": "hi"}))
+        elapsed = time.monotonic() - started
+        assert item["error"] is None
+
+        for task in slow:
+            task.cancel()
+        await asyncio.gather(*slow, return_exceptions=True)
+        return elapsed
+    finally:
+        await manager.stop_all()
+
+
+def test_fast_call_not_blocked_by_saturated_server():
+    assert asyncio.run(_fast_call_latency()) < 0.25
@@ -0,0 +1,64 @@
+"""链路追踪模块 - 接收bridge-server的 trace 上下文，记录本地耗时 span 并随结果返回
+
+trace 上下文格式: {"trace_id": 32位hex, "parent_span_id": 16位hex}
+span 格式: {trace_id, span_id, parent_span_id, name, service, start, end（Unix纳秒）, attributes, error?}
+由发起方（web-agent）汇总后导出为 OTLP JSON。
+三个服务各有一份追踪模块，上下文与 span 格式的互通由 mcp-bridge-server/tests/test_wire_compat.py 校验。
+"""
+import time
+import uuid
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, Any, Iterator, List, Optional
+
+SERVICE_NAME = "mcp-bridge-client"
+
+# 当前请求收集的span列表（未开启追踪时为None）及当前父span
+_spans: ContextVar[Optional[List[Dict[str, Any]]]] = ContextVar("trace_spans", default=None)
+_parent: ContextVar[Optional[Dict[str, Any]]] = ContextVar("trace_parent", default=None)
+
+
+def start_trace(trace: Optional[Dict[str, Any]]) -> Optional[List[Dict[str, Any]]]:
+    """在当前上下文开始收集span，返回span列表；上游未传trace时不追踪，返回None"""
+    if not trace or not trace.get("trace_id"):
+        return None
+    spans: List[Dict[str, Any]] = []
+    _spans.set(spans)
+    _parent.set({"trace_id": trace["trace_id"], "span_id": trace.get("parent_span_id")})
+    return spans
+
+
+@contextmanager
+def span(name: str, **attributes: Any) -> Iterator[Optional[Dict[str, Any]]]:
+    """记录一个span，产出span记录（未开启追踪时产出None）"""
+    spans = _spans.get()
+    if spans is None:
+        yield None
+        return
+
+    parent = _parent.get()
+    record = {
+        "trace_id": parent["trace_id"],
+        "span_id": uuid.uuid4().hex[:16],
+        "parent_span_id": parent["span_id"],
+        "name": name,
+        "service": SERVICE_NAME,
+        "start": time.time_ns(),
+        "attributes": attributes
+    }
+    token = _parent.set({"trace_id": record["trace_id"], "span_id": record["span_id"]})
+    try:
+        yield record
+    except BaseException as e:
+        record["error"] = str(e) or type(e).__name__
+        raise
+    finally:
+        _parent.reset(token)
+        record["end"] = time.time_ns()
+        spans.append(record)
+
+
+def child_context(record: Dict[str, Any]) -> Dict[str, Any]:
+    """传给下一跳的trace上下文"""
+    return {"trace_id": record["trace_id"], "parent_span_id": record["span_id"]}
+
@@ -1,13 +1,30 @@
 """WebSocket客户端模块 - 连接远程bridge-server"""
+import asyncio
 import json
 import logging
-from typing import Dict, Any, List, Callable, Optional
+import random
+from typing import Dict, Any, List, Callable, Optional, Set
 
 import websockets
 from websockets.client import WebSocketClientProtocol
 
+from codec import Codec, CodecError, JSON_CODEC, available_encodings
+from metrics import observe_frame_in, observe_frame_out
+from tracing import span, start_trace
+
 logger = logging.getLogger(__name__)
 
+CHUNK_SIZE = 256 * 1024  # 结果JSON超过该长度时分块发送
+CHUNK_WINDOW = 8  # 未确认分块的最大数量（流控窗口）
+CHUNK_ACK_TIMEOUT = 60.0  # 等待分块确认的超时（秒）
+
+
+def _serialize_content(content: Any) -> Dict[str, Any]:
+    """序列化MCP内容项；文本保持 {type, text}，图片/资源等保留 data、mimeType 等字段"""
+    if content.type == "text":
+        return {"type": "text", "text": content.text}
+    return content.model_dump(mode="json", exclude_none=True)
+
 
 class BridgeWSClient:
     """WebSocket客户端，连接远程bridge-server"""
@@ -16,18 +33,59 @@ class BridgeWSClient:
         self,
         server_url: str,
         client_id: str,
-        on_call: Callable[[str, str, Dict[str, Any]], Any]
+        on_call: Callable[..., Any],
+        max_concurrency: int = 64,
+        ws_deflate: bool = True,
+        reconnect_base_delay: float = 1.0,
+        reconnect_max_delay: float = 30.0
     ):
         self.server_url = server_url
         self.client_id = client_id
-        self.on_call = on_call  # 工具调用回调
+        self.on_call = on_call  # 工具调用回调，call_slot 参数为全局并发名额，应在按server排队和懒启动之后再进入
         self._ws: Optional[WebSocketClientProtocol] = None
         self._running = False
+        self._call_limit = asyncio.Semaphore(max_concurrency)  # 全局并发限制
+        self._tasks: Set[asyncio.Task] = set()  # 正在执行的调用任务
+        self._calls: Dict[str, asyncio.Task] = {}  # request_id -> 执行该调用的任务（用于取消）
+        self._cancelled: Set[str] = set()  # 已被bridge-server取消的request_id
+        self.ws_deflate = ws_deflate  # 是否启用传输层 permessage-deflate
+        self._codec: Codec = JSON_CODEC  # 注册确认后切换为协商的编码
+        self._features: Set[str] = set()  # bridge-server支持的可选协议特性
+        self._chunk_credits: Dict[str, asyncio.Semaphore] = {}  # request_id -> 分块发送窗口
+        # 断线重连：退避参数、会话令牌，以及断线期间完成的调用结果
+        self.reconnect_base_delay = reconnect_base_delay
+        self.reconnect_max_delay = reconnect_max_delay
+        self._closing = False
+        self._session_token: Optional[str] = None
+        self._awaiting_registered = False  # 重连后尚未收到注册确认
+        self._pending_ids: Set[str] = set()  # 执行中或结果尚未送达的request_id
+        self._outbox: List[Dict[str, Any]] = []  # 断线期间待发送的结果消息
+    
+    @property
+    def connected(self) -> bool:
+        """WebSocket是否已连接"""
+        return self._ws is not None and self._running
+    
+    @property
+    def pending_calls(self) -> int:
+        """执行中或结果尚未送达的调用数"""
+        return len(self._pending_ids)
+    
+    @property
+    def outbox_size(self) -> int:
+        """断线期间待补发的结果消息数"""
+        return len(self._outbox)
     
     async def connect(self) -> None:
         """连接到bridge-server"""
         logger.info(f"连接到 bridge-server: {self.server_url}")
-        self._ws = await websockets.connect(self.server_url)
+        self._ws = await websockets.connect(
+            self.server_url,
+            compression="deflate" if self.ws_deflate else None
+        )
+        self._codec = JSON_CODEC
+        self._features = set()
+        self._awaiting_registered = True
         self._running = True
         logger.info("WebSocket连接成功")
     
@@ -39,23 +97,76 @@ class BridgeWSClient:
         message = {
             "type": "register",
             "client_id": self.client_id,
-            "tools": tools
+            "tools": tools,
+            # 提供可用的编码；已启用permessage-deflate时不再做应用层压缩
+            "encodings": available_encodings(),
+            "compression": [] if self.ws_deflate else ["zlib"],
+            # 断线重连时恢复会话：服务端据此保留在途请求并只重发丢失的调用
+            "session_token": self._session_token,
+            "inflight": list(self._pending_ids)
         }
-        await self._ws.send(json.dumps(message))
+        await self._write(JSON_CODEC.encode(message))
         logger.info(f"已注册 {len(tools)} 个工具到 bridge-server")
     
-    async def send_result(self, request_id: str, result: Any, error: str = None) -> None:
-        """发送工具调用结果"""
-        if not self._ws:
-            return
-        
+    async def send_result(
+        self,
+        request_id: str,
+        result: Any,
+        error: str = None,
+        spans: Optional[List[Dict[str, Any]]] = None
+    ) -> None:
+        """发送工具调用结果（spans 为开启追踪时本地各阶段的耗时span）"""
         message = {
             "type": "result",
             "request_id": request_id,
             "result": result,
             "error": error
         }
-        await self._ws.send(json.dumps(message))
+        if spans is not None:
+            message["spans"] = spans
+        await self._deliver(message)
+    
+    async def _deliver(self, message: Dict[str, Any]) -> None:
+        """发送结果消息；连接不可用时暂存，重连并恢复会话后再发送"""
+        if message["type"] == "result_batch":
+            request_ids = [item["request_id"] for item in message["results"]]
+        else:
+            request_ids = [message["request_id"]]
+        
+        try:
+            if not self._ws or self._awaiting_registered:
+                raise websockets.ConnectionClosed(None, None)
+            await self._write(self._codec.encode(message))
+        except websockets.ConnectionClosed:
+            self._outbox.append(message)
+            return
+        self._pending_ids.difference_update(request_ids)
+    
+    async def run(self, get_tools: Callable[[], List[Dict[str, Any]]]) -> None:
+        """连接、注册并监听；断线后按指数退避+抖动自动重连，直到 close()"""
+        self._closing = False
+        attempt = 0
+        while not self._closing:
+            try:
+                await self.connect()
+                await self.register_tools(get_tools())
+                attempt = 0
+                logger.info("开始监听远程调用...")
+                await self.listen()
+            except (OSError, websockets.WebSocketException) as e:
+                logger.error(f"连接错误: {e}")
+            
+            self._ws = None
+            self._running = False
+            if self._closing:
+                break
+            
+            # 退避上限内取 [cap/2, cap] 的随机值，避免大量客户端同时重连
+            cap = min(self.reconnect_max_delay, self.reconnect_base_delay * 2 ** attempt)
+            delay = cap / 2 + random.uniform(0, cap / 2)
+            attempt += 1
+            logger.info(f"{delay:.1f}s 后重连（第 {attempt} 次）")
+            await asyncio.sleep(delay)
     
     async def listen(self) -> None:
         """监听来自bridge-server的消息"""
@@ -64,11 +175,12 @@ class BridgeWSClient:
         
         try:
             async for message in self._ws:
+                observe_frame_in(message)
                 try:
-                    data = json.loads(message)
+                    data = self._codec.decode(message)
                     await self._handle_message(data)
-                except json.JSONDecodeError as e:
-                    logger.error(f"JSON解析错误: {e}")
+                except CodecError as e:
+                    logger.error(f"消息解码错误: {e}")
         except websockets.ConnectionClosed:
             logger.info("WebSocket连接已关闭")
             self._running = False
@@ -79,39 +191,219 @@ class BridgeWSClient:
         
         if msg_type == "call":
             # 工具调用请求
-            request_id = data.get("request_id")
-            server = data.get("server")
-            method = data.get("method")
-            args = data.get("args", {})
-            
-            logger.info(f"收到工具调用请求: {server}/{method}")
+            self._spawn(self._handle_call(data))
+        
+        elif msg_type == "call_batch":
+            # 批量工具调用请求
+            self._spawn(self._handle_call_batch(data))
+        
+        elif msg_type == "registered":
+            # 注册确认，切换到协商的编码（旧版本服务端不返回encoding，保持JSON）
+            self._codec = Codec(data.get("encoding") or "json", data.get("compression"))
+            self._features = set(data.get("features") or [])
+            self._session_token = data.get("session_token")
+            logger.info(f"注册成功，编码: {self._codec.encoding}, 压缩: {self._codec.compression}")
             
-            try:
-                result = await self.on_call(server, method, args)
-                # 序列化MCP结果
-                if hasattr(result, "content"):
-                    # MCP CallToolResult
-                    result_data = [
-                        {"type": c.type, "text": getattr(c, "text", None)}
-                        for c in result.content
-                    ]
-                else:
-                    result_data = result
-                await self.send_result(request_id, result_data)
-            except Exception as e:
-                logger.error(f"工具调用失败: {e}")
-                await self.send_result(request_id, None, str(e))
+            if self._awaiting_registered:
+                self._awaiting_registered = False
+                outbox, self._outbox = self._outbox, []
+                if data.get("resumed"):
+                    # 会话已恢复，补发断线期间完成的结果
+                    logger.info(f"会话已恢复，补发 {len(outbox)} 个结果")
+                    for message in outbox:
+                        await self._deliver(message)
+                elif outbox:
+                    logger.warning(f"会话未能恢复，丢弃 {len(outbox)} 个结果")
+                    self._pending_ids.clear()
+        
+        elif msg_type == "cancel":
+            # 调用在bridge-server端已超时或调用方已离开，停止执行且不再回写结果
+            self._cancel_call(data.get("request_id"), data.get("reason"))
+        
+        elif msg_type == "chunk_ack":
+            # 分块已被消费，归还发送窗口
+            credits = self._chunk_credits.get(data.get("request_id"))
+            if credits:
+                credits.release()
         
         elif msg_type == "ping":
             # 心跳响应
-            await self._ws.send(json.dumps({"type": "pong"}))
+            await self._send({"type": "pong"})
         
         else:
             logger.warning(f"未知消息类型: {msg_type}")
     
+    def _spawn(self, coro) -> None:
+        """以独立任务执行调用，避免慢调用阻塞后续消息"""
+        task = asyncio.create_task(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+    
+    def _cancel_call(self, request_id: Optional[str], reason: Optional[str]) -> None:
+        """取消执行中的调用，MCP调用被取消时由 mcp_manager 通知本地MCP Server"""
+        task = self._calls.get(request_id)
+        if task is None:
+            # 已执行完，结果在途（bridge-server会忽略）
+            return
+        logger.info(f"取消工具调用: {request_id}（{reason}）")
+        self._cancelled.add(request_id)
+        task.cancel()
+    
+    async def _execute_call(self, data: Dict[str, Any]) -> Dict[str, Any]:
+        """执行单个工具调用，返回 {request_id, result, error[, spans]}
+        
+        deadline_ms 为bridge-server给出的剩余时间：排队期间已过期则不执行，执行超时则取消。
+        调用被bridge-server取消时返回的项带 cancelled 标记，不应回写。
+        """
+        request_id = data.get("request_id")
+        server = data.get("server")
+        method = data.get("method")
+        args = data.get("args", {})
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + data["deadline_ms"] / 1000 if data.get("deadline_ms") is not None else None
+        
+        logger.info(f"收到工具调用请求: {server}/{method}")
+        self._pending_ids.add(request_id)
+        self._calls[request_id] = asyncio.current_task()
+        
+        # 全局名额交给回调在真正执行前获取，等待某个server的调用不占用其他server的名额
+        kwargs = {"call_slot": self._call_limit}
+        if data.get("stream"):
+            # 流式调用：转发MCP进度通知
+            async def on_progress(progress: float, total: Optional[float], message: Optional[str] = None) -> None:
+                await self._send({
+                    "type": "progress",
+                    "request_id": request_id,
+                    "progress": progress,
+                    "total": total,
+                    "message": message
+                })
+            kwargs["progress_callback"] = on_progress
+        
+        # 请求携带trace上下文时记录本地耗时（含全局并发排队与路由）
+        spans = start_trace(data.get("trace"))
+        try:
+            with span("client.execute", server=server, tool=method):
+                if deadline is None:
+                    result = await self.on_call(server, method, args, **kwargs)
+                else:
+                    remaining = deadline - loop.time()
+                    if remaining <= 0:
+                        raise TimeoutError(f"排队期间已超过截止时间，未执行: {server}/{method}")
+                    try:
+                        result = await asyncio.wait_for(self.on_call(server, method, args, **kwargs), remaining)
+                    except asyncio.TimeoutError:
+                        raise TimeoutError(f"超过截止时间，已取消: {server}/{method}")
+            # 序列化MCP结果
+            if hasattr(result, "content"):
+                # MCP CallToolResult
+                result_data = [_serialize_content(c) for c in result.content]
+            else:
+                result_data = result
+            item = {"request_id": request_id, "result": result_data, "error": None}
+        except asyncio.CancelledError:
+            if request_id not in self._cancelled:
+                raise
+            self._pending_ids.discard(request_id)
+            item = {"request_id": request_id, "result": None, "error": "调用已取消", "cancelled": True}
+        except Exception as e:
+            logger.error(f"工具调用失败: {e}")
+            item = {"request_id": request_id, "result": None, "error": str(e)}
+        finally:
+            self._calls.pop(request_id, None)
+            self._cancelled.discard(request_id)
+        if spans is not None:
+            item["spans"] = spans
+        return item
+    
+    async def _handle_call(self, data: Dict[str, Any]) -> None:
+        """执行单个工具调用，完成后立即回写结果（可乱序）"""
+        item = await self._execute_call(data)
+        if item.get("cancelled"):
+            return
+        if item["error"] is None and "result_chunk" in self._features:
+            text = json.dumps(item["result"], ensure_ascii=False)
+            if len(text) > CHUNK_SIZE:
+                try:
+                    await self._send_chunked(item["request_id"], text, item.get("spans"))
+                    return
+                except websockets.ConnectionClosed:
+                    # 首个分块未能发出，改为重连后整体补发
+                    pass
+        await self.send_result(item["request_id"], item["result"], item["error"], item.get("spans"))
+    
+    async def _send_chunked(
+        self,
+        request_id: str,
+        text: str,
+        spans: Optional[List[Dict[str, Any]]] = None
+    ) -> None:
+        """将大结果的JSON文本分块发送，最多 CHUNK_WINDOW 个分块未确认，spans 随最后一块发送
+        
+        首个分块未能发出时抛出 ConnectionClosed，由调用方改为整体发送。已发出部分分块后
+        连接中断或等待确认超时，则发送带 error 的分块中止该调用（连接不可用时重连后补发）：
+        流式消费者已收到部分分块，不能再改为整体发送。
+        """
+        credits = asyncio.Semaphore(CHUNK_WINDOW)
+        self._chunk_credits[request_id] = credits
+        seq = 0
+        try:
+            total = (len(text) + CHUNK_SIZE - 1) // CHUNK_SIZE
+            for seq in range(total):
+                await asyncio.wait_for(credits.acquire(), timeout=CHUNK_ACK_TIMEOUT)
+                chunk = {
+                    "type": "result_chunk",
+                    "request_id": request_id,
+                    "seq": seq,
+                    "data": text[seq * CHUNK_SIZE:(seq + 1) * CHUNK_SIZE],
+                    "final": seq == total - 1
+                }
+                if chunk["final"] and spans is not None:
+                    chunk["spans"] = spans
+                if not self._ws or self._awaiting_registered:
+                    raise websockets.ConnectionClosed(None, None)
+                await self._write(self._codec.encode(chunk))
+        except (websockets.ConnectionClosed, asyncio.TimeoutError) as e:
+            if seq == 0:
+                raise
+            reason = "等待分块确认超时" if isinstance(e, asyncio.TimeoutError) else "连接中断"
+            logger.warning(f"分块发送{reason}，中止调用: {request_id}")
+            await self._deliver({
+                "type": "result_chunk",
+                "request_id": request_id,
+                "seq": seq,
+                "final": True,
+                "error": f"结果分块发送中止（{reason}）"
+            })
+            return
+        finally:
+            self._chunk_credits.pop(request_id, None)
+        self._pending_ids.discard(request_id)
+    
+    async def _send(self, message: Dict[str, Any]) -> None:
+        """按协商的编码发送消息"""
+        if self._ws:
+            await self._write(self._codec.encode(message))
+    
+    async def _write(self, payload) -> None:
+        """发送一帧已编码的消息"""
+        observe_frame_out(payload)
+        await self._ws.send(payload)
+    
+    async def _handle_call_batch(self, data: Dict[str, Any]) -> None:
+        """并发执行一批工具调用，全部完成后以一个result_batch帧回写"""
+        calls = data.get("calls", [])
+        results = await asyncio.gather(*(self._execute_call(call) for call in calls))
+        results = [item for item in results if not item.get("cancelled")]
+        if results:
+            await self._deliver({"type": "result_batch", "results": results})
+    
     async def close(self) -> None:
-        """关闭连接"""
+        """关闭连接（不再重连）"""
+        self._closing = True
         self._running = False
+        for task in list(self._tasks):
+            task.cancel()
         if self._ws:
             await self._ws.close()
             self._ws = None
@@ -0,0 +1,106 @@
+"""准入控制模块 - 限制单个客户端的在途请求数并按排队延迟削峰"""
+import asyncio
+import math
+import os
+from collections import deque
+from typing import Deque
+
+# 配置（环境变量）
+MAX_INFLIGHT_PER_CLIENT = int(os.getenv("MAX_INFLIGHT_PER_CLIENT", "32"))
+MAX_QUEUE_PER_CLIENT = int(os.getenv("MAX_QUEUE_PER_CLIENT", "256"))
+MAX_QUEUE_DELAY = float(os.getenv("MAX_QUEUE_DELAY", "5.0"))  # 秒
+
+
+class OverloadedError(Exception):
+    """客户端过载，请求被拒绝"""
+
+    def __init__(self, message: str, retry_after: float):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+    @property
+    def retry_after_header(self) -> str:
+        """Retry-After 响应头（整数秒，至少1秒）"""
+        return str(max(1, math.ceil(self.retry_after)))
+
+
+class AdmissionController:
+    """单个客户端的准入控制器
+
+    - 最多 max_inflight 个请求同时在途
+    - 超出部分进入有界等待队列（FIFO）
+    - 预计排队延迟超过 max_queue_delay 时直接拒绝，排队超时同样拒绝
+    """
+
+    def __init__(
+        self,
+        max_inflight: int = MAX_INFLIGHT_PER_CLIENT,
+        max_queue: int = MAX_QUEUE_PER_CLIENT,
+        max_queue_delay: float = MAX_QUEUE_DELAY
+    ):
+        self.max_inflight = max_inflight
+        self.max_queue = max_queue
+        self.max_queue_delay = max_queue_delay
+        self.inflight = 0
+        self.rejected = 0
+        self._waiters: Deque[asyncio.Future] = deque()
+        self.service_time = 0.1  # 单次调用耗时的EWMA（秒）
+
+    @property
+    def queued(self) -> int:
+        """当前排队数"""
+        return len(self._waiters)
+
+    def estimated_delay(self) -> float:
+        """估算新请求的排队延迟"""
+        return (len(self._waiters) + 1) * self.service_time / self.max_inflight
+
+    async def acquire(self) -> None:
+        """申请一个在途名额，过载时抛出 OverloadedError"""
+        if self.inflight < self.max_inflight and not self._waiters:
+            self.inflight += 1
+            return
+
+        delay = self.estimated_delay()
+        if len(self._waiters) >= self.max_queue or delay > self.max_queue_delay:
+            self.rejected += 1
+            raise OverloadedError(
+                f"客户端过载: 在途 {self.inflight}, 排队 {len(self._waiters)}",
+                retry_after=delay
+            )
+
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        try:
+            await asyncio.wait_for(asyncio.shield(waiter), timeout=self.max_queue_delay)
+        except asyncio.TimeoutError:
+            if waiter.done() and not waiter.cancelled():
+                # 超时的同时恰好拿到了名额
+                return
+            waiter.cancel()
+            self.rejected += 1
+            raise OverloadedError("客户端过载: 排队超时", retry_after=self.estimated_delay())
+        except BaseException:
+            if waiter.done() and not waiter.cancelled():
+                # 已移交名额但调用方被取消，归还名额
+                self.release()
+            else:
+                waiter.cancel()
+            raise
+        finally:
+            try:
+                self._waiters.remove(waiter)
+            except ValueError:
+                pass
+
+    def release(self, elapsed: float = None) -> None:
+        """归还在途名额，优先直接移交给排队中的请求"""
+        if elapsed is not None:
+            self.service_time = 0.8 * self.service_time + 0.2 * elapsed
+
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+        self.inflight -= 1
@@ -0,0 +1,280 @@
+"""集群模块 - 多个 bridge-server 节点共享客户端目录并互相转发调用
+
+每个节点定期把本地客户端及其工具写入共享存储（带TTL，节点宕机后自动过期），
+并读取其他节点的记录合并进工具目录，因此任一节点的 /tools 都返回全集群的工具。
+调用落到没有目标客户端连接的节点时，转发到持有该客户端的节点的 /internal/call。
+
+CLUSTER_NODE_URL 必须能直达本进程（同一主机多个进程请使用不同端口，而不是 uvicorn --workers）。
+"""
+import asyncio
+import json
+import logging
+import math
+import os
+import random
+import socket
+import time
+from typing import Dict, Any, List, Optional
+
+import httpx
+
+from admission import OverloadedError
+from registry import registry as default_registry, Registry, ClientDisconnectedError
+from tracing import add_spans, child_context, span
+
+try:
+    import redis.asyncio as aioredis
+except ImportError:  # 可选依赖，仅 redis:// 存储需要
+    aioredis = None
+
+logger = logging.getLogger(__name__)
+
+# 配置（环境变量）
+CLUSTER_STORE = os.getenv("CLUSTER_STORE", "")  # 空表示单节点；memory 或 redis://host:6379/0
+CLUSTER_NODE_ID = os.getenv("CLUSTER_NODE_ID") or f"{socket.gethostname()}-{os.getpid()}"
+CLUSTER_NODE_URL = os.getenv("CLUSTER_NODE_URL", "http://127.0.0.1:8001")  # 其他节点转发调用的地址
+CLUSTER_SECRET = os.getenv("CLUSTER_SECRET", "")  # 节点间转发的共享密钥
+CLUSTER_SYNC_INTERVAL = float(os.getenv("CLUSTER_SYNC_INTERVAL", "1.0"))  # 目录同步间隔（秒）
+CLUSTER_NODE_TTL = float(os.getenv("CLUSTER_NODE_TTL", "10.0"))  # 节点记录的过期时间（秒）
+
+SECRET_HEADER = "X-Cluster-Secret"
+
+
+class ClusterStore:
+    """共享存储接口：每个节点一条记录 {"url": ..., "clients": {client_id: [tool, ...]}}"""
+
+    async def put_node(self, node_id: str, record: Dict[str, Any], ttl: float) -> None:
+        """写入（刷新）节点记录，ttl 秒内未刷新则过期"""
+        raise NotImplementedError
+
+    async def remove_node(self, node_id: str) -> None:
+        """删除节点记录（节点正常退出）"""
+        raise NotImplementedError
+
+    async def get_nodes(self) -> Dict[str, Dict[str, Any]]:
+        """获取所有未过期的节点记录"""
+        raise NotImplementedError
+
+    async def close(self) -> None:
+        """释放连接"""
+
+
+class MemoryStore(ClusterStore):
+    """进程内存储，供测试及同一进程内的多节点模拟使用"""
+
+    def __init__(self):
+        self._nodes: Dict[str, Any] = {}  # node_id -> (过期时间, 记录)
+
+    async def put_node(self, node_id: str, record: Dict[str, Any], ttl: float) -> None:
+        self._nodes[node_id] = (time.monotonic() + ttl, record)
+
+    async def remove_node(self, node_id: str) -> None:
+        self._nodes.pop(node_id, None)
+
+    async def get_nodes(self) -> Dict[str, Dict[str, Any]]:
+        now = time.monotonic()
+        for node_id in [n for n, (expires_at, _) in self._nodes.items() if expires_at <= now]:
+            del self._nodes[node_id]
+        return {node_id: record for node_id, (_, record) in self._nodes.items()}
+
+
+class RedisStore(ClusterStore):
+    """Redis 存储：每个节点一个带过期时间的键，另用一个集合记录节点ID"""
+
+    def __init__(self, url: str, prefix: str = "mcp-bridge"):
+        if aioredis is None:
+            raise RuntimeError("redis:// 集群存储需要安装 redis 包")
+        self._redis = aioredis.from_url(url)
+        self._prefix = prefix
+
+    def _key(self, node_id: str) -> str:
+        return f"{self._prefix}:node:{node_id}"
+
+    async def put_node(self, node_id: str, record: Dict[str, Any], ttl: float) -> None:
+        async with self._redis.pipeline(transaction=True) as pipe:
+            pipe.set(self._key(node_id), json.dumps(record, ensure_ascii=False), ex=max(1, math.ceil(ttl)))
+            pipe.sadd(f"{self._prefix}:nodes", node_id)
+            await pipe.execute()
+
+    async def remove_node(self, node_id: str) -> None:
+        async with self._redis.pipeline(transaction=True) as pipe:
+            pipe.delete(self._key(node_id))
+            pipe.srem(f"{self._prefix}:nodes", node_id)
+            await pipe.execute()
+
+    async def get_nodes(self) -> Dict[str, Dict[str, Any]]:
+        node_ids = sorted(n.decode() if isinstance(n, bytes) else n for n in await self._redis.smembers(f"{self._prefix}:nodes"))
+        if not node_ids:
+            return {}
+        values = await self._redis.mget([self._key(n) for n in node_ids])
+        nodes = {}
+        expired = []
+        for node_id, value in zip(node_ids, values):
+            if value is None:
+                expired.append(node_id)
+            else:
+                nodes[node_id] = json.loads(value)
+        if expired:
+            await self._redis.srem(f"{self._prefix}:nodes", *expired)
+        return nodes
+
+    async def close(self) -> None:
+        await self._redis.aclose()
+
+
+def create_store(spec: str) -> Optional[ClusterStore]:
+    """根据 CLUSTER_STORE 创建存储，空字符串表示不启用集群"""
+    if not spec:
+        return None
+    if spec == "memory":
+        return MemoryStore()
+    if spec.startswith(("redis://", "rediss://", "unix://")):
+        return RedisStore(spec)
+    raise ValueError(f"不支持的集群存储: {spec}")
+
+
+class Cluster:
+    """本节点的集群成员身份：同步目录、转发调用"""
+
+    def __init__(
+        self,
+        store: Optional[ClusterStore],
+        node_id: str = CLUSTER_NODE_ID,
+        node_url: str = CLUSTER_NODE_URL,
+        secret: str = CLUSTER_SECRET,
+        registry: Registry = default_registry,
+        sync_interval: float = CLUSTER_SYNC_INTERVAL,
+        node_ttl: float = CLUSTER_NODE_TTL
+    ):
+        self.store = store
+        self.node_id = node_id
+        self.node_url = node_url.rstrip("/")
+        self.secret = secret
+        self.registry = registry
+        self.sync_interval = sync_interval
+        self.node_ttl = node_ttl
+        self.nodes: Dict[str, Dict[str, Any]] = {}  # 其他节点 node_id -> 记录
+        self.forwarded = 0  # 累计转发的调用数
+        self._dirty = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        self._http: Optional[httpx.AsyncClient] = None
+
+    @property
+    def enabled(self) -> bool:
+        """是否处于集群模式"""
+        return self.store is not None
+
+    async def start(self) -> None:
+        """加入集群：立即同步一次，之后按间隔或本地目录变化时同步"""
+        if not self.enabled:
+            return
+        self._http = httpx.AsyncClient()
+        self.registry.on_change = self._dirty.set
+        await self.sync()
+        self._task = asyncio.create_task(self._sync_loop())
+        logger.info(f"集群节点已启动: {self.node_id} ({self.node_url})，其他节点: {len(self.nodes)}")
+
+    async def stop(self) -> None:
+        """离开集群：删除本节点记录，其他节点随即不再转发到本节点"""
+        if not self.enabled:
+            return
+        self.registry.on_change = None
+        if self._task:
+            self._task.cancel()
+        try:
+            await self.store.remove_node(self.node_id)
+        except Exception as e:
+            logger.warning(f"删除集群节点记录失败: {e}")
+        await self.store.close()
+        if self._http:
+            await self._http.aclose()
+
+    async def _sync_loop(self) -> None:
+        """定期同步；本地目录变化时提前同步"""
+        while True:
+            try:
+                await asyncio.wait_for(self._dirty.wait(), timeout=self.sync_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._dirty.clear()
+            try:
+                await self.sync()
+            except Exception as e:
+                logger.warning(f"集群同步失败: {e}")
+
+    async def sync(self) -> None:
+        """发布本节点的客户端及工具，并合并其他节点的记录"""
+        record = {
+            "url": self.node_url,
+            "clients": {
+                client_id: list(conn.tools.values())
+                for client_id, conn in self.registry.clients.items()
+            }
+        }
+        await self.store.put_node(self.node_id, record, self.node_ttl)
+        nodes = await self.store.get_nodes()
+        self.nodes = {node_id: rec for node_id, rec in nodes.items() if node_id != self.node_id}
+        self.registry.set_remote(self.nodes)
+
+    def authorized(self, secret: Optional[str]) -> bool:
+        """校验节点间转发请求的密钥"""
+        return not self.secret or secret == self.secret
+
+    async def forward_call(self, tool_name: str, arguments: Dict[str, Any], timeout: float) -> Any:
+        """把调用转发到持有该工具客户端的节点
+
+        只有确定调用未被执行时（连接不上节点，或节点答复调用未发出）才尝试下一个节点，
+        否则直接返回错误，避免同一调用在不同节点上各执行一次。
+        """
+        owners: List[str] = [n for n in self.registry.remote_owners.get(tool_name, []) if n in self.nodes]
+        if not owners:
+            raise ValueError(f"未找到工具 {tool_name} 对应的客户端")
+        random.shuffle(owners)
+
+        headers = {SECRET_HEADER: self.secret} if self.secret else {}
+        for node_id in owners:
+            with span("bridge.forward", tool=tool_name, node=node_id) as record:
+                body = {"name": tool_name, "arguments": arguments, "timeout": timeout}
+                if record is not None:
+                    body["trace"] = child_context(record)
+                try:
+                    response = await self._http.post(
+                        f"{self.nodes[node_id]['url']}/internal/call",
+                        json=body,
+                        headers=headers,
+                        timeout=timeout + 5.0
+                    )
+                except (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout) as e:
+                    # 请求尚未发出，可以安全地尝试其他节点
+                    logger.warning(f"转发到节点 {node_id} 失败: {e}")
+                    continue
+                except httpx.TimeoutException as e:
+                    # 请求已发出，目标节点可能已经执行，不能换节点重试
+                    raise TimeoutError(f"转发到节点 {node_id} 超时: {e}")
+                except httpx.TransportError as e:
+                    raise ClientDisconnectedError(f"转发到节点 {node_id} 失败: {e}", dispatched=True)
+                try:
+                    data = response.json()
+                except ValueError:
+                    data = {"success": False, "error": f"节点 {node_id} 返回 HTTP {response.status_code}"}
+                add_spans(data.get("spans"))
+
+            self.forwarded += 1
+            if response.status_code == 429:
+                raise OverloadedError(data.get("error", "客户端过载"), retry_after=data.get("retry_after", 1.0))
+            if response.status_code == 503:
+                if data.get("dispatched") is False:
+                    # 该节点上的客户端已断开且调用未发出，尝试其他节点
+                    continue
+                raise ClientDisconnectedError(data.get("error", f"节点 {node_id} 的客户端已断开"), dispatched=True)
+            if response.status_code == 504:
+                raise TimeoutError(data.get("error"))
+            if not data.get("success"):
+                raise Exception(data.get("error"))
+            return data.get("result")
+
+        raise ClientDisconnectedError(f"工具 {tool_name} 所在的节点均不可用")
+
+
+# 全局集群实例（CLUSTER_STORE 为空时不启用）
+cluster = Cluster(create_store(CLUSTER_STORE))
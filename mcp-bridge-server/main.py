@@ -1,13 +1,22 @@
 """MCP Bridge Server 入口"""
+import asyncio
+import json
 import logging
-from typing import Dict, Any
+from contextlib import asynccontextmanager
+from typing import Dict, Any, Awaitable, List, Optional
 
-from fastapi import FastAPI, WebSocket
+from fastapi import FastAPI, Header, Request, Response, WebSocket
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, StreamingResponse
 from pydantic import BaseModel
 
-from ws_handler import handle_websocket
-from mcp_server import list_tools, call_tool
+from admission import OverloadedError
+from cluster import cluster, SECRET_HEADER
+from registry import ClientDisconnectedError
+from rpc import handle_rpc
+from tracing import start_trace
+from ws_handler import call_tool_on_client, handle_websocket
+from mcp_server import call_tool, call_tool_batch, call_tool_stream
 
 # 配置日志
 logging.basicConfig(
@@ -16,8 +25,16 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """启动时加入集群（CLUSTER_STORE 未配置则为单节点），退出时离开"""
+    await cluster.start()
+    yield
+    await cluster.stop()
+
+
 # 创建FastAPI应用
-app = FastAPI(title="MCP Bridge Server")
+app = FastAPI(title="MCP Bridge Server", lifespan=lifespan)
 
 # CORS配置
 app.add_middleware(
@@ -33,6 +50,49 @@ class ToolCallRequest(BaseModel):
     """工具调用请求"""
     name: str
     arguments: Dict[str, Any] = {}
+    trace: Optional[Dict[str, Any]] = None  # 追踪上下文 {"trace_id", "parent_span_id"}
+
+
+class InternalCallRequest(BaseModel):
+    """集群节点间转发的工具调用"""
+    name: str
+    arguments: Dict[str, Any] = {}
+    timeout: float = 30.0
+    trace: Optional[Dict[str, Any]] = None
+
+
+class ToolCallBatchRequest(BaseModel):
+    """批量工具调用请求"""
+    calls: List[ToolCallRequest]
+
+
+class CallerDisconnected(Exception):
+    """HTTP调用方在调用完成前断开"""
+
+
+async def _until_disconnect(http_request: Request, call: Awaitable[Any]) -> Any:
+    """执行调用，HTTP调用方中途断开（如 web-agent 的 /chat 客户端离开）时取消调用
+    
+    取消沿 合并→转发 传到 ws_handler，由其向 bridge-client 发送 cancel 帧。
+    """
+    task = asyncio.ensure_future(call)
+    
+    async def disconnected() -> None:
+        while (await http_request.receive())["type"] != "http.disconnect":
+            pass
+    
+    watcher = asyncio.ensure_future(disconnected())
+    try:
+        done, _ = await asyncio.wait({task, watcher}, return_when=asyncio.FIRST_COMPLETED)
+    except asyncio.CancelledError:
+        task.cancel()
+        raise
+    finally:
+        watcher.cancel()
+    if task not in done:
+        task.cancel()
+        raise CallerDisconnected()
+    return task.result()
 
 
 @app.websocket("/ws")
@@ -41,26 +101,162 @@ async def websocket_endpoint(websocket: WebSocket):
     await handle_websocket(websocket)
 
 
+@app.websocket("/rpc")
+async def rpc_endpoint(websocket: WebSocket):
+    """WebSocket RPC端点 - web-agent 在一条长连接上并发复用工具调用"""
+    await handle_rpc(websocket)
+
+
 @app.get("/tools")
-async def get_tools():
-    """获取所有已注册的工具列表"""
-    tools = await list_tools()
-    return {"tools": tools}
+async def get_tools(request: Request):
+    """获取所有已注册的工具列表（支持 ETag / If-None-Match 条件请求）"""
+    from registry import registry
+    etag = registry.get_catalog_etag()
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers={"ETag": etag})
+    
+    # 直接返回注册表中预先序列化好的目录
+    return Response(
+        content=registry.get_catalog_bytes(),
+        media_type="application/json",
+        headers={"ETag": etag}
+    )
 
 
 @app.post("/tools/call")
-async def call_tool_endpoint(request: ToolCallRequest):
-    """调用工具"""
-    result = await call_tool(request.name, request.arguments)
+async def call_tool_endpoint(request: ToolCallRequest, http_request: Request):
+    """调用工具
+    
+    Accept 为 application/x-ndjson 或 text/event-stream 时以流式返回
+    progress / chunk / result / end / error 事件，chunk 拼接后即为结果JSON。
+    """
+    accept = http_request.headers.get("accept", "")
+    if "application/x-ndjson" in accept or "text/event-stream" in accept:
+        sse = "text/event-stream" in accept
+        
+        async def generate():
+            async for event in call_tool_stream(request.name, request.arguments):
+                line = json.dumps(event, ensure_ascii=False)
+                yield f"data: {line}\n\n" if sse else line + "\n"
+        
+        return StreamingResponse(
+            generate(),
+            media_type="text/event-stream" if sse else "application/x-ndjson",
+            headers={"Cache-Control": "no-cache"}
+        )
+    
+    try:
+        result = await _until_disconnect(
+            http_request,
+            call_tool(request.name, request.arguments, request.trace)
+        )
+    except CallerDisconnected:
+        logger.info(f"调用方已断开，取消调用: {request.name}")
+        return Response(status_code=499)
+    except OverloadedError as e:
+        return JSONResponse(
+            status_code=429,
+            content={"success": False, "error": str(e), "retry_after": e.retry_after},
+            headers={"Retry-After": e.retry_after_header}
+        )
     return result
 
 
+@app.post("/tools/call/batch")
+async def call_tool_batch_endpoint(request: ToolCallBatchRequest, http_request: Request):
+    """批量调用工具 - 发往同一客户端的调用合并为一个WebSocket帧"""
+    try:
+        results = await _until_disconnect(http_request, call_tool_batch([
+            {"name": call.name, "arguments": call.arguments}
+            for call in request.calls
+        ]))
+    except CallerDisconnected:
+        logger.info(f"调用方已断开，取消批量调用: {len(request.calls)} 个")
+        return Response(status_code=499)
+    return {"results": results}
+
+
+@app.post("/internal/call")
+async def internal_call_endpoint(
+    request: InternalCallRequest,
+    http_request: Request,
+    x_cluster_secret: Optional[str] = Header(default=None, alias=SECRET_HEADER)
+):
+    """集群内部接口 - 由其他节点转发来的调用，只在本节点的客户端上执行"""
+    if not cluster.authorized(x_cluster_secret):
+        return JSONResponse(status_code=403, content={"success": False, "error": "集群密钥错误"})
+    
+    spans = start_trace(request.trace)
+    try:
+        result = await _until_disconnect(
+            http_request,
+            call_tool_on_client(request.name, request.arguments, request.timeout, local_only=True)
+        )
+        response = {"success": True, "result": result}
+        status_code = 200
+    except CallerDisconnected:
+        # 转发方已放弃（超时或其调用方断开）
+        return Response(status_code=499)
+    except OverloadedError as e:
+        response = {"success": False, "error": str(e), "retry_after": e.retry_after}
+        status_code = 429
+    except (ClientDisconnectedError, ValueError) as e:
+        # 客户端已不在本节点；调用未发出时由转发方尝试其他节点
+        response = {"success": False, "error": str(e), "dispatched": getattr(e, "dispatched", False)}
+        status_code = 503
+    except TimeoutError as e:
+        response = {"success": False, "error": str(e)}
+        status_code = 504
+    except Exception as e:
+        response = {"success": False, "error": str(e)}
+        status_code = 200
+    if spans is not None:
+        response["spans"] = spans
+    return JSONResponse(status_code=status_code, content=response)
+
+
+@app.get("/cluster")
+async def get_cluster():
+    """获取集群节点信息"""
+    from registry import registry
+    return {
+        "enabled": cluster.enabled,
+        "node_id": cluster.node_id,
+        "local_clients": len(registry.clients),
+        "forwarded": cluster.forwarded,
+        "nodes": {
+            node_id: {"url": record.get("url"), "clients": sorted(record.get("clients") or {})}
+            for node_id, record in cluster.nodes.items()
+        }
+    }
+
+
 @app.get("/health")
 async def health():
     """健康检查"""
     return {"status": "ok"}
 
 
+@app.get("/metrics")
+async def get_metrics():
+    """Prometheus 格式的运行指标"""
+    from prometheus_client import CONTENT_TYPE_LATEST
+    from metrics import render
+    return Response(content=render(), media_type=CONTENT_TYPE_LATEST)
+
+
+@app.get("/cache/stats")
+async def get_cache_stats():
+    """获取结果缓存命中及请求合并统计"""
+    from result_cache import result_cache
+    from mcp_server import singleflight
+    return {
+        **result_cache.stats(),
+        "coalesced": singleflight.coalesced,
+        "coalescing_inflight": singleflight.inflight
+    }
+
+
 @app.get("/clients")
 async def get_clients():
     """获取已连接的客户端列表"""
@@ -69,7 +265,11 @@ async def get_clients():
         "clients": [
             {
                 "client_id": client_id,
-                "tool_count": len(conn.tools)
+                "tool_count": len(conn.tools),
+                "connected": conn.connected,
+                "inflight": conn.admission.inflight,
+                "queued": conn.admission.queued,
+                "rejected": conn.admission.rejected
             }
             for client_id, conn in registry.clients.items()
         ]
@@ -77,5 +277,8 @@ async def get_clients():
 
 
 if __name__ == "__main__":
+    import os
     import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=8001)
+    # 是否接受客户端的 permessage-deflate 协商
+    ws_deflate = os.getenv("WS_PER_MESSAGE_DEFLATE", "true").lower() in ("1", "true", "yes")
+    uvicorn.run(app, host="0.0.0.0", port=8001, ws_per_message_deflate=ws_deflate)
@@ -1,40 +1,137 @@
 """MCP Server接口模块 - 对外暴露标准MCP接口"""
 import logging
-from typing import Dict, Any, List
+from typing import Dict, Any, AsyncGenerator, List, Optional
 
+from admission import OverloadedError
 from registry import registry
-from ws_handler import call_tool_on_client
+from result_cache import result_cache, cache_ttl_for, make_key, is_miss
+from singleflight import SingleFlight, coalesce_allowed
+from tracing import span, start_trace
+from ws_handler import call_tool_on_client, call_tools_batch, stream_tool_on_client
 
 logger = logging.getLogger(__name__)
 
+# 相同在途调用的合并器
+singleflight = SingleFlight()
+
 
 async def list_tools() -> List[Dict[str, Any]]:
-    """获取所有已注册的工具列表"""
-    tools = registry.get_all_tools()
-    # 返回标准MCP格式
-    return [
-        {
-            "name": tool["name"],
-            "description": tool.get("description", ""),
-            "inputSchema": tool.get("inputSchema", {})
-        }
-        for tool in tools
-    ]
+    """获取所有已注册的工具列表（标准MCP格式）"""
+    return registry.get_all_tools()
+
+
+async def call_tool(
+    name: str,
+    arguments: Dict[str, Any],
+    trace: Optional[Dict[str, Any]] = None
+) -> Dict[str, Any]:
+    """调用工具
+    
+    trace 为上游的追踪上下文 {"trace_id", "parent_span_id"}，提供时响应中附带本跳及下游的 spans。
+    """
+    spans = start_trace(trace)
+    with span("bridge.call_tool", tool=name) as record:
+        response = await _call_tool(name, arguments)
+        if record is not None:
+            record["attributes"]["cached"] = response.get("cached", False)
+            if not response["success"]:
+                record["error"] = response["error"]
+    if spans is not None:
+        response["spans"] = spans
+    return response
 
 
-async def call_tool(name: str, arguments: Dict[str, Any]) -> Dict[str, Any]:
-    """调用工具"""
+async def _call_tool(name: str, arguments: Dict[str, Any]) -> Dict[str, Any]:
+    """调用工具（查缓存 → 合并 → 转发给客户端）"""
     logger.info(f"调用工具: {name}")
     
+    tool = registry.get_tool(name)
+    key = make_key(name, arguments)
+    
+    # 可缓存的工具先查结果缓存
+    ttl = cache_ttl_for(tool)
+    if ttl is not None:
+        cached = result_cache.get(key)
+        if not is_miss(cached):
+            return {"success": True, "result": cached, "cached": True}
+    
     try:
-        result = await call_tool_on_client(name, arguments)
+        if coalesce_allowed(tool):
+            # 相同工具+参数的在途调用共享一次上游调用
+            result = await singleflight.do(key, lambda: call_tool_on_client(name, arguments))
+        else:
+            result = await call_tool_on_client(name, arguments)
+        if ttl is not None:
+            result_cache.put(key, result, ttl)
         return {
             "success": True,
             "result": result
         }
+    except OverloadedError:
+        # 交给HTTP层返回429
+        raise
     except Exception as e:
         logger.error(f"工具调用失败: {e}")
         return {
             "success": False,
             "error": str(e)
         }
+
+
+async def call_tool_batch(calls: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """批量调用工具，返回逐项结果"""
+    logger.info(f"批量调用工具: {len(calls)} 个")
+    
+    results: List[Dict[str, Any]] = [None] * len(calls)
+    misses = []  # (index, ttl)
+    for index, call in enumerate(calls):
+        # 可缓存的工具先查结果缓存，只把未命中的发往客户端
+        ttl = cache_ttl_for(registry.get_tool(call["name"]))
+        if ttl is not None:
+            cached = result_cache.get(make_key(call["name"], call.get("arguments", {})))
+            if not is_miss(cached):
+                results[index] = {"success": True, "result": cached, "cached": True}
+                continue
+        misses.append((index, ttl))
+    
+    outcomes = await call_tools_batch([
+        (calls[index]["name"], calls[index].get("arguments", {}))
+        for index, _ in misses
+    ])
+    for (index, ttl), outcome in zip(misses, outcomes):
+        call = calls[index]
+        if isinstance(outcome, OverloadedError):
+            results[index] = {
+                "success": False,
+                "error": str(outcome),
+                "retry_after": outcome.retry_after
+            }
+        elif isinstance(outcome, BaseException):
+            logger.error(f"工具调用失败: {call['name']}: {outcome}")
+            results[index] = {"success": False, "error": str(outcome)}
+        else:
+            if ttl is not None:
+                result_cache.put(make_key(call["name"], call.get("arguments", {})), outcome, ttl)
+            results[index] = {"success": True, "result": outcome}
+    return results
+
+
+async def call_tool_stream(name: str, arguments: Dict[str, Any]) -> AsyncGenerator[Dict[str, Any], None]:
+    """流式调用工具，产出 progress / chunk / result / end / error 事件"""
+    logger.info(f"流式调用工具: {name}")
+    
+    ttl = cache_ttl_for(registry.get_tool(name))
+    if ttl is not None:
+        cached = result_cache.get(make_key(name, arguments))
+        if not is_miss(cached):
+            yield {"type": "result", "result": cached, "cached": True}
+            return
+    
+    try:
+        async for event in stream_tool_on_client(name, arguments):
+            yield event
+    except OverloadedError as e:
+        yield {"type": "error", "error": str(e), "retry_after": e.retry_after}
+    except Exception as e:
+        logger.error(f"工具调用失败: {e}")
+        yield {"type": "error", "error": str(e)}
@@ -0,0 +1,97 @@
+"""指标模块 - Prometheus 格式的运行指标
+
+热路径上只做预绑定标签的计数/观测；在途数、排队数、目录大小等状态量在抓取时
+由 BridgeCollector 从注册表读取，不在调用路径上维护。
+"""
+from typing import Iterator
+
+from prometheus_client import REGISTRY, Counter, Histogram, generate_latest
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily
+from prometheus_client.registry import Collector
+
+# 工具调用耗时分桶（秒）
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+TOOL_CALL_SECONDS = Histogram(
+    "bridge_server_tool_call_duration_seconds",
+    "经WebSocket转发的工具调用耗时",
+    ["tool", "client"],
+    buckets=LATENCY_BUCKETS
+)
+TOOL_CALLS = Counter(
+    "bridge_server_tool_calls_total",
+    "工具调用次数（按结果：ok / error / timeout / disconnected / cancelled）",
+    ["tool", "outcome"]
+)
+WS_FRAMES = Counter("bridge_server_ws_frames_total", "WebSocket帧数", ["direction"])
+WS_BYTES = Counter("bridge_server_ws_bytes_total", "WebSocket负载字节数", ["direction"])
+
+# 预绑定标签，避免每帧查找子指标
+_FRAMES_IN = WS_FRAMES.labels("in")
+_FRAMES_OUT = WS_FRAMES.labels("out")
+_BYTES_IN = WS_BYTES.labels("in")
+_BYTES_OUT = WS_BYTES.labels("out")
+
+
+def observe_call(tool: str, client_id: str, elapsed: float, outcome: str) -> None:
+    """记录一次工具调用"""
+    TOOL_CALL_SECONDS.labels(tool, client_id).observe(elapsed)
+    TOOL_CALLS.labels(tool, outcome).inc()
+
+
+def observe_frame_in(payload) -> None:
+    """记录收到的一帧（str 按字符数近似字节数）"""
+    _FRAMES_IN.inc()
+    _BYTES_IN.inc(len(payload))
+
+
+def observe_frame_out(payload) -> None:
+    """记录发出的一帧"""
+    _FRAMES_OUT.inc()
+    _BYTES_OUT.inc(len(payload))
+
+
+class BridgeCollector(Collector):
+    """抓取时从注册表、结果缓存和请求合并器读取状态量"""
+
+    def describe(self) -> Iterator:
+        """注册时不调用 collect（此时注册表模块可能尚未初始化完成）"""
+        return iter(())
+
+    def collect(self) -> Iterator:
+        from registry import registry
+        from result_cache import result_cache
+        from mcp_server import singleflight
+        from cluster import cluster
+
+        pending = GaugeMetricFamily("bridge_server_client_pending_requests", "等待结果的请求数", labels=["client"])
+        inflight = GaugeMetricFamily("bridge_server_client_inflight", "占用准入名额的在途请求数", labels=["client"])
+        queued = GaugeMetricFamily("bridge_server_client_queued", "准入队列中的请求数", labels=["client"])
+        rejected = CounterMetricFamily("bridge_server_client_rejected", "准入控制拒绝的请求数", labels=["client"])
+        connected = GaugeMetricFamily("bridge_server_client_connected", "客户端是否在线（断线宽限期内为0）", labels=["client"])
+        for client_id, conn in list(registry.clients.items()):
+            pending.add_metric([client_id], len(conn.pending_requests))
+            inflight.add_metric([client_id], conn.admission.inflight)
+            queued.add_metric([client_id], conn.admission.queued)
+            rejected.add_metric([client_id], conn.admission.rejected)
+            connected.add_metric([client_id], 1 if conn.connected else 0)
+        yield from (pending, inflight, queued, rejected, connected)
+
+        yield GaugeMetricFamily("bridge_server_catalog_tools", "工具目录中的工具数", value=len(registry.get_all_tools()))
+        yield GaugeMetricFamily("bridge_server_catalog_bytes", "序列化后的工具目录字节数", value=len(registry.get_catalog_bytes()))
+        yield GaugeMetricFamily("bridge_server_catalog_version", "工具目录版本号", value=registry.version)
+
+        yield CounterMetricFamily("bridge_server_result_cache_hits", "结果缓存命中数", value=result_cache.hits)
+        yield CounterMetricFamily("bridge_server_result_cache_misses", "结果缓存未命中数", value=result_cache.misses)
+        yield CounterMetricFamily("bridge_server_coalesced_requests", "被合并的请求数", value=singleflight.coalesced)
+        yield CounterMetricFamily("bridge_server_cluster_forwarded", "转发到其他集群节点的调用数", value=cluster.forwarded)
+        yield GaugeMetricFamily("bridge_server_cluster_nodes", "可见的其他集群节点数", value=len(cluster.nodes))
+
+
+REGISTRY.register(BridgeCollector())
+
+
+def render() -> bytes:
+    """以 Prometheus 文本格式导出所有指标"""
+    return generate_latest(REGISTRY)
+
@@ -1,13 +1,37 @@
 """工具注册表模块 - 存储已注册的工具和客户端连接"""
 import asyncio
+import hashlib
+import json
 import logging
-from typing import Dict, Any, List, Optional
+import os
+import uuid
+from typing import Dict, Any, Callable, List, Optional, Set
 from dataclasses import dataclass, field
 
 from fastapi import WebSocket
 
+from admission import AdmissionController
+from codec import Codec, JSON_CODEC
+from metrics import observe_frame_out
+
 logger = logging.getLogger(__name__)
 
+# 副本选择策略: least_pending（最少在途+排队）或 ewma（最低EWMA延迟）
+ROUTING_POLICY = os.getenv("ROUTING_POLICY", "least_pending")
+# 客户端断线后保留会话（在途请求）的时间，期间可凭session_token恢复
+RESUME_GRACE = float(os.getenv("RESUME_GRACE", "15.0"))
+
+
+class ClientDisconnectedError(Exception):
+    """客户端在调用过程中断开连接
+    
+    dispatched 为 True 表示调用帧已发出、客户端可能已经执行。
+    """
+    
+    def __init__(self, message: str = "", dispatched: bool = False):
+        super().__init__(message)
+        self.dispatched = dispatched
+
 
 @dataclass
 class ClientConnection:
@@ -16,6 +40,30 @@ class ClientConnection:
     websocket: WebSocket
     tools: Dict[str, Dict[str, Any]] = field(default_factory=dict)
     pending_requests: Dict[str, asyncio.Future] = field(default_factory=dict)
+    streams: Dict[str, asyncio.Queue] = field(default_factory=dict)  # 流式调用的事件队列
+    chunk_buffers: Dict[str, List[str]] = field(default_factory=dict)  # 非流式调用的结果分块
+    trace_spans: Dict[str, List[Dict[str, Any]]] = field(default_factory=dict)  # request_id -> 客户端返回的span
+    admission: AdmissionController = field(default_factory=AdmissionController)
+    codec: Codec = JSON_CODEC  # 握手后替换为协商的编码
+    session_token: str = field(default_factory=lambda: uuid.uuid4().hex)  # 断线重连时用于恢复会话
+    connected: bool = True
+    sent_frames: Dict[str, Dict[str, Any]] = field(default_factory=dict)  # request_id -> 已发送的call帧（用于重连后重发）
+    deadlines: Dict[str, float] = field(default_factory=dict)  # request_id -> 截止时间（monotonic，重发时据此重算 deadline_ms）
+    grace_timer: Optional[asyncio.TimerHandle] = None
+    
+    @property
+    def outstanding(self) -> int:
+        """在途 + 排队的请求数"""
+        return self.admission.inflight + self.admission.queued
+    
+    async def send(self, data: Dict[str, Any]) -> None:
+        """按协商的编码发送消息"""
+        payload = self.codec.encode(data)
+        observe_frame_out(payload)
+        if isinstance(payload, bytes):
+            await self.websocket.send_bytes(payload)
+        else:
+            await self.websocket.send_text(payload)
 
 
 class Registry:
@@ -23,56 +71,206 @@ class Registry:
     
     def __init__(self):
         self.clients: Dict[str, ClientConnection] = {}  # client_id -> ClientConnection
-        self.tool_to_client: Dict[str, str] = {}  # tool_name -> client_id
+        self.tool_to_client: Dict[str, List[str]] = {}  # tool_name -> [client_id, ...]（副本集）
+        self.version = 0  # 工具目录版本号，目录变化时单调递增
+        # 增量维护的标准MCP格式工具目录及其序列化缓存
+        self._catalog: Dict[str, Dict[str, Any]] = {}  # tool_name -> {name, description, inputSchema}
+        self._catalog_view: Optional[List[Dict[str, Any]]] = None  # 合并集群其他节点后的目录
+        self._catalog_bytes: Optional[bytes] = None
+        self._catalog_etag: Optional[str] = None
+        # 集群模式：其他节点的客户端注册的工具，及本地目录变化时的回调（触发同步）
+        self.remote_tools: Dict[str, Dict[str, Any]] = {}  # tool_name -> 工具元数据
+        self.remote_owners: Dict[str, List[str]] = {}  # tool_name -> [node_id, ...]
+        self.on_change: Optional[Callable[[], None]] = None
     
     def register_client(self, client_id: str, websocket: WebSocket) -> ClientConnection:
-        """注册新客户端"""
+        """注册新客户端（同ID的旧会话无法恢复，先注销）"""
+        if client_id in self.clients:
+            self.unregister_client(client_id)
         conn = ClientConnection(client_id=client_id, websocket=websocket)
         self.clients[client_id] = conn
         logger.info(f"客户端已连接: {client_id}")
         return conn
     
+    def resume_client(self, client_id: str, websocket: WebSocket, session_token: Optional[str]) -> Optional[ClientConnection]:
+        """断线重连：session_token匹配时把新连接挂到原会话上，保留在途请求"""
+        conn = self.clients.get(client_id)
+        if not conn or not session_token or conn.session_token != session_token:
+            return None
+        if conn.grace_timer:
+            conn.grace_timer.cancel()
+            conn.grace_timer = None
+        conn.websocket = websocket
+        conn.connected = True
+        logger.info(f"客户端会话已恢复: {client_id}，在途请求: {len(conn.pending_requests)}")
+        return conn
+    
+    def detach_client(self, client_id: str, websocket: WebSocket) -> None:
+        """连接断开：保留会话 RESUME_GRACE 秒，期间不再路由新请求，超时后注销"""
+        conn = self.clients.get(client_id)
+        if not conn or conn.websocket is not websocket:
+            # 已被新连接接管
+            return
+        if RESUME_GRACE <= 0:
+            self.unregister_client(client_id)
+            return
+        conn.connected = False
+        conn.grace_timer = asyncio.get_running_loop().call_later(
+            RESUME_GRACE, self._expire_session, client_id, conn
+        )
+        logger.info(f"客户端连接断开，保留会话 {RESUME_GRACE}s: {client_id}")
+    
+    def _expire_session(self, client_id: str, conn: ClientConnection) -> None:
+        """宽限期内未重连，注销客户端"""
+        if self.clients.get(client_id) is conn and not conn.connected:
+            self.unregister_client(client_id)
+    
+    def is_active(self, conn: ClientConnection) -> bool:
+        """连接是否仍是该客户端的当前在线连接"""
+        return conn.connected and self.clients.get(conn.client_id) is conn
+    
     def unregister_client(self, client_id: str) -> None:
         """注销客户端"""
         if client_id in self.clients:
             conn = self.clients[client_id]
-            # 移除该客户端的所有工具
+            if conn.grace_timer:
+                conn.grace_timer.cancel()
+                conn.grace_timer = None
+            # 从副本集中移除该客户端，其余副本继续提供服务
             for tool_name in conn.tools.keys():
-                if tool_name in self.tool_to_client:
-                    del self.tool_to_client[tool_name]
+                self._remove_replica(tool_name, client_id)
             # 取消所有pending请求
             for future in conn.pending_requests.values():
                 if not future.done():
-                    future.set_exception(Exception("客户端断开连接"))
+                    future.set_exception(ClientDisconnectedError(f"客户端断开连接: {client_id}", dispatched=True))
             del self.clients[client_id]
+            self._catalog_changed()
             logger.info(f"客户端已断开: {client_id}")
     
     def register_tools(self, client_id: str, tools: List[Dict[str, Any]]) -> None:
-        """注册客户端的工具"""
+        """注册客户端的工具（整体替换该客户端之前注册的工具列表）"""
         if client_id not in self.clients:
             raise ValueError(f"未知的客户端: {client_id}")
         
         conn = self.clients[client_id]
+        new_names = {tool["name"] for tool in tools}
+        for tool_name in list(conn.tools.keys()):
+            if tool_name not in new_names:
+                del conn.tools[tool_name]
+                self._remove_replica(tool_name, client_id)
+        
         for tool in tools:
             tool_name = tool["name"]
             conn.tools[tool_name] = tool
-            self.tool_to_client[tool_name] = client_id
+            replicas = self.tool_to_client.setdefault(tool_name, [])
+            if client_id not in replicas:
+                replicas.append(client_id)
+            self._catalog[tool_name] = self._to_catalog_entry(tool)
+        self._catalog_changed()
         
         logger.info(f"客户端 {client_id} 注册了 {len(tools)} 个工具")
     
+    def _remove_replica(self, tool_name: str, client_id: str) -> None:
+        """从工具的副本集中移除客户端，副本集为空时从目录中删除该工具"""
+        replicas = self.tool_to_client.get(tool_name)
+        if replicas and client_id in replicas:
+            replicas.remove(client_id)
+            if not replicas:
+                del self.tool_to_client[tool_name]
+                self._catalog.pop(tool_name, None)
+    
+    @staticmethod
+    def _to_catalog_entry(tool: Dict[str, Any]) -> Dict[str, Any]:
+        """转换为对外的标准MCP工具格式"""
+        return {
+            "name": tool["name"],
+            "description": tool.get("description", ""),
+            "inputSchema": tool.get("inputSchema", {})
+        }
+    
+    def _catalog_changed(self, local: bool = True) -> None:
+        """目录变化：递增版本号并使序列化缓存失效；本地变化时通知集群同步"""
+        self.version += 1
+        self._catalog_view = None
+        self._catalog_bytes = None
+        if local and self.on_change:
+            self.on_change()
+    
+    def set_remote(self, nodes: Dict[str, Dict[str, Any]]) -> None:
+        """用其他节点的记录（node_id -> {"clients": {client_id: [tool, ...]}}）替换远程工具"""
+        tools: Dict[str, Dict[str, Any]] = {}
+        owners: Dict[str, List[str]] = {}
+        for node_id, record in nodes.items():
+            for client_tools in (record.get("clients") or {}).values():
+                for tool in client_tools:
+                    tools.setdefault(tool["name"], tool)
+                    node_ids = owners.setdefault(tool["name"], [])
+                    if node_id not in node_ids:
+                        node_ids.append(node_id)
+        
+        changed = tools != self.remote_tools
+        self.remote_tools = tools
+        self.remote_owners = owners
+        if changed:
+            self._catalog_changed(local=False)
+    
     def get_all_tools(self) -> List[Dict[str, Any]]:
-        """获取所有已注册的工具"""
-        all_tools = []
-        for conn in self.clients.values():
-            all_tools.extend(conn.tools.values())
-        return all_tools
-    
-    def get_client_for_tool(self, tool_name: str) -> Optional[ClientConnection]:
-        """根据工具名获取对应的客户端连接"""
-        client_id = self.tool_to_client.get(tool_name)
-        if client_id:
-            return self.clients.get(client_id)
-        return None
+        """获取所有已注册的工具（标准MCP格式，多个副本提供的同名工具只返回一次）
+        
+        集群模式下合并其他节点的工具；始终按名称排序，各节点对相同目录给出相同的顺序和 ETag。
+        """
+        if self._catalog_view is None:
+            merged = {name: self._to_catalog_entry(tool) for name, tool in self.remote_tools.items()}
+            merged.update(self._catalog)
+            self._catalog_view = [merged[name] for name in sorted(merged)]
+        return self._catalog_view
+    
+    def get_catalog_bytes(self) -> bytes:
+        """获取序列化好的 /tools 响应体，目录未变化时直接复用"""
+        if self._catalog_bytes is None:
+            tools_json = json.dumps(self.get_all_tools(), ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+            # ETag 取目录内容的摘要，集群各节点对相同目录给出相同的 ETag
+            self._catalog_etag = f'"{hashlib.sha1(tools_json).hexdigest()[:16]}"'
+            self._catalog_bytes = b'{"tools":' + tools_json + b',"version":' + str(self.version).encode() + b"}"
+        return self._catalog_bytes
+    
+    def get_catalog_etag(self) -> str:
+        """当前目录的 ETag"""
+        self.get_catalog_bytes()
+        return self._catalog_etag
+    
+    def get_tool(self, tool_name: str) -> Optional[Dict[str, Any]]:
+        """获取工具注册时的完整元数据（取任一副本，本地没有时取其他节点的）"""
+        for client_id in self.tool_to_client.get(tool_name, []):
+            conn = self.clients.get(client_id)
+            tool = conn.tools.get(tool_name) if conn else None
+            if tool is not None:
+                return tool
+        return self.remote_tools.get(tool_name)
+    
+    def get_replicas(self, tool_name: str) -> List[ClientConnection]:
+        """获取提供该工具的所有客户端连接"""
+        return [
+            self.clients[client_id]
+            for client_id in self.tool_to_client.get(tool_name, [])
+            if client_id in self.clients and self.clients[client_id].connected
+        ]
+    
+    def get_client_for_tool(self, tool_name: str, exclude: Set[str] = None) -> Optional[ClientConnection]:
+        """根据工具名选择一个客户端副本
+        
+        least_pending: 在途+排队最少者优先，EWMA延迟次之
+        ewma: EWMA延迟最低者优先，在途+排队次之
+        """
+        replicas = [
+            conn for conn in self.get_replicas(tool_name)
+            if not exclude or conn.client_id not in exclude
+        ]
+        if not replicas:
+            return None
+        if ROUTING_POLICY == "ewma":
+            return min(replicas, key=lambda c: (c.admission.service_time, c.outstanding))
+        return min(replicas, key=lambda c: (c.outstanding, c.admission.service_time))
     
     def parse_tool_name(self, tool_name: str) -> tuple:
         """解析工具名，提取server和method
@@ -0,0 +1,94 @@
+"""结果缓存模块 - 缓存幂等只读工具的调用结果"""
+import json
+import os
+import time
+from collections import OrderedDict
+from typing import Dict, Any, Optional, Tuple
+
+# 配置（环境变量）
+RESULT_CACHE_SIZE = int(os.getenv("RESULT_CACHE_SIZE", "1024"))  # 最大缓存条目数，0表示禁用
+# 对仅声明了 readOnlyHint + idempotentHint 注解（未显式声明cache）的工具使用的TTL，0表示不缓存
+RESULT_CACHE_DEFAULT_TTL = float(os.getenv("RESULT_CACHE_DEFAULT_TTL", "0"))
+
+_MISSING = object()
+
+
+def cache_ttl_for(tool: Optional[Dict[str, Any]]) -> Optional[float]:
+    """根据注册时的工具元数据确定缓存TTL，返回None表示不可缓存
+
+    优先使用客户端显式声明的 {"cache": {"ttl": 秒}}；否则仅当MCP注解同时声明
+    readOnlyHint 与 idempotentHint 时使用 RESULT_CACHE_DEFAULT_TTL。
+    """
+    if not tool:
+        return None
+
+    cache = tool.get("cache")
+    if isinstance(cache, dict):
+        ttl = cache.get("ttl")
+        return float(ttl) if ttl and ttl > 0 else None
+
+    annotations = tool.get("annotations") or {}
+    if annotations.get("readOnlyHint") and annotations.get("idempotentHint") and RESULT_CACHE_DEFAULT_TTL > 0:
+        return RESULT_CACHE_DEFAULT_TTL
+    return None
+
+
+def make_key(tool_name: str, arguments: Dict[str, Any]) -> Tuple[str, str]:
+    """缓存键：工具名 + 规范化后的参数"""
+    return tool_name, json.dumps(arguments, sort_keys=True, ensure_ascii=False, separators=(",", ":"))
+
+
+class ResultCache:
+    """带TTL的LRU结果缓存"""
+
+    def __init__(self, max_size: int = RESULT_CACHE_SIZE):
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._entries: "OrderedDict[Tuple[str, str], Tuple[float, Any]]" = OrderedDict()  # key -> (过期时间, 结果)
+
+    def get(self, key: Tuple[str, str]) -> Any:
+        """查询缓存，未命中或已过期返回 _MISSING"""
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return _MISSING
+
+        expires_at, result = entry
+        if expires_at <= time.monotonic():
+            del self._entries[key]
+            self.misses += 1
+            return _MISSING
+
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return result
+
+    def put(self, key: Tuple[str, str], result: Any, ttl: float) -> None:
+        """写入缓存，超出容量时淘汰最久未使用的条目"""
+        if self.max_size <= 0:
+            return
+        self._entries[key] = (time.monotonic() + ttl, result)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def stats(self) -> Dict[str, Any]:
+        """命中统计"""
+        total = self.hits + self.misses
+        return {
+            "size": len(self._entries),
+            "max_size": self.max_size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0
+        }
+
+
+def is_miss(value: Any) -> bool:
+    """判断 ResultCache.get 的返回值是否为未命中"""
+    return value is _MISSING
+
+
+# 全局结果缓存实例
+result_cache = ResultCache()
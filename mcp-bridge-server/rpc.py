@@ -0,0 +1,84 @@
+"""RPC模块 - 供 web-agent 使用的 WebSocket 长连接，在一条连接上并发复用工具调用
+
+请求帧: {"id": 1, "method": "tools/call" | "tools/call/batch" | "tools/list", "params": {...}}
+响应帧: {"id": 1, "status": 200, "result": ...}，status 与对应HTTP接口一致（429 过载、304 目录未变化）
+响应按完成顺序返回，可与请求顺序不同。
+取消帧: {"method": "cancel", "params": {"id": 1}}，取消对应的在途请求（不再返回响应）。
+"""
+import asyncio
+import json
+import logging
+from typing import Dict, Any
+
+from fastapi import WebSocket, WebSocketDisconnect
+
+from admission import OverloadedError
+from mcp_server import call_tool, call_tool_batch
+from registry import registry
+
+logger = logging.getLogger(__name__)
+
+
+async def handle_rpc(websocket: WebSocket) -> None:
+    """处理一条RPC连接：每个请求一个任务，收到取消帧或连接断开时取消未完成的请求"""
+    await websocket.accept()
+    tasks: Dict[Any, asyncio.Task] = {}  # 请求id -> 任务
+    try:
+        while True:
+            request = json.loads(await websocket.receive_text())
+            if request.get("method") == "cancel":
+                # 调用方已放弃（超时或其客户端断开），取消沿 ws_handler 传到 bridge-client
+                task = tasks.get((request.get("params") or {}).get("id"))
+                if task is not None:
+                    task.cancel()
+                continue
+            request_id = request.get("id")
+            task = asyncio.create_task(_dispatch(websocket, request))
+            tasks[request_id] = task
+            task.add_done_callback(lambda _, request_id=request_id: tasks.pop(request_id, None))
+    except WebSocketDisconnect:
+        pass
+    except Exception as e:
+        logger.error(f"RPC连接异常: {e}")
+    finally:
+        for task in list(tasks.values()):
+            task.cancel()
+
+
+async def _dispatch(websocket: WebSocket, request: Dict[str, Any]) -> None:
+    """执行一个RPC请求并回写响应"""
+    request_id = request.get("id")
+    method = request.get("method")
+    params = request.get("params") or {}
+
+    if method == "tools/list":
+        # 目录已预先序列化，直接拼进响应帧
+        etag = registry.get_catalog_etag()
+        if params.get("etag") == etag:
+            await websocket.send_text(json.dumps({"id": request_id, "status": 304, "etag": etag}))
+            return
+        head = json.dumps({"id": request_id, "status": 200, "etag": etag})[:-1]
+        await websocket.send_text(f'{head},"result":{registry.get_catalog_bytes().decode("utf-8")}}}')
+        return
+
+    status = 200
+    try:
+        if method == "tools/call":
+            result: Any = await call_tool(params.get("name", ""), params.get("arguments") or {}, params.get("trace"))
+        elif method == "tools/call/batch":
+            result = {"results": await call_tool_batch(params.get("calls") or [])}
+        else:
+            status = 400
+            result = {"success": False, "error": f"未知方法: {method}"}
+    except OverloadedError as e:
+        status = 429
+        result = {"success": False, "error": str(e), "retry_after": e.retry_after}
+    except Exception as e:
+        logger.error(f"RPC请求失败: {e}")
+        status = 500
+        result = {"success": False, "error": str(e)}
+
+    try:
+        await websocket.send_text(json.dumps({"id": request_id, "status": status, "result": result}, ensure_ascii=False))
+    except Exception as e:
+        logger.warning(f"RPC响应发送失败: {e}")
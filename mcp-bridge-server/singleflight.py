@@ -0,0 +1,66 @@
+"""请求合并模块 - 相同的在途调用共享一次上游调用"""
+import asyncio
+from typing import Dict, Any, Awaitable, Callable, Hashable, Optional
+
+
+def coalesce_allowed(tool: Optional[Dict[str, Any]]) -> bool:
+    """根据注册时的工具元数据判断相同调用能否合并
+
+    优先使用客户端显式声明的 {"coalesce": true/false}；否则只读工具（readOnlyHint）可合并。
+    """
+    if not tool:
+        return False
+    if "coalesce" in tool:
+        return bool(tool["coalesce"])
+    annotations = tool.get("annotations") or {}
+    return bool(annotations.get("readOnlyHint"))
+
+
+class _Call:
+    """一次在途的上游调用"""
+
+    def __init__(self, task: asyncio.Task):
+        self.task = task
+        self.waiters = 0
+
+
+class SingleFlight:
+    """相同key的并发请求只执行一次，所有等待者得到同一结果"""
+
+    def __init__(self):
+        self._calls: Dict[Hashable, _Call] = {}
+        self.coalesced = 0  # 累计被合并的请求数
+
+    @property
+    def inflight(self) -> int:
+        """当前在途的上游调用数"""
+        return len(self._calls)
+
+    async def do(self, key: Hashable, fn: Callable[[], Awaitable[Any]]) -> Any:
+        """执行 fn，若相同key的调用已在途则等待其结果"""
+        call = self._calls.get(key)
+        if call is None:
+            call = _Call(asyncio.ensure_future(fn()))
+            self._calls[key] = call
+            call.task.add_done_callback(lambda _: self._forget(key, call))
+        else:
+            self.coalesced += 1
+
+        call.waiters += 1
+        try:
+            return await asyncio.shield(call.task)
+        except asyncio.CancelledError:
+            # 所有等待者都已离开时取消上游调用
+            if call.waiters == 1 and not call.task.done():
+                call.task.cancel()
+            raise
+        finally:
+            call.waiters -= 1
+
+    def _forget(self, key: Hashable, call: _Call) -> None:
+        """上游调用结束后移除记录"""
+        if self._calls.get(key) is call:
+            del self._calls[key]
+        if not call.task.cancelled():
+            # 等待者均已离开时避免 "exception was never retrieved" 警告
+            call.task.exception()
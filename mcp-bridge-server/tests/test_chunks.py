@@ -0,0 +1,40 @@
+"""结果分块：客户端中止分块发送时，调用以错误结束并释放缓冲"""
+import asyncio
+
+import pytest
+
+from registry import ClientConnection
+from ws_handler import _handle_chunk
+
+
+def _connection() -> ClientConnection:
+    return ClientConnection(client_id="c1", websocket=None)
+
+
+def test_abort_chunk_fails_buffered_call():
+    async def run():
+        conn = _connection()
+        future = asyncio.get_running_loop().create_future()
+        conn.pending_requests["r1"] = future
+        assert _handle_chunk(conn, {"request_id": "r1", "seq": 0, "data": "[1,"})
+        _handle_chunk(conn, {"request_id": "r1", "seq": 1, "final": True, "error": "中止"})
+        assert "r1" not in conn.chunk_buffers
+        with pytest.raises(Exception, match="中止"):
+            future.result()
+
+    asyncio.run(run())
+
+
+def test_abort_chunk_ends_stream_with_error():
+    async def run():
+        conn = _connection()
+        future = asyncio.get_running_loop().create_future()
+        conn.pending_requests["r1"] = future
+        conn.streams["r1"] = asyncio.Queue()
+        _handle_chunk(conn, {"request_id": "r1", "seq": 0, "data": "[1,"})
+        _handle_chunk(conn, {"request_id": "r1", "seq": 1, "final": True, "error": "中止"})
+        assert conn.streams["r1"].qsize() == 1
+        with pytest.raises(Exception, match="中止"):
+            future.result()
+
+    asyncio.run(run())
@@ -0,0 +1,181 @@
+"""集群模式：两个节点共享 MemoryStore，验证目录收敛、调用转发与故障转移"""
+import asyncio
+import json
+
+import httpx
+import pytest
+
+import cluster as cluster_module
+import main
+import ws_handler
+from cluster import Cluster, MemoryStore
+from registry import ClientDisconnectedError, Registry, registry as node_b_registry
+
+TOOL = {"name": "srv__echo", "description": "echo", "inputSchema": {"type": "object"}}
+
+
+class EchoWebSocket:
+    """模拟 bridge-client：收到 call 帧后回写参数作为结果"""
+
+    def __init__(self, registry: Registry, client_id: str):
+        self.registry = registry
+        self.client_id = client_id
+
+    async def send_text(self, payload: str) -> None:
+        frame = json.loads(payload)
+        if frame["type"] == "call":
+            conn = self.registry.clients[self.client_id]
+            asyncio.get_running_loop().call_soon(
+                ws_handler._resolve_result, conn, {"request_id": frame["request_id"], "result": frame["args"]}
+            )
+
+
+def _add_client(registry: Registry, client_id: str, tools) -> None:
+    registry.register_client(client_id, EchoWebSocket(registry, client_id))
+    registry.register_tools(client_id, tools)
+
+
+@pytest.fixture
+def node_b():
+    """节点B：由 main.app 通过 ASGI 提供 /internal/call，使用全局注册表"""
+    _add_client(node_b_registry, "client-b", [TOOL])
+    yield
+    node_b_registry.unregister_client("client-b")
+
+
+def _node_a(store: MemoryStore, handler=None) -> Cluster:
+    """节点A：没有本地客户端，转发请求经 handler 或直接交给 main.app"""
+    node = Cluster(store, node_id="a", node_url="http://node-a", registry=Registry())
+    app_transport = httpx.ASGITransport(app=main.app)
+
+    async def route(request: httpx.Request) -> httpx.Response:
+        if handler is not None:
+            response = handler(request)
+            if response is not None:
+                return response
+        return await app_transport.handle_async_request(request)
+
+    node._http = httpx.AsyncClient(transport=httpx.MockTransport(route))
+    return node
+
+
+async def _join(store: MemoryStore, node_id: str, registry: Registry) -> Cluster:
+    node = Cluster(store, node_id=node_id, node_url=f"http://node-{node_id}", registry=registry)
+    await node.sync()
+    return node
+
+
+def test_catalog_converges_across_nodes():
+    async def run():
+        store = MemoryStore()
+        registry_a, registry_b = Registry(), Registry()
+        _add_client(registry_a, "client-a", [{**TOOL, "name": "zeta__run"}, {**TOOL, "name": "alpha__run"}])
+        _add_client(registry_b, "client-b", [TOOL])
+        node_a = await _join(store, "a", registry_a)
+        await _join(store, "b", registry_b)
+        await node_a.sync()
+
+        names = [tool["name"] for tool in registry_a.get_all_tools()]
+        assert names == ["alpha__run", "srv__echo", "zeta__run"]
+        assert registry_b.get_all_tools() == registry_a.get_all_tools()
+        assert registry_b.get_catalog_etag() == registry_a.get_catalog_etag()
+
+    asyncio.run(run())
+
+
+def test_catalog_order_matches_without_remote_tools():
+    registry_a, registry_b = Registry(), Registry()
+    _add_client(registry_a, "c1", [{**TOOL, "name": "b__x"}, {**TOOL, "name": "a__x"}])
+    _add_client(registry_b, "c1", [{**TOOL, "name": "a__x"}, {**TOOL, "name": "b__x"}])
+    assert registry_a.get_catalog_etag() == registry_b.get_catalog_etag()
+
+
+def test_forward_call_reaches_owner(node_b):
+    async def run():
+        store = MemoryStore()
+        node_a = _node_a(store)
+        await _join(store, "b", node_b_registry)
+        await node_a.sync()
+
+        assert node_a.registry.remote_owners["srv__echo"] == ["b"]
+        assert await node_a.forward_call("srv__echo", {"message": "hi"}, 5.0) == {"message": "hi"}
+        assert node_a.forwarded == 1
+
+    asyncio.run(run())
+
+
+def _fail_host(host: str, response=None, error: Exception = None):
+    """对指定节点返回固定响应或抛出传输错误，记录是否被请求"""
+    calls = []
+
+    def handler(request: httpx.Request):
+        if request.url.host != host:
+            return None
+        calls.append(request)
+        if error is not None:
+            raise error
+        return response
+
+    handler.calls = calls
+    return handler
+
+
+async def _two_owners(handler) -> Cluster:
+    """节点 a-bad 与 b 都声明持有 srv__echo，按节点ID顺序尝试"""
+    store = MemoryStore()
+    node_a = _node_a(store, handler)
+    await store.put_node("a-bad", {"url": "http://node-a-bad", "clients": {"lost": [TOOL]}}, 10.0)
+    await _join(store, "b", node_b_registry)
+    await node_a.sync()
+    return node_a
+
+
+@pytest.fixture
+def ordered_owners(monkeypatch):
+    monkeypatch.setattr(cluster_module.random, "shuffle", lambda items: items.sort())
+
+
+@pytest.mark.parametrize("handler", [
+    _fail_host("node-a-bad", error=httpx.ConnectError("refused")),
+    _fail_host("node-a-bad", response=httpx.Response(503, json={"success": False, "error": "gone", "dispatched": False})),
+])
+def test_forward_fails_over_when_never_dispatched(node_b, ordered_owners, handler):
+    async def run():
+        node_a = await _two_owners(handler)
+        assert await node_a.forward_call("srv__echo", {"n": 1}, 5.0) == {"n": 1}
+
+    handler.calls.clear()
+    asyncio.run(run())
+    assert len(handler.calls) == 1
+
+
+@pytest.mark.parametrize("handler, error, answered", [
+    (_fail_host("node-a-bad", error=httpx.ReadTimeout("slow")), TimeoutError, 0),
+    (_fail_host("node-a-bad", error=httpx.RemoteProtocolError("reset")), ClientDisconnectedError, 0),
+    (_fail_host("node-a-bad", response=httpx.Response(503, json={"success": False, "error": "lost", "dispatched": True})),
+     ClientDisconnectedError, 1),
+])
+def test_forward_does_not_retry_possibly_executed_call(node_b, ordered_owners, handler, error, answered):
+    async def run():
+        node_a = await _two_owners(handler)
+        with pytest.raises(error):
+            await node_a.forward_call("srv__echo", {"n": 1}, 5.0)
+        # 只有 a-bad 被请求过，没有转到节点 b
+        assert node_a.forwarded == answered
+
+    asyncio.run(run())
+
+
+def test_stream_call_forwards_when_owner_is_remote(monkeypatch):
+    async def forward_call(tool_name, arguments, timeout):
+        return [{"type": "text", "text": arguments["message"]}]
+
+    node = Cluster(MemoryStore(), node_id="a", registry=Registry())
+    monkeypatch.setattr(node, "forward_call", forward_call)
+    monkeypatch.setattr(ws_handler, "cluster", node)
+    monkeypatch.setattr(ws_handler.registry, "remote_owners", {"srv__echo": ["b"]})
+
+    async def run():
+        return [event async for event in ws_handler.stream_tool_on_client("srv__echo", {"message": "hi"})]
+
+    assert asyncio.run(run()) == [{"type": "result", "result": [{"type": "text", "text": "hi"}]}]
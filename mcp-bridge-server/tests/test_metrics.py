@@ -0,0 +1,14 @@
+"""指标：bridge-server 导出的所有指标使用同一前缀，不与 bridge-client 的 bridge_client_* 冲突"""
+import main  # noqa: F401  注册全部指标
+from metrics import render
+
+
+def test_all_bridge_metrics_share_prefix():
+    names = {
+        line.split()[2]
+        for line in render().decode().splitlines()
+        if line.startswith("# TYPE")
+    }
+    own = {name for name in names if not name.startswith(("python_", "process_"))}
+    assert own
+    assert all(name.startswith("bridge_server_") for name in own), sorted(own)
@@ -0,0 +1,85 @@
+"""跨服务兼容：codec.py 与 tracing.py 在各服务目录下各有一份（各自独立构建镜像），
+这里加载其他服务的副本，验证一端编码/产生的数据能被另一端解析。"""
+import asyncio
+import importlib.util
+from pathlib import Path
+
+import pytest
+
+import codec as server_codec
+import tracing as server_tracing
+
+ROOT = Path(__file__).resolve().parents[2]
+
+
+def _load(service: str, module: str):
+    """按路径加载其他服务的模块（以不同模块名，避免与本服务的同名模块冲突）"""
+    spec = importlib.util.spec_from_file_location(f"{service.replace('-', '_')}_{module}", ROOT / service / f"{module}.py")
+    loaded = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(loaded)
+    return loaded
+
+
+client_codec = _load("mcp-bridge-client", "codec")
+client_tracing = _load("mcp-bridge-client", "tracing")
+agent_tracing = _load("web-agent", "tracing")
+
+FRAMES = [
+    {"type": "call", "request_id": "r1", "server": "srv", "method": "echo", "args": {"message": "你好", "n": 1.5}},
+    {"type": "result", "request_id": "r1", "result": [{"type": "text", "text": "x" * (2 * server_codec.COMPRESS_THRESHOLD)}], "error": None},
+]
+
+
+def _negotiated():
+    """客户端提供的每种编码/压缩选项，由服务端协商出的组合"""
+    combos = []
+    for encoding in client_codec.available_encodings():
+        for compression in ([], ["zlib"]):
+            codec = server_codec.negotiate([encoding], compression)
+            combos.append((codec.encoding, codec.compression))
+    return sorted(set(combos), key=str)
+
+
+def test_both_sides_support_the_same_encodings():
+    assert client_codec.available_encodings() == server_codec.available_encodings()
+    assert client_codec.COMPRESS_THRESHOLD == server_codec.COMPRESS_THRESHOLD
+
+
+@pytest.mark.parametrize("encoding, compression", _negotiated())
+@pytest.mark.parametrize("frame", FRAMES, ids=["small", "large"])
+def test_frames_round_trip_between_client_and_server(encoding, compression, frame):
+    # 客户端按 registered 帧中的 encoding / compression 构造编解码器
+    client = client_codec.Codec(encoding, compression)
+    server = server_codec.Codec(encoding, compression)
+    assert server.decode(client.encode(frame)) == frame
+    assert client.decode(server.encode(frame)) == frame
+
+
+def test_trace_context_and_spans_propagate_across_services():
+    trace = agent_tracing.Trace()
+
+    def bridge_client(frame_trace):
+        spans = client_tracing.start_trace(frame_trace)
+        with client_tracing.span("client.execute", tool="echo"):
+            pass
+        return spans
+
+    async def bridge_server(request_trace):
+        spans = server_tracing.start_trace(request_trace)
+        with server_tracing.span("bridge.ws_call", tool="srv__echo") as record:
+            server_tracing.add_spans(bridge_client(server_tracing.child_context(record)))
+        return spans
+
+    with agent_tracing.span(trace, "agent.tool_call", tool="srv__echo") as root:
+        trace.add(asyncio.run(bridge_server(agent_tracing.child_context(root))))
+
+    by_name = {record["name"]: record for record in trace.spans}
+    assert set(by_name) == {"agent.tool_call", "bridge.ws_call", "client.execute"}
+    assert {record["trace_id"] for record in trace.spans} == {trace.trace_id}
+    assert by_name["bridge.ws_call"]["parent_span_id"] == by_name["agent.tool_call"]["span_id"]
+    assert by_name["client.execute"]["parent_span_id"] == by_name["bridge.ws_call"]["span_id"]
+    assert {record["service"] for record in trace.spans} == {"web-agent", "mcp-bridge-server", "mcp-bridge-client"}
+
+    services = [resource["resource"]["attributes"][0]["value"]["stringValue"]
+                for resource in agent_tracing.to_otlp(trace.spans)["resourceSpans"]]
+    assert sorted(services) == ["mcp-bridge-client", "mcp-bridge-server", "web-agent"]
@@ -2,15 +2,26 @@
 import asyncio
 import json
 import logging
+import time
 import uuid
-from typing import Dict, Any
+from typing import Dict, Any, AsyncGenerator, List, Optional, Set, Tuple
 
 from fastapi import WebSocket, WebSocketDisconnect
 
-from registry import registry
+from codec import JSON_CODEC, CodecError, negotiate
+from metrics import observe_call, observe_frame_in, observe_frame_out
+from cluster import cluster
+from registry import registry, ClientConnection, ClientDisconnectedError
+from tracing import add_spans, child_context, span
 
 logger = logging.getLogger(__name__)
 
+# 本端支持的可选协议特性，在注册确认中告知客户端
+FEATURES = ["result_chunk"]
+
+# 流式调用中分块结果已全部交给消费者时，Future的结果标记
+_STREAMED = object()
+
 
 async def handle_websocket(websocket: WebSocket) -> None:
     """处理WebSocket连接"""
@@ -20,9 +31,18 @@ async def handle_websocket(websocket: WebSocket) -> None:
     conn = None
     
     try:
-        async for message in websocket.iter_text():
+        while True:
+            message = await websocket.receive()
+            if message["type"] == "websocket.disconnect":
+                raise WebSocketDisconnect(message.get("code", 1000))
+            # 文本帧为JSON，二进制帧使用握手时协商的编码
+            payload = message.get("text")
+            if payload is None:
+                payload = message.get("bytes")
+            observe_frame_in(payload)
+            
             try:
-                data = json.loads(message)
+                data = (conn.codec if conn else JSON_CODEC).decode(payload)
                 msg_type = data.get("type")
                 
                 if msg_type == "register":
@@ -30,28 +50,69 @@ async def handle_websocket(websocket: WebSocket) -> None:
                     client_id = data.get("client_id", str(uuid.uuid4()))
                     tools = data.get("tools", [])
                     
-                    conn = registry.register_client(client_id, websocket)
+                    resumed = False
+                    if not conn or conn.client_id != client_id:
+                        # 断线重连时凭session_token恢复原会话，否则新建
+                        conn = registry.resume_client(client_id, websocket, data.get("session_token"))
+                        resumed = conn is not None
+                        if not resumed:
+                            conn = registry.register_client(client_id, websocket)
+                    # 同一连接上重复注册时只更新工具列表（如客户端的server延迟就绪）
                     registry.register_tools(client_id, tools)
                     
-                    # 发送确认
-                    await websocket.send_json({
+                    # 协商后续消息的编码（旧客户端不提供则保持JSON）
+                    codec = negotiate(data.get("encodings"), data.get("compression"))
+                    
+                    # 发送确认（仍为JSON文本帧），之后切换到协商的编码
+                    ack = JSON_CODEC.encode({
                         "type": "registered",
                         "client_id": client_id,
-                        "tool_count": len(tools)
+                        "tool_count": len(tools),
+                        "encoding": codec.encoding,
+                        "compression": codec.compression,
+                        "features": FEATURES,
+                        "session_token": conn.session_token,
+                        "resumed": resumed
                     })
+                    observe_frame_out(ack)
+                    await websocket.send_text(ack)
+                    conn.codec = codec
+                    logger.info(f"客户端 {client_id} 使用编码: {codec.encoding}, 压缩: {codec.compression}")
+                    
+                    if resumed:
+                        # 重发客户端未收到（既未在执行也未缓存结果）的调用
+                        await _redeliver(conn, set(data.get("inflight") or []))
                 
                 elif msg_type == "result":
                     # 工具调用结果
-                    request_id = data.get("request_id")
-                    result = data.get("result")
-                    error = data.get("error")
-                    
-                    if conn and request_id in conn.pending_requests:
-                        future = conn.pending_requests.pop(request_id)
-                        if error:
-                            future.set_exception(Exception(error))
-                        else:
-                            future.set_result(result)
+                    if conn:
+                        _resolve_result(conn, data)
+                
+                elif msg_type == "result_batch":
+                    # 批量工具调用结果
+                    if conn:
+                        for item in data.get("results", []):
+                            _resolve_result(conn, item)
+                
+                elif msg_type == "result_chunk":
+                    # 大结果的分块；流式调用由消费者取走后再确认，否则立即确认
+                    if conn and _handle_chunk(conn, data):
+                        await conn.send({
+                            "type": "chunk_ack",
+                            "request_id": data.get("request_id"),
+                            "seq": data.get("seq")
+                        })
+                
+                elif msg_type == "progress":
+                    # MCP进度通知，转发给流式调用的消费者
+                    stream = conn.streams.get(data.get("request_id")) if conn else None
+                    if stream is not None:
+                        stream.put_nowait({
+                            "type": "progress",
+                            "progress": data.get("progress"),
+                            "total": data.get("total"),
+                            "message": data.get("message")
+                        })
                 
                 elif msg_type == "pong":
                     # 心跳响应
@@ -60,25 +121,173 @@ async def handle_websocket(websocket: WebSocket) -> None:
                 else:
                     logger.warning(f"未知消息类型: {msg_type}")
                     
-            except json.JSONDecodeError as e:
-                logger.error(f"JSON解析错误: {e}")
+            except CodecError as e:
+                logger.error(f"消息解码错误: {e}")
                 
     except WebSocketDisconnect:
         logger.info(f"WebSocket断开: {client_id}")
     finally:
         if client_id:
-            registry.unregister_client(client_id)
+            # 保留会话一段时间等待重连，超时后注销
+            registry.detach_client(client_id, websocket)
 
 
-async def call_tool_on_client(tool_name: str, arguments: Dict[str, Any], timeout: float = 30.0) -> Any:
-    """通过WebSocket调用客户端的工具"""
-    conn = registry.get_client_for_tool(tool_name)
-    if not conn:
-        raise ValueError(f"未找到工具 {tool_name} 对应的客户端")
+async def _redeliver(conn: ClientConnection, inflight: Set[str]) -> None:
+    """会话恢复后重发丢失的调用请求（deadline_ms 按剩余时间重算）"""
+    now = time.monotonic()
+    frames = []
+    for request_id, frame in list(conn.sent_frames.items()):
+        if request_id in inflight or request_id not in conn.pending_requests:
+            continue
+        deadline = conn.deadlines.get(request_id)
+        if deadline is not None:
+            frame = {**frame, "deadline_ms": max(0, int((deadline - now) * 1000))}
+        frames.append(frame)
+    for frame in frames:
+        await conn.send(frame)
+    if frames:
+        logger.info(f"客户端 {conn.client_id} 会话恢复，重发 {len(frames)} 个调用")
+
+
+async def _send_cancel(conn: ClientConnection, request_ids: List[str], reason: str) -> None:
+    """通知客户端放弃已超时或调用方已离开的调用（尽力而为，连接已断开时忽略）"""
+    if not request_ids or not registry.is_active(conn):
+        return
+    try:
+        for request_id in request_ids:
+            await conn.send({"type": "cancel", "request_id": request_id, "reason": reason})
+    except Exception as e:
+        logger.debug(f"发送取消通知失败: {e}")
+
+
+def _resolve_result(conn: ClientConnection, data: Dict[str, Any]) -> None:
+    """将调用结果交给等待中的Future"""
+    request_id = data.get("request_id")
+    error = data.get("error")
+    
+    future = conn.pending_requests.pop(request_id, None)
+    if future is None or future.done():
+        return
+    if data.get("spans"):
+        conn.trace_spans[request_id] = data["spans"]
+    if error:
+        future.set_exception(Exception(error))
+    else:
+        future.set_result(data.get("result"))
+
+
+def _handle_chunk(conn: ClientConnection, data: Dict[str, Any]) -> bool:
+    """处理结果分块，返回是否需要立即确认
+    
+    带 error 的分块表示客户端在发出部分分块后放弃发送，调用以该错误结束。
+    """
+    request_id = data.get("request_id")
+    
+    if data.get("error"):
+        conn.chunk_buffers.pop(request_id, None)
+        _resolve_result(conn, {"request_id": request_id, "error": data["error"]})
+        return False
     
+    stream = conn.streams.get(request_id)
+    if stream is not None:
+        stream.put_nowait({"type": "chunk", "seq": data.get("seq"), "data": data.get("data", "")})
+        if data.get("final"):
+            _resolve_result(conn, {"request_id": request_id, "result": _STREAMED})
+        return False
+    
+    if request_id in conn.pending_requests:
+        buffer = conn.chunk_buffers.setdefault(request_id, [])
+        buffer.append(data.get("data", ""))
+        if data.get("final"):
+            text = "".join(conn.chunk_buffers.pop(request_id))
+            try:
+                _resolve_result(conn, {
+                    "request_id": request_id,
+                    "result": json.loads(text),
+                    "spans": data.get("spans")
+                })
+            except ValueError as e:
+                _resolve_result(conn, {"request_id": request_id, "error": f"分块结果解析失败: {e}"})
+    # 未知请求（已超时等）也立即确认，避免客户端一直等待窗口
+    return True
+
+
+async def call_tool_on_client(
+    tool_name: str,
+    arguments: Dict[str, Any],
+    timeout: float = 30.0,
+    local_only: bool = False
+) -> Any:
+    """通过WebSocket调用客户端的工具
+    
+    工具由多个客户端提供时按负载选择副本；所选副本在调用中断开时，调用帧尚未发出或工具声明了
+    idempotentHint 才切换到其他副本重试，所有尝试共享同一截止时间。
+    集群模式下本节点没有可用副本时转发到持有该工具的节点（local_only 时不转发，用于处理转发来的调用）。
+    """
+    deadline = time.monotonic() + timeout
+    tried: Set[str] = set()
+    while True:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            raise TimeoutError(f"工具调用超时: {tool_name}")
+        
+        conn = registry.get_client_for_tool(tool_name, exclude=tried)
+        if not conn:
+            if not local_only and cluster.enabled and tool_name in registry.remote_owners:
+                return await cluster.forward_call(tool_name, arguments, remaining)
+            if tried:
+                raise ClientDisconnectedError(f"工具 {tool_name} 的所有副本均已断开")
+            raise ValueError(f"未找到工具 {tool_name} 对应的客户端")
+        
+        try:
+            return await _call_on_connection(conn, tool_name, arguments, remaining)
+        except ClientDisconnectedError as e:
+            if not _failover_allowed(tool_name, e):
+                raise
+            tried.add(conn.client_id)
+            logger.warning(f"{e}，切换副本重试: {tool_name}")
+
+
+def _failover_allowed(tool_name: str, error: ClientDisconnectedError) -> bool:
+    """断开的调用能否在其他副本上重试：调用帧未发出，或工具是幂等的"""
+    if not error.dispatched:
+        return True
+    tool = registry.get_tool(tool_name) or {}
+    annotations = tool.get("annotations") or {}
+    return bool(annotations.get("idempotentHint"))
+
+
+async def _call_on_connection(
+    conn: ClientConnection,
+    tool_name: str,
+    arguments: Dict[str, Any],
+    timeout: float
+) -> Any:
+    """在指定客户端连接上执行一次工具调用"""
+    # 开启追踪时记录 bridge-server→客户端 的往返耗时（含准入排队）
+    with span("bridge.ws_call", tool=tool_name, client=conn.client_id) as record:
+        return await _call_on_connection_traced(conn, tool_name, arguments, timeout, record)
+
+
+async def _call_on_connection_traced(
+    conn: ClientConnection,
+    tool_name: str,
+    arguments: Dict[str, Any],
+    timeout: float,
+    record: Optional[Dict[str, Any]]
+) -> Any:
+    """_call_on_connection 的实现，record 为本跳的span（未追踪时为None）"""
     # 解析工具名
     server, method = registry.parse_tool_name(tool_name)
     
+    # 准入控制：超过在途上限则排队，过载时快速失败（OverloadedError）
+    await conn.admission.acquire()
+    started = time.monotonic()
+    if not registry.is_active(conn):
+        # 排队期间客户端已断开
+        conn.admission.release()
+        raise ClientDisconnectedError(f"客户端断开连接: {conn.client_id}")
+    
     # 生成请求ID
     request_id = str(uuid.uuid4())
     
@@ -86,19 +295,339 @@ async def call_tool_on_client(tool_name: str, arguments: Dict[str, Any], timeout
     future = asyncio.get_event_loop().create_future()
     conn.pending_requests[request_id] = future
     
-    # 发送调用请求
-    await conn.websocket.send_json({
+    frame = {
         "type": "call",
         "request_id": request_id,
         "server": server,
         "method": method,
-        "args": arguments
-    })
+        "args": arguments,
+        "deadline_ms": int(timeout * 1000)  # 相对时长，不依赖两端时钟同步
+    }
+    if record is not None:
+        record["attributes"]["request_id"] = request_id
+        frame["trace"] = child_context(record)
+    conn.sent_frames[request_id] = frame
+    conn.deadlines[request_id] = time.monotonic() + timeout
+    outcome = "error"
     
-    # 等待结果
     try:
+        # 发送调用请求
+        try:
+            await conn.send(frame)
+        except Exception as e:
+            raise ClientDisconnectedError(f"发送调用请求失败: {e}")
+        
+        # 等待结果
         result = await asyncio.wait_for(future, timeout=timeout)
+        outcome = "ok"
         return result
     except asyncio.TimeoutError:
-        conn.pending_requests.pop(request_id, None)
+        outcome = "timeout"
+        await _send_cancel(conn, [request_id], outcome)
         raise TimeoutError(f"工具调用超时: {tool_name}")
+    except asyncio.CancelledError:
+        # 调用方已离开（如HTTP客户端断开），让客户端停止执行
+        outcome = "cancelled"
+        await _send_cancel(conn, [request_id], outcome)
+        raise
+    except ClientDisconnectedError:
+        outcome = "disconnected"
+        raise
+    finally:
+        conn.pending_requests.pop(request_id, None)
+        conn.sent_frames.pop(request_id, None)
+        conn.deadlines.pop(request_id, None)
+        conn.chunk_buffers.pop(request_id, None)
+        add_spans(conn.trace_spans.pop(request_id, None))
+        elapsed = time.monotonic() - started
+        conn.admission.release(elapsed)
+        observe_call(tool_name, conn.client_id, elapsed, outcome)
+
+
+async def call_tools_batch(calls: List[Tuple[str, Dict[str, Any]]], timeout: float = 30.0) -> List[Any]:
+    """批量调用工具
+    
+    发往同一客户端的调用合并为一个 call_batch 帧。返回与 calls 等长的列表，
+    每个元素为调用结果或对应的异常。
+    """
+    deadline = time.monotonic() + timeout
+    results: List[Any] = [None] * len(calls)
+    groups: Dict[str, List[int]] = {}
+    conns: Dict[str, ClientConnection] = {}
+    
+    forwarded: List[int] = []  # 集群模式下由其他节点处理的调用
+    
+    for index, (tool_name, _) in enumerate(calls):
+        conn = registry.get_client_for_tool(tool_name)
+        if not conn:
+            if cluster.enabled and tool_name in registry.remote_owners:
+                forwarded.append(index)
+            else:
+                results[index] = ValueError(f"未找到工具 {tool_name} 对应的客户端")
+            continue
+        conns[conn.client_id] = conn
+        groups.setdefault(conn.client_id, []).append(index)
+    
+    async def run_group(client_id: str, indexes: List[int]) -> None:
+        items = [calls[i] for i in indexes]
+        outcomes = await _call_batch_on_connection(conns[client_id], items, timeout)
+        for index, outcome in zip(indexes, outcomes):
+            tool_name, arguments = calls[index]
+            remaining = deadline - time.monotonic()
+            if isinstance(outcome, ClientDisconnectedError) and remaining > 0 and _failover_allowed(tool_name, outcome):
+                # 该副本已断开，单独走故障转移
+                try:
+                    outcome = await call_tool_on_client(tool_name, arguments, remaining)
+                except Exception as e:
+                    outcome = e
+            results[index] = outcome
+    
+    async def run_forwarded(index: int) -> None:
+        tool_name, arguments = calls[index]
+        try:
+            results[index] = await cluster.forward_call(tool_name, arguments, timeout)
+        except Exception as e:
+            results[index] = e
+    
+    await asyncio.gather(
+        *(run_group(cid, indexes) for cid, indexes in groups.items()),
+        *(run_forwarded(index) for index in forwarded)
+    )
+    return results
+
+
+async def _call_batch_on_connection(
+    conn: ClientConnection,
+    items: List[Tuple[str, Dict[str, Any]]],
+    timeout: float
+) -> List[Any]:
+    """在指定客户端连接上以 call_batch 帧执行一批调用
+    
+    每帧最多 max_inflight 项：同一帧的名额在整帧完成后才归还，超出上限的项
+    若与之同帧申请，只能等待本批自己占用的名额。后一帧在前一帧发出后再申请名额，
+    随前面的调用完成逐步放行。所有帧共享同一截止时间。
+    """
+    size = max(1, conn.admission.max_inflight)
+    deadline = time.monotonic() + timeout
+    frames = []
+    previous: Optional[asyncio.Event] = None
+    for start in range(0, len(items), size):
+        sent = asyncio.Event()
+        frames.append(_call_batch_frame(conn, items[start:start + size], deadline, previous, sent))
+        previous = sent
+    
+    parts = await asyncio.gather(*frames)
+    return [outcome for part in parts for outcome in part]
+
+
+async def _call_batch_frame(
+    conn: ClientConnection,
+    items: List[Tuple[str, Dict[str, Any]]],
+    deadline: float,
+    previous: Optional[asyncio.Event],
+    sent: asyncio.Event
+) -> List[Any]:
+    """_call_batch_on_connection 的单帧实现，previous 为前一帧已发出的信号，本帧发出后置位 sent"""
+    try:
+        if previous is not None:
+            await previous.wait()
+        
+        # 准入控制：逐项申请名额，被拒绝的项直接返回 OverloadedError
+        admitted = await asyncio.gather(
+            *(conn.admission.acquire() for _ in items),
+            return_exceptions=True
+        )
+        started = time.monotonic()
+        timeout = max(0.0, deadline - started)
+        return await _send_batch_frame(conn, items, admitted, started, timeout, sent)
+    finally:
+        sent.set()
+
+
+async def _send_batch_frame(
+    conn: ClientConnection,
+    items: List[Tuple[str, Dict[str, Any]]],
+    admitted: List[Any],
+    started: float,
+    timeout: float,
+    sent: asyncio.Event
+) -> List[Any]:
+    """发送一个已完成准入的 call_batch 帧并等待各项结果"""
+    outcomes: List[Any] = [None] * len(items)
+    
+    requests: List[Tuple[int, str, asyncio.Future]] = []
+    frame_calls = []
+    loop = asyncio.get_event_loop()
+    for index, ((tool_name, arguments), admit) in enumerate(zip(items, admitted)):
+        if isinstance(admit, BaseException):
+            outcomes[index] = admit
+            continue
+        server, method = registry.parse_tool_name(tool_name)
+        request_id = str(uuid.uuid4())
+        future = loop.create_future()
+        conn.pending_requests[request_id] = future
+        requests.append((index, request_id, future))
+        call = {
+            "request_id": request_id,
+            "server": server,
+            "method": method,
+            "args": arguments,
+            "deadline_ms": int(timeout * 1000)
+        }
+        frame_calls.append(call)
+        conn.sent_frames[request_id] = {"type": "call", **call}
+        conn.deadlines[request_id] = time.monotonic() + timeout
+    
+    if not requests:
+        return outcomes
+    
+    try:
+        if not registry.is_active(conn):
+            raise ClientDisconnectedError(f"客户端断开连接: {conn.client_id}")
+        try:
+            await conn.send({"type": "call_batch", "calls": frame_calls})
+        except Exception as e:
+            raise ClientDisconnectedError(f"发送调用请求失败: {e}")
+        sent.set()
+        
+        await asyncio.wait([future for _, _, future in requests], timeout=timeout)
+        for index, _, future in requests:
+            if not future.done():
+                outcomes[index] = TimeoutError(f"工具调用超时: {items[index][0]}")
+            elif future.exception() is not None:
+                outcomes[index] = future.exception()
+            else:
+                outcomes[index] = future.result()
+        await _send_cancel(conn, [
+            request_id for index, request_id, _ in requests if isinstance(outcomes[index], TimeoutError)
+        ], "timeout")
+    except ClientDisconnectedError as e:
+        for index, _, _ in requests:
+            outcomes[index] = e
+    except asyncio.CancelledError:
+        unfinished = [(index, request_id) for index, request_id, future in requests if not future.done()]
+        for index, _ in unfinished:
+            outcomes[index] = asyncio.CancelledError()
+        await _send_cancel(conn, [request_id for _, request_id in unfinished], "cancelled")
+        raise
+    finally:
+        elapsed = time.monotonic() - started
+        for index, request_id, future in requests:
+            conn.pending_requests.pop(request_id, None)
+            conn.sent_frames.pop(request_id, None)
+            conn.deadlines.pop(request_id, None)
+            if not future.done():
+                future.cancel()
+            conn.admission.release(elapsed)
+            observe_call(items[index][0], conn.client_id, elapsed, _outcome_of(outcomes[index]))
+    
+    return outcomes
+
+
+def _outcome_of(outcome: Any) -> str:
+    """批量调用中单项结果对应的指标标签"""
+    if isinstance(outcome, TimeoutError):
+        return "timeout"
+    if isinstance(outcome, ClientDisconnectedError):
+        return "disconnected"
+    if isinstance(outcome, asyncio.CancelledError):
+        return "cancelled"
+    if isinstance(outcome, BaseException):
+        return "error"
+    return "ok"
+
+
+async def stream_tool_on_client(
+    tool_name: str,
+    arguments: Dict[str, Any],
+    timeout: float = 30.0
+) -> AsyncGenerator[Dict[str, Any], None]:
+    """流式调用客户端的工具
+    
+    依次产出 progress（进度）、chunk（结果JSON文本的分块）事件，
+    最后产出 result（未分块的完整结果）或 end（分块结束）。
+    timeout 为两次事件之间的最长等待时间。分块在被消费后才向客户端确认（流控）。
+    集群模式下本节点没有可用副本时，以非流式调用转发到持有该工具的节点，只产出一个 result 事件。
+    """
+    conn = registry.get_client_for_tool(tool_name)
+    if not conn:
+        if cluster.enabled and tool_name in registry.remote_owners:
+            yield {"type": "result", "result": await cluster.forward_call(tool_name, arguments, timeout)}
+            return
+        raise ValueError(f"未找到工具 {tool_name} 对应的客户端")
+    
+    server, method = registry.parse_tool_name(tool_name)
+    
+    await conn.admission.acquire()
+    started = time.monotonic()
+    
+    request_id = str(uuid.uuid4())
+    future = asyncio.get_event_loop().create_future()
+    events: asyncio.Queue = asyncio.Queue()
+    conn.pending_requests[request_id] = future
+    conn.streams[request_id] = events
+    
+    frame = {
+        "type": "call",
+        "request_id": request_id,
+        "server": server,
+        "method": method,
+        "args": arguments,
+        "stream": True
+    }
+    conn.sent_frames[request_id] = frame
+    outcome = "error"
+    
+    try:
+        if not registry.is_active(conn):
+            outcome = "disconnected"
+            raise ClientDisconnectedError(f"客户端断开连接: {conn.client_id}")
+        await conn.send(frame)
+        
+        while True:
+            if not events.empty():
+                event = events.get_nowait()
+            elif future.done():
+                break
+            else:
+                getter = asyncio.ensure_future(events.get())
+                done, _ = await asyncio.wait(
+                    {getter, future},
+                    timeout=timeout,
+                    return_when=asyncio.FIRST_COMPLETED
+                )
+                if getter not in done:
+                    getter.cancel()
+                    if not done:
+                        outcome = "timeout"
+                        raise TimeoutError(f"工具调用超时: {tool_name}")
+                    continue
+                event = getter.result()
+            
+            yield event
+            if event["type"] == "chunk":
+                # 消费者已取走该分块，归还发送窗口
+                await conn.send({"type": "chunk_ack", "request_id": request_id, "seq": event["seq"]})
+        
+        result = future.result()
+        outcome = "ok"
+        if result is _STREAMED:
+            yield {"type": "end"}
+        else:
+            yield {"type": "result", "result": result}
+    except (asyncio.CancelledError, GeneratorExit):
+        # 消费者已离开（如HTTP客户端断开）
+        if outcome != "ok":
+            outcome = "cancelled"
+        raise
+    finally:
+        conn.pending_requests.pop(request_id, None)
+        conn.sent_frames.pop(request_id, None)
+        conn.streams.pop(request_id, None)
+        if not future.done():
+            future.cancel()
+            if outcome in ("timeout", "cancelled"):
+                await _send_cancel(conn, [request_id], outcome)
+        elapsed = time.monotonic() - started
+        conn.admission.release(elapsed)
+        observe_call(tool_name, conn.client_id, elapsed, outcome)
@@ -1,97 +1,411 @@
 """Agent模块 - 智能体推理循环"""
+import asyncio
 import json
 import logging
-from typing import Dict, Any, AsyncGenerator
+import time
+from typing import Dict, Any, AsyncGenerator, List, Optional, Tuple
 
 from openai import AsyncOpenAI
 
 from mcp_client import MCPClient
+from sessions import Session
+from result_budget import READ_RESULT_TOOL, READ_RESULT_TOOL_SCHEMA, ResultBudget, render_result
+from metrics import CHATS_ACTIVE, observe_llm_call, observe_llm_ttft, observe_result_budget, observe_tool_call
+from tracing import Trace, TraceExporter, child_context, span
 
 logger = logging.getLogger(__name__)
 
+SYSTEM_PROMPT = "你是一个有用的助手。你可以使用工具来帮助用户完成任务。"
+
 
 class Agent:
     """智能体 - 处理用户消息并调用工具"""
     
-    def __init__(self, openai_client: AsyncOpenAI, mcp_client: MCPClient, model: str = "gpt-4o-mini"):
+    def __init__(
+        self,
+        openai_client: AsyncOpenAI,
+        mcp_client: MCPClient,
+        model: str = "gpt-4o-mini",
+        max_parallel_tools: int = 8,
+        trace_exporter: Optional[TraceExporter] = None,
+        trace_in_events: bool = False,
+        stream: bool = False,
+        tool_top_k: int = 0,
+        result_budget: Optional[ResultBudget] = None
+    ):
         self.openai = openai_client
         self.mcp = mcp_client
         self.model = model
         self.max_iterations = 10  # 最大迭代次数，防止无限循环
+        self.max_parallel_tools = max_parallel_tools  # 单轮内并发执行的工具调用上限
+        # 链路追踪：配置了导出或需要在事件中返回span时才生成trace
+        self.trace_exporter = trace_exporter
+        self.trace_in_events = trace_in_events
+        self.tracing = trace_exporter is not None or trace_in_events
+        # 流式输出：LLM内容增量作为 message_delta 事件发出，tool_call 参数完整即开始执行
+        self.stream = stream
+        # 工具目录超过 tool_top_k 时只把与用户消息最相关的 tool_top_k 个工具发给LLM（0 表示全部）
+        self.tool_top_k = tool_top_k
+        # 工具结果送回LLM前的预算阶段（默认只去掉 success 包装，不压缩）
+        self.result_budget = result_budget if result_budget is not None else ResultBudget(max_tokens=0)
+    
+    async def chat(self, user_message: str, session: Optional[Session] = None) -> AsyncGenerator[Dict[str, Any], None]:
+        """处理用户消息，返回流式响应；传入 session 时带上历史，并在得到最终回复后把本轮写入会话"""
+        CHATS_ACTIVE.inc()
+        trace = Trace() if self.tracing else None
+        try:
+            with span(trace, "agent.chat", model=self.model) as root:
+                async for event in self._chat(user_message, session, trace, root):
+                    yield event
+        finally:
+            CHATS_ACTIVE.dec()
+            if trace is not None and self.trace_exporter is not None:
+                await self.trace_exporter.export(trace)
     
-    async def chat(self, user_message: str) -> AsyncGenerator[Dict[str, Any], None]:
-        """处理用户消息，返回流式响应"""
-        # 获取可用工具
-        tools = await self.mcp.list_tools()
-        openai_tools = self.mcp.tools_to_openai_format(tools) if tools else None
+    async def _chat(
+        self,
+        user_message: str,
+        session: Optional[Session],
+        trace: Optional[Trace],
+        root: Optional[Dict[str, Any]]
+    ) -> AsyncGenerator[Dict[str, Any], None]:
+        """推理循环：调用LLM，执行工具调用，直到得到最终回复"""
+        # 获取可用工具（已转换为OpenAI格式并缓存）；大目录按本轮及上一轮用户消息筛选，整轮对话内不变
+        query = user_message
+        if session is not None:
+            previous = [m["content"] for m in session.history() if m["role"] == "user"]
+            if previous:
+                query = f"{previous[-1]}\n{user_message}"
+        openai_tools = await self.mcp.select_openai_tools(query, self.tool_top_k) or None
+        if openai_tools and self.result_budget.enabled:
+            openai_tools = openai_tools + [READ_RESULT_TOOL_SCHEMA]
         
-        logger.info(f"可用工具数: {len(tools) if tools else 0}")
+        logger.info(f"可用工具数: {len(openai_tools) if openai_tools else 0}")
+        if root is not None:
+            root["attributes"]["tools"] = len(openai_tools) if openai_tools else 0
         
-        # 初始化消息列表
-        messages = [
-            {"role": "system", "content": "你是一个有用的助手。你可以使用工具来帮助用户完成任务。"},
-            {"role": "user", "content": user_message}
-        ]
+        # 初始化消息列表：系统提示词与历史在各轮间保持不变，只在末尾追加
+        system_prompt = session.system_prompt(SYSTEM_PROMPT) if session is not None else SYSTEM_PROMPT
+        messages = [{"role": "system", "content": system_prompt}]
+        if session is not None:
+            messages.extend(session.history())
+        turn_start = len(messages)
+        messages.append({"role": "user", "content": user_message})
         
         iteration = 0
         while iteration < self.max_iterations:
             iteration += 1
             
-            # 调用LLM
-            response = await self.openai.chat.completions.create(
-                model=self.model,
-                messages=messages,
-                tools=openai_tools if openai_tools else None,
-                tool_choice="auto" if openai_tools else None
-            )
-            
-            assistant_message = response.choices[0].message
-            
-            # 检查是否有工具调用
-            if assistant_message.tool_calls:
-                # 添加助手消息
-                messages.append(assistant_message)
+            # 本轮的工具调用；流式模式下参数一完整就开始执行，不等LLM输出结束
+            batch = _ToolBatch(self, trace, root, session.id if session is not None else None)
+            try:
+                # 调用LLM
+                with span(trace, "llm.chat", parent=root, model=self.model, iteration=iteration) as llm_span:
+                    if self.stream:
+                        turn: Dict[str, Any] = {}
+                        async for event in self._stream_completion(messages, openai_tools, batch, llm_span, turn):
+                            yield event
+                        content, tool_calls = turn["content"], turn["tool_calls"]
+                    else:
+                        content, tool_calls = await self._complete(messages, openai_tools, llm_span)
+                        for index, tool_call in enumerate(tool_calls):
+                            batch.start(index, tool_call["function"]["name"], tool_call["function"]["arguments"])
                 
-                # 处理每个工具调用
-                for tool_call in assistant_message.tool_calls:
-                    function_name = tool_call.function.name
-                    function_args = json.loads(tool_call.function.arguments)
+                # 检查是否有工具调用
+                if tool_calls:
+                    # 添加助手消息
+                    messages.append({"role": "assistant", "content": content or None, "tool_calls": tool_calls})
                     
-                    logger.info(f"调用工具: {function_name}")
+                    # 等待本轮所有工具调用完成，事件随调用开始/结束实时发出
+                    async for event in batch.drain():
+                        yield event
                     
-                    # 发送工具调用事件
-                    yield {
-                        "type": "tool_call",
-                        "tool": function_name,
-                        "arguments": function_args
+                    # 按tool_call顺序添加工具结果到消息
+                    for index, tool_call in enumerate(tool_calls):
+                        messages.append({
+                            "role": "tool",
+                            "tool_call_id": tool_call["id"],
+                            "content": batch.results[index]
+                        })
+                else:
+                    # 没有工具调用，返回最终响应（流式模式下内容已通过 message_delta 发出，这里给出完整文本）
+                    event = {
+                        "type": "message",
+                        "content": content or ""
                     }
-                    
-                    # 执行工具调用
-                    result = await self.mcp.call_tool(function_name, function_args)
-                    
-                    # 发送工具结果事件
-                    yield {
-                        "type": "tool_result",
-                        "tool": function_name,
-                        "result": result
-                    }
-                    
-                    # 添加工具结果到消息
-                    messages.append({
-                        "role": "tool",
-                        "tool_call_id": tool_call.id,
-                        "content": json.dumps(result, ensure_ascii=False)
-                    })
-            else:
-                # 没有工具调用，返回最终响应
-                yield {
-                    "type": "message",
-                    "content": assistant_message.content or ""
-                }
-                return
+                    if trace is not None:
+                        event["trace_id"] = trace.trace_id
+                    if session is not None:
+                        session.add_turn(messages[turn_start:] + [{"role": "assistant", "content": content or ""}])
+                    yield event
+                    return
+            finally:
+                batch.cancel()
         
         # 超过最大迭代次数
         yield {
             "type": "error",
             "content": "超过最大迭代次数"
         }
+    
+    async def _complete(
+        self,
+        messages: List[Any],
+        openai_tools: Optional[List[Dict[str, Any]]],
+        llm_span: Optional[Dict[str, Any]]
+    ) -> Tuple[Optional[str], List[Dict[str, Any]]]:
+        """非流式调用LLM，返回 (回复内容, tool_calls)"""
+        started = time.monotonic()
+        try:
+            response = await self.openai.chat.completions.create(
+                model=self.model,
+                messages=messages,
+                tools=openai_tools if openai_tools else None,
+                tool_choice="auto" if openai_tools else None
+            )
+        except Exception:
+            observe_llm_call(self.model, time.monotonic() - started, ok=False)
+            raise
+        observe_llm_call(self.model, time.monotonic() - started, response.usage)
+        _record_usage(llm_span, response.usage)
+        
+        assistant_message = response.choices[0].message
+        tool_calls = [
+            {
+                "id": tool_call.id,
+                "type": "function",
+                "function": {"name": tool_call.function.name, "arguments": tool_call.function.arguments}
+            }
+            for tool_call in assistant_message.tool_calls or []
+        ]
+        return assistant_message.content, tool_calls
+    
+    async def _stream_completion(
+        self,
+        messages: List[Any],
+        openai_tools: Optional[List[Dict[str, Any]]],
+        batch: "_ToolBatch",
+        llm_span: Optional[Dict[str, Any]],
+        turn: Dict[str, Any]
+    ) -> AsyncGenerator[Dict[str, Any], None]:
+        """流式调用LLM：内容增量作为 message_delta 事件发出，tool_call 参数片段逐个拼接，
+        参数一旦完整即交给 batch 执行；结束时把 content / tool_calls 写入 turn"""
+        started = time.monotonic()
+        first_token_at: Optional[float] = None
+        usage = None
+        content_parts: List[str] = []
+        calls: Dict[int, Dict[str, Any]] = {}  # index -> {"id", "name", "arguments"}
+        
+        try:
+            stream = await self.openai.chat.completions.create(
+                model=self.model,
+                messages=messages,
+                tools=openai_tools if openai_tools else None,
+                tool_choice="auto" if openai_tools else None,
+                stream=True,
+                stream_options={"include_usage": True}
+            )
+            async for chunk in stream:
+                if chunk.usage is not None:
+                    usage = chunk.usage
+                if not chunk.choices:
+                    continue
+                delta = chunk.choices[0].delta
+                if first_token_at is None and (delta.content or delta.tool_calls):
+                    first_token_at = time.monotonic()
+                    observe_llm_ttft(self.model, first_token_at - started)
+                
+                if delta.content:
+                    content_parts.append(delta.content)
+                    yield {"type": "message_delta", "content": delta.content}
+                
+                for fragment in delta.tool_calls or []:
+                    call = calls.setdefault(fragment.index, {"id": "", "name": "", "arguments": ""})
+                    if fragment.id:
+                        call["id"] = fragment.id
+                    if fragment.function is not None:
+                        call["name"] += fragment.function.name or ""
+                        call["arguments"] += fragment.function.arguments or ""
+                    # 之前的tool_call已不会再有片段；当前的参数已是完整JSON时也可提前开始
+                    for index, pending in calls.items():
+                        if index in batch.tasks:
+                            continue
+                        if index < fragment.index or (index == fragment.index and _complete_arguments(pending["arguments"])):
+                            batch.start(index, pending["name"], pending["arguments"])
+                
+                # 已开始的工具调用的事件穿插在增量之间发出
+                for event in batch.ready():
+                    yield event
+        except Exception:
+            observe_llm_call(self.model, time.monotonic() - started, ok=False)
+            raise
+        
+        for index, pending in calls.items():
+            if index not in batch.tasks:
+                batch.start(index, pending["name"], pending["arguments"])
+        
+        observe_llm_call(self.model, time.monotonic() - started, usage)
+        _record_usage(llm_span, usage)
+        if llm_span is not None and first_token_at is not None:
+            llm_span["attributes"]["ttft_ms"] = round((first_token_at - started) * 1000, 1)
+        
+        turn["content"] = "".join(content_parts) or None
+        turn["tool_calls"] = [
+            {
+                "id": call["id"],
+                "type": "function",
+                "function": {"name": call["name"], "arguments": call["arguments"]}
+            }
+            for _, call in sorted(calls.items())
+        ]
+    
+    async def _run_tool_call(
+        self,
+        function_name: str,
+        arguments: str,
+        batch: "_ToolBatch"
+    ) -> str:
+        """执行一个工具调用（受 max_parallel_tools 限制），事件写入 batch，返回送回LLM的内容"""
+        try:
+            function_args = json.loads(arguments or "{}")
+        except json.JSONDecodeError as e:
+            logger.warning(f"工具 {function_name} 的参数不是合法JSON: {e}")
+            result = {"success": False, "error": f"参数不是合法JSON: {e}"}
+            batch.events.put_nowait({"type": "tool_result", "tool": function_name, "result": result})
+            return render_result(result)
+        
+        if function_name == READ_RESULT_TOOL:
+            # 内置工具：读取被压缩结果的完整内容，不经过bridge-server
+            batch.events.put_nowait({"type": "tool_call", "tool": function_name, "arguments": function_args})
+            try:
+                offset = int(function_args.get("offset") or 0)
+            except (TypeError, ValueError):
+                result = {"success": False, "error": f"offset 必须是整数: {function_args.get('offset')!r}"}
+                batch.events.put_nowait({"type": "tool_result", "tool": function_name, "result": result})
+                return render_result(result)
+            content = self.result_budget.read(str(function_args.get("ref", "")), offset, batch.session_id)
+            batch.events.put_nowait({
+                "type": "tool_result",
+                "tool": function_name,
+                "result": {"success": True, "result": [{"type": "text", "text": content}]}
+            })
+            return content
+        
+        async with batch.semaphore:
+            logger.info(f"调用工具: {function_name}")
+            
+            # 发送工具调用事件
+            batch.events.put_nowait({
+                "type": "tool_call",
+                "tool": function_name,
+                "arguments": function_args
+            })
+            
+            # 执行工具调用，trace上下文随请求传给下游各跳
+            with span(batch.trace, "agent.tool_call", parent=batch.parent, tool=function_name) as tool_span:
+                started = time.monotonic()
+                result = await self.mcp.call_tool(function_name, function_args, trace=child_context(tool_span))
+                observe_tool_call(function_name, time.monotonic() - started, bool(result.get("success")))
+            
+            # 下游返回的span不进入LLM上下文
+            downstream = result.pop("spans", None)
+            if batch.trace is not None:
+                batch.trace.add(downstream)
+            
+            # 按预算压缩后送回LLM，完整结果可按引用读取
+            content, budget = self.result_budget.apply(result, batch.session_id)
+            if budget is not None:
+                observe_result_budget(function_name, budget["original_tokens"] - budget["tokens"])
+                logger.info(
+                    f"工具 {function_name} 结果已压缩: {budget['original_tokens']} → {budget['tokens']} tokens（{budget['ref']}）"
+                )
+                if tool_span is not None:
+                    tool_span["attributes"]["result_tokens_saved"] = budget["original_tokens"] - budget["tokens"]
+            
+            # 发送工具结果事件
+            event = {
+                "type": "tool_result",
+                "tool": function_name,
+                "result": result
+            }
+            if budget is not None:
+                event["budget"] = budget
+            if self.trace_in_events and tool_span is not None:
+                event["spans"] = [tool_span] + (downstream or [])
+            batch.events.put_nowait(event)
+            return content
+
+
+class _ToolBatch:
+    """一轮推理中的工具调用：可在LLM输出过程中逐个启动，并发执行，事件经队列按发生顺序发出"""
+    
+    def __init__(
+        self,
+        agent: Agent,
+        trace: Optional[Trace],
+        parent: Optional[Dict[str, Any]],
+        session_id: Optional[str] = None
+    ):
+        self.agent = agent
+        self.trace = trace
+        self.parent = parent
+        self.session_id = session_id  # 被压缩结果绑定的会话，read_tool_result 只能读取本会话的结果
+        self.events: asyncio.Queue = asyncio.Queue()
+        self.semaphore = asyncio.Semaphore(agent.max_parallel_tools)
+        self.tasks: Dict[int, asyncio.Task] = {}  # tool_call index -> 执行任务
+    
+    @property
+    def results(self) -> Dict[int, str]:
+        """各tool_call送回LLM的内容（drain 完成后可用）"""
+        return {index: task.result() for index, task in self.tasks.items()}
+    
+    def start(self, index: int, function_name: str, arguments: str) -> None:
+        """开始执行第 index 个tool_call，arguments 为LLM给出的JSON字符串"""
+        self.tasks[index] = asyncio.create_task(self.agent._run_tool_call(function_name, arguments, self))
+    
+    def ready(self) -> List[Dict[str, Any]]:
+        """取出已产生的事件，不等待"""
+        events = []
+        while not self.events.empty():
+            events.append(self.events.get_nowait())
+        return events
+    
+    async def drain(self) -> AsyncGenerator[Dict[str, Any], None]:
+        """发出事件直到所有已启动的工具调用完成"""
+        while True:
+            for event in self.ready():
+                yield event
+            pending = [task for task in self.tasks.values() if not task.done()]
+            if not pending:
+                break
+            getter = asyncio.ensure_future(self.events.get())
+            done, _ = await asyncio.wait([getter, *pending], return_when=asyncio.FIRST_COMPLETED)
+            if getter in done:
+                yield getter.result()
+            else:
+                getter.cancel()
+        # 工具调用自身的异常（如bridge-server不可达）在这里抛出
+        for task in self.tasks.values():
+            task.result()
+    
+    def cancel(self) -> None:
+        """取消未完成的工具调用（对话中断或LLM流出错时）"""
+        for task in self.tasks.values():
+            task.cancel()
+
+
+def _complete_arguments(arguments: str) -> bool:
+    """tool_call参数片段是否已拼成完整的JSON对象"""
+    if not arguments.rstrip().endswith("}"):
+        return False
+    try:
+        return isinstance(json.loads(arguments), dict)
+    except json.JSONDecodeError:
+        return False
+
+
+def _record_usage(llm_span: Optional[Dict[str, Any]], usage: Any) -> None:
+    """把token用量记到llm.chat span上"""
+    if llm_span is not None and usage is not None:
+        llm_span["attributes"]["prompt_tokens"] = usage.prompt_tokens
+        llm_span["attributes"]["completion_tokens"] = usage.completion_tokens
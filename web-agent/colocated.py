@@ -0,0 +1,38 @@
+"""同进程部署模块 - 在 web-agent 进程内运行 bridge-server
+
+bridge-client 连接 web-agent 的 /bridge/ws，工具调用直接在进程内完成。
+两个服务都有名为 main / metrics / tracing 的顶层模块：加载 bridge-server 时临时移开 web-agent 的同名模块，
+加载完成后恢复，bridge-server 的模块之间仍引用各自的版本。
+"""
+import importlib
+import logging
+import os
+import sys
+from pathlib import Path
+from types import ModuleType
+from typing import Dict
+
+logger = logging.getLogger(__name__)
+
+BRIDGE_SERVER_DIR = os.getenv(
+    "BRIDGE_SERVER_DIR",
+    str(Path(__file__).resolve().parent.parent / "mcp-bridge-server")
+)
+
+# 两个服务同名的顶层模块
+_SHADOWED = ("main", "metrics", "tracing")
+
+
+def load_bridge_server() -> Dict[str, ModuleType]:
+    """加载 bridge-server，返回其模块（main / registry / mcp_server / admission）"""
+    saved = {name: sys.modules.pop(name) for name in _SHADOWED if name in sys.modules}
+    sys.path.insert(0, BRIDGE_SERVER_DIR)
+    try:
+        bridge = {name: importlib.import_module(name) for name in ("main", "registry", "mcp_server", "admission")}
+    finally:
+        sys.path.remove(BRIDGE_SERVER_DIR)
+        for name in _SHADOWED:
+            sys.modules.pop(name, None)
+        sys.modules.update(saved)
+    logger.info(f"已在进程内加载 bridge-server: {BRIDGE_SERVER_DIR}")
+    return bridge
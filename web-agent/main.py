@@ -2,16 +2,24 @@
 import os
 import json
 import logging
+from contextlib import asynccontextmanager
+from typing import Optional
 
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Response
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import StreamingResponse
+from fastapi.responses import PlainTextResponse, StreamingResponse
+from prometheus_client import CONTENT_TYPE_LATEST
 from pydantic import BaseModel
 from dotenv import load_dotenv
 from openai import AsyncOpenAI
 
 from mcp_client import MCPClient
+from transport import HttpTransport, LocalTransport, WebSocketTransport
 from agent import Agent
+from tracing import TraceExporter
+from result_budget import ResultBudget
+from sessions import SessionManager, SESSION_STORE, SESSION_SUMMARIZE, create_store as create_session_store
+from metrics import render as render_metrics
 
 # 加载环境变量
 load_dotenv()
@@ -28,9 +36,41 @@ OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
 OPENAI_API_URL = os.getenv("OPENAI_API_URL")  # 支持自定义API URL
 OPENAI_MODEL = os.getenv("OPENAI_MODEL", "gpt-4o-mini")
 BRIDGE_SERVER_URL = os.getenv("BRIDGE_SERVER_URL", "http://localhost:8001")
+MAX_PARALLEL_TOOLS = int(os.getenv("MAX_PARALLEL_TOOLS", "8"))  # 单轮并发工具调用上限
+TOOLS_CACHE_TTL = float(os.getenv("TOOLS_CACHE_TTL", "2.0"))  # 工具目录缓存免校验时间（秒）
+TRACE_EXPORT_FILE = os.getenv("TRACE_EXPORT_FILE")  # trace导出文件（OTLP JSON，每行一个trace）
+TRACE_OTLP_ENDPOINT = os.getenv("TRACE_OTLP_ENDPOINT")  # OTLP/HTTP collector，如 http://localhost:4318/v1/traces
+TRACE_IN_EVENTS = os.getenv("TRACE_IN_EVENTS", "false").lower() in ("1", "true", "yes")  # tool_result事件中附带span
+TOOL_TOP_K = int(os.getenv("TOOL_TOP_K", "32"))  # 目录超过该数量时按用户消息只选出最相关的K个工具（0 表示不筛选）
+LLM_STREAM = os.getenv("LLM_STREAM", "true").lower() in ("1", "true", "yes")  # /chat 流式输出LLM内容（message_delta事件）
+BRIDGE_TRANSPORT = os.getenv("BRIDGE_TRANSPORT", "http")  # http / ws（/rpc 长连接复用）/ local（同进程内嵌bridge-server）
+BRIDGE_MAX_CONNECTIONS = int(os.getenv("BRIDGE_MAX_CONNECTIONS", "100"))  # http 传输的连接池上限
+BRIDGE_MAX_KEEPALIVE = int(os.getenv("BRIDGE_MAX_KEEPALIVE", "20"))  # http 传输保持的空闲连接数
+BRIDGE_HTTP2 = os.getenv("BRIDGE_HTTP2", "false").lower() in ("1", "true", "yes")  # http 传输使用HTTP/2（需 h2 包）
+
+# 同进程部署时加载 bridge-server，bridge-client 连接本服务的 /bridge/ws
+bridge = None
+if BRIDGE_TRANSPORT == "local":
+    from colocated import load_bridge_server
+    bridge = load_bridge_server()
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """同进程部署时运行 bridge-server 的启动/退出逻辑；退出时关闭到bridge-server的连接"""
+    if bridge is not None:
+        bridge_app = bridge["main"].app
+        async with bridge_app.router.lifespan_context(bridge_app):
+            yield
+    else:
+        yield
+    await mcp_client.close()
+
 
 # 创建FastAPI应用
-app = FastAPI(title="Web Agent")
+app = FastAPI(title="Web Agent", lifespan=lifespan)
+if bridge is not None:
+    app.mount("/bridge", bridge["main"].app)
 
 # CORS配置
 app.add_middleware(
@@ -46,12 +86,48 @@ openai_client = AsyncOpenAI(
     api_key=OPENAI_API_KEY,
     base_url=OPENAI_API_URL  # 支持自定义base_url
 ) if OPENAI_API_KEY else None
-mcp_client = MCPClient(BRIDGE_SERVER_URL)
+if bridge is not None:
+    transport = LocalTransport(bridge)
+elif BRIDGE_TRANSPORT == "ws":
+    transport = WebSocketTransport(BRIDGE_SERVER_URL)
+elif BRIDGE_TRANSPORT == "http":
+    transport = HttpTransport(
+        BRIDGE_SERVER_URL,
+        max_connections=BRIDGE_MAX_CONNECTIONS,
+        max_keepalive=BRIDGE_MAX_KEEPALIVE,
+        http2=BRIDGE_HTTP2
+    )
+else:
+    raise ValueError(f"不支持的 BRIDGE_TRANSPORT: {BRIDGE_TRANSPORT}")
+mcp_client = MCPClient(transport, tools_cache_ttl=TOOLS_CACHE_TTL)
+sessions = SessionManager(
+    create_session_store(SESSION_STORE),
+    openai_client=openai_client if SESSION_SUMMARIZE else None,
+    model=OPENAI_MODEL
+)
+result_budget = ResultBudget()  # 全局共享，压缩前的完整结果可跨请求按引用读取
+trace_exporter = TraceExporter(TRACE_EXPORT_FILE, TRACE_OTLP_ENDPOINT) if TRACE_EXPORT_FILE or TRACE_OTLP_ENDPOINT else None
+
+
+def create_agent(stream: bool = False) -> Agent:
+    """按配置创建智能体，stream 为True时流式调用LLM"""
+    return Agent(
+        openai_client,
+        mcp_client,
+        model=OPENAI_MODEL,
+        max_parallel_tools=MAX_PARALLEL_TOOLS,
+        trace_exporter=trace_exporter,
+        trace_in_events=TRACE_IN_EVENTS,
+        stream=stream,
+        tool_top_k=TOOL_TOP_K,
+        result_budget=result_budget
+    )
 
 
 class ChatRequest(BaseModel):
     """聊天请求"""
     message: str
+    session_id: Optional[str] = None  # 继续已有会话；为空时新建会话
 
 
 @app.post("/chat")
@@ -60,11 +136,13 @@ async def chat(request: ChatRequest):
     if not openai_client:
         raise HTTPException(status_code=500, detail="OpenAI API key未配置")
     
-    agent = Agent(openai_client, mcp_client, model=OPENAI_MODEL)
+    agent = create_agent(stream=LLM_STREAM)
     
     async def generate():
-        async for event in agent.chat(request.message):
-            yield f"data: {json.dumps(event, ensure_ascii=False)}\n\n"
+        async with sessions.checkout(request.session_id) as session:
+            yield f"data: {json.dumps({'type': 'session', 'session_id': session.id})}\n\n"
+            async for event in agent.chat(request.message, session):
+                yield f"data: {json.dumps(event, ensure_ascii=False)}\n\n"
         yield "data: [DONE]\n\n"
     
     return StreamingResponse(
@@ -83,22 +161,50 @@ async def chat_sync(request: ChatRequest):
     if not openai_client:
         raise HTTPException(status_code=500, detail="OpenAI API key未配置")
     
-    agent = Agent(openai_client, mcp_client, model=OPENAI_MODEL)
+    agent = create_agent()
     
     events = []
     final_message = ""
     
-    async for event in agent.chat(request.message):
-        events.append(event)
-        if event["type"] == "message":
-            final_message = event["content"]
+    async with sessions.checkout(request.session_id) as session:
+        async for event in agent.chat(request.message, session):
+            events.append(event)
+            if event["type"] == "message":
+                final_message = event["content"]
     
     return {
+        "session_id": session.id,
         "message": final_message,
         "events": events
     }
 
 
+@app.get("/sessions/{session_id}")
+async def get_session(session_id: str):
+    """查看会话历史（含压缩后的摘要）"""
+    session = await sessions.get(session_id)
+    if session is None:
+        raise HTTPException(status_code=404, detail="会话不存在")
+    return {**session.to_dict(), "tokens": session.tokens()}
+
+
+@app.delete("/sessions/{session_id}")
+async def delete_session(session_id: str):
+    """删除会话"""
+    if not await sessions.delete(session_id):
+        raise HTTPException(status_code=404, detail="会话不存在")
+    return {"deleted": session_id}
+
+
+@app.get("/results/{ref}")
+async def get_result(ref: str, session_id: str):
+    """获取被压缩的工具结果的完整内容（tool_result 事件的 budget.ref），只能读取所属会话的结果"""
+    text = result_budget.store.get(ref, session_id)
+    if text is None:
+        raise HTTPException(status_code=404, detail="结果不存在或已过期")
+    return PlainTextResponse(text)
+
+
 @app.get("/tools")
 async def get_tools():
     """获取可用工具列表"""
@@ -106,6 +212,12 @@ async def get_tools():
     return {"tools": tools}
 
 
+@app.get("/metrics")
+async def get_metrics():
+    """Prometheus 格式的运行指标"""
+    return Response(content=render_metrics(), media_type=CONTENT_TYPE_LATEST)
+
+
 @app.get("/health")
 async def health():
     """健康检查"""
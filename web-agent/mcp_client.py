@@ -1,46 +1,96 @@
 """MCP Client模块 - 连接bridge-server获取和调用工具"""
 import logging
-from typing import Dict, Any, List
+import time
+from typing import Dict, Any, List, Optional
 
-import httpx
+from metrics import CATALOG_TOOLS
+from tool_index import ToolIndex
 
 logger = logging.getLogger(__name__)
 
 
 class MCPClient:
-    """MCP Client - 通过HTTP与bridge-server通信"""
+    """MCP Client - 通过 transport（HTTP / WebSocket RPC / 同进程）与bridge-server通信"""
     
-    def __init__(self, bridge_server_url: str):
-        self.bridge_server_url = bridge_server_url.rstrip("/")
-        self._client = httpx.AsyncClient(timeout=60.0)
+    def __init__(self, transport: Any, tools_cache_ttl: float = 2.0):
+        self.transport = transport
+        # 工具目录缓存：在TTL内直接复用，过期后用 ETag 条件请求重新校验
+        self.tools_cache_ttl = tools_cache_ttl
+        self._tools: List[Dict[str, Any]] = []
+        self._openai_tools: List[Dict[str, Any]] = []
+        self.tool_index = ToolIndex()  # 目录变化时增量更新，用于按消息筛选工具
+        self._tools_etag: Optional[str] = None
+        self._tools_checked_at = 0.0
     
     async def list_tools(self) -> List[Dict[str, Any]]:
-        """获取所有可用工具"""
+        """获取所有可用工具（带缓存，目录版本变化时才重新拉取）"""
+        if self._tools_etag and time.monotonic() - self._tools_checked_at < self.tools_cache_ttl:
+            return self._tools
+        
         try:
-            response = await self._client.get(f"{self.bridge_server_url}/tools")
-            response.raise_for_status()
-            data = response.json()
-            return data.get("tools", [])
+            data, etag = await self.transport.list_tools(self._tools_etag)
+            self._tools_checked_at = time.monotonic()
+            if data is None:
+                return self._tools
         except Exception as e:
+            # 失败时沿用已缓存的目录（首次失败则为空）
             logger.error(f"获取工具列表失败: {e}")
-            return []
+            return self._tools
+        
+        self._tools = data.get("tools", [])
+        self._openai_tools = self.tools_to_openai_format(self._tools)
+        added, removed = self.tool_index.update(self._tools)
+        CATALOG_TOOLS.set(len(self._tools))
+        self._tools_etag = etag
+        logger.info(
+            f"工具目录已更新: 版本 {data.get('version')}, 工具数 {len(self._tools)}，索引 +{added}/-{removed}"
+        )
+        return self._tools
     
-    async def call_tool(self, name: str, arguments: Dict[str, Any]) -> Dict[str, Any]:
-        """调用工具"""
+    async def list_openai_tools(self) -> List[Dict[str, Any]]:
+        """获取OpenAI function calling格式的工具列表（随目录缓存一起复用）"""
+        await self.list_tools()
+        return self._openai_tools
+    
+    async def select_openai_tools(self, query: str, top_k: int) -> List[Dict[str, Any]]:
+        """按 query 选出最相关的 top_k 个工具（OpenAI格式，保持目录顺序以稳定prompt前缀）；
+        目录不超过 top_k 或没有任何工具与 query 相关时返回全部工具"""
+        openai_tools = await self.list_openai_tools()
+        if top_k <= 0 or len(openai_tools) <= top_k:
+            return openai_tools
+        selected = {name for name, _ in self.tool_index.search(query, top_k)}
+        if not selected:
+            return openai_tools
+        return [tool for tool in openai_tools if tool["function"]["name"] in selected]
+    
+    async def call_tool(
+        self,
+        name: str,
+        arguments: Dict[str, Any],
+        trace: Optional[Dict[str, Any]] = None
+    ) -> Dict[str, Any]:
+        """调用工具，trace 为追踪上下文，提供时响应中附带下游各跳的 spans"""
+        body = {"name": name, "arguments": arguments}
+        if trace is not None:
+            body["trace"] = trace
         try:
-            response = await self._client.post(
-                f"{self.bridge_server_url}/tools/call",
-                json={"name": name, "arguments": arguments}
-            )
-            response.raise_for_status()
-            return response.json()
+            # bridge-server过载（429）时直接返回其错误信息（含retry_after）
+            return await self.transport.call_tool(body)
         except Exception as e:
             logger.error(f"调用工具失败: {e}")
             return {"success": False, "error": str(e)}
     
+    async def call_tools_batch(self, calls: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """批量调用工具，calls 为 [{"name": ..., "arguments": {...}}]，返回逐项结果"""
+        try:
+            return await self.transport.call_tools_batch(calls)
+        except Exception as e:
+            logger.error(f"批量调用工具失败: {e}")
+            return [{"success": False, "error": str(e)} for _ in calls]
+    
     async def close(self):
         """关闭客户端"""
-        await self._client.aclose()
+        await self.transport.close()
     
     def tools_to_openai_format(self, tools: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
         """将MCP工具转换为OpenAI function calling格式"""
@@ -0,0 +1,68 @@
+"""指标模块 - Prometheus 格式的运行指标"""
+from typing import Any
+
+from prometheus_client import REGISTRY, Counter, Gauge, Histogram, generate_latest
+
+# 耗时分桶（秒），LLM调用通常比工具调用慢
+LATENCY_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+LLM_CALL_SECONDS = Histogram(
+    "agent_llm_call_duration_seconds",
+    "LLM chat completions 调用耗时",
+    ["model"],
+    buckets=LATENCY_BUCKETS
+)
+LLM_TTFT_SECONDS = Histogram(
+    "agent_llm_time_to_first_token_seconds",
+    "流式LLM调用的首token耗时",
+    ["model"],
+    buckets=LATENCY_BUCKETS
+)
+LLM_CALLS = Counter("agent_llm_calls_total", "LLM调用次数（按结果：ok / error）", ["model", "outcome"])
+LLM_TOKENS = Counter("agent_llm_tokens_total", "LLM token用量", ["model", "kind"])
+TOOL_CALL_SECONDS = Histogram(
+    "agent_tool_call_duration_seconds",
+    "智能体发起的工具调用耗时（含bridge-server往返）",
+    ["tool"],
+    buckets=LATENCY_BUCKETS
+)
+TOOL_CALLS = Counter("agent_tool_calls_total", "智能体发起的工具调用次数（按结果：ok / error）", ["tool", "outcome"])
+TOOL_RESULT_TOKENS_SAVED = Counter(
+    "agent_tool_result_tokens_saved_total",
+    "工具结果超出预算被压缩后少发给LLM的token数（估算）",
+    ["tool"]
+)
+TOOL_RESULTS_COMPACTED = Counter("agent_tool_results_compacted_total", "超出预算被压缩的工具结果数", ["tool"])
+CHATS_ACTIVE = Gauge("agent_chats_active", "进行中的对话数")
+CATALOG_TOOLS = Gauge("agent_catalog_tools", "当前缓存的工具目录中的工具数")
+
+
+def observe_llm_call(model: str, elapsed: float, usage: Any = None, ok: bool = True) -> None:
+    """记录一次LLM调用及其token用量（usage 为 OpenAI 响应的 usage 字段）"""
+    LLM_CALL_SECONDS.labels(model).observe(elapsed)
+    LLM_CALLS.labels(model, "ok" if ok else "error").inc()
+    if usage is not None:
+        LLM_TOKENS.labels(model, "prompt").inc(getattr(usage, "prompt_tokens", 0) or 0)
+        LLM_TOKENS.labels(model, "completion").inc(getattr(usage, "completion_tokens", 0) or 0)
+
+
+def observe_llm_ttft(model: str, elapsed: float) -> None:
+    """记录一次流式LLM调用的首token耗时"""
+    LLM_TTFT_SECONDS.labels(model).observe(elapsed)
+
+
+def observe_tool_call(tool: str, elapsed: float, ok: bool) -> None:
+    """记录一次工具调用"""
+    TOOL_CALL_SECONDS.labels(tool).observe(elapsed)
+    TOOL_CALLS.labels(tool, "ok" if ok else "error").inc()
+
+
+def observe_result_budget(tool: str, tokens_saved: int) -> None:
+    """记录一次工具结果压缩"""
+    TOOL_RESULTS_COMPACTED.labels(tool).inc()
+    TOOL_RESULT_TOKENS_SAVED.labels(tool).inc(max(0, tokens_saved))
+
+
+def render() -> bytes:
+    """以 Prometheus 文本格式导出所有指标"""
+    return generate_latest(REGISTRY)
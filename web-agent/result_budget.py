@@ -0,0 +1,224 @@
+"""工具结果预算模块 - 工具结果送回LLM前按token预算压缩
+
+/tools/call 的响应先去掉 success 包装，转为文本（图片、二进制资源只保留说明）；超出预算时按策略压缩：
+  truncate   只保留开头
+  head_tail  保留开头和结尾（默认，日志、目录列表的结尾往往同样重要）
+  structure  JSON 按结构收缩（长列表只保留前几项、长字符串截断）并保留全部键，非JSON按行保留首尾
+完整内容保存在进程内（按引用ID，并绑定产生它的会话），LLM 可通过内置工具 read_tool_result 分段读取，
+前端可凭会话ID通过 /results/{ref} 获取；其他会话无法读取。
+"""
+import json
+import logging
+import os
+import uuid
+from collections import OrderedDict
+from typing import Dict, Any, List, Optional, Tuple
+
+from sessions import estimate_tokens
+
+logger = logging.getLogger(__name__)
+
+# 配置（环境变量）
+RESULT_BUDGET_TOKENS = int(os.getenv("RESULT_BUDGET_TOKENS", "4000"))  # 单个工具结果送回LLM的token上限（0 表示不限制）
+RESULT_BUDGET_STRATEGY = os.getenv("RESULT_BUDGET_STRATEGY", "head_tail")  # truncate / head_tail / structure
+RESULT_STORE_MAX_BYTES = int(os.getenv("RESULT_STORE_MAX_BYTES", str(64 * 1024 * 1024)))  # 完整结果保存的总大小上限
+
+STRATEGIES = ("truncate", "head_tail", "structure")
+
+# 内置工具：按引用分段读取被压缩结果的完整内容
+READ_RESULT_TOOL = "read_tool_result"
+READ_RESULT_TOOL_SCHEMA = {
+    "type": "function",
+    "function": {
+        "name": READ_RESULT_TOOL,
+        "description": "读取之前被压缩的工具结果的完整内容（分段）。只在压缩后的结果缺少所需信息时使用。",
+        "parameters": {
+            "type": "object",
+            "properties": {
+                "ref": {"type": "string", "description": "压缩说明中给出的结果引用"},
+                "offset": {"type": "integer", "description": "起始字符位置，默认 0"}
+            },
+            "required": ["ref"]
+        }
+    }
+}
+
+# structure 策略逐级收缩的 (列表保留项数, 字符串保留字符数)
+_SHRINK_LEVELS = ((20, 500), (10, 200), (5, 80), (2, 40))
+
+
+def render_result(result: Dict[str, Any]) -> str:
+    """把 /tools/call 响应转为送回LLM的文本：去掉 success 包装，非文本内容只保留说明"""
+    if not result.get("success"):
+        text = f"工具调用失败: {result.get('error')}"
+        if result.get("retry_after") is not None:
+            text += f"（{result['retry_after']} 秒后可重试）"
+        return text
+
+    data = result.get("result")
+    if not isinstance(data, list):
+        return data if isinstance(data, str) else json.dumps(data, ensure_ascii=False)
+
+    parts: List[str] = []
+    for item in data:
+        kind = item.get("type") if isinstance(item, dict) else None
+        if kind == "text":
+            parts.append(item.get("text", ""))
+        elif kind == "image":
+            parts.append(f"[图片 {item.get('mimeType', '')}，约 {len(item.get('data', '')) * 3 // 4 // 1024} KB，未发送给模型]")
+        elif kind == "resource" and "text" in (item.get("resource") or {}):
+            parts.append(item["resource"]["text"])
+        elif kind == "resource":
+            resource = item.get("resource") or {}
+            parts.append(f"[二进制资源 {resource.get('uri', '')} {resource.get('mimeType', '')}，未发送给模型]")
+        else:
+            parts.append(json.dumps(item, ensure_ascii=False))
+    return "\n".join(parts)
+
+
+def _fit_chars(text: str, max_tokens: int) -> int:
+    """text 中约 max_tokens 个token对应的字符数"""
+    tokens = estimate_tokens(text)
+    return len(text) if tokens <= max_tokens else int(len(text) * max_tokens / tokens)
+
+
+def _head_tail(text: str, max_tokens: int) -> str:
+    """保留开头约2/3、结尾约1/3"""
+    keep = _fit_chars(text, max_tokens)
+    head = keep * 2 // 3
+    tail = keep - head
+    return f"{text[:head]}\n…[省略 {len(text) - keep} 字符]…\n{text[len(text) - tail:] if tail else ''}"
+
+
+def _shrink(value: Any, max_items: int, max_chars: int) -> Any:
+    """按结构收缩JSON值：列表保留前 max_items 项，字符串保留前 max_chars 字符，字典保留全部键"""
+    if isinstance(value, list):
+        items = [_shrink(v, max_items, max_chars) for v in value[:max_items]]
+        if len(value) > max_items:
+            items.append(f"…另外 {len(value) - max_items} 项")
+        return items
+    if isinstance(value, dict):
+        return {k: _shrink(v, max_items, max_chars) for k, v in value.items()}
+    if isinstance(value, str) and len(value) > max_chars:
+        return f"{value[:max_chars]}…(+{len(value) - max_chars} 字符)"
+    return value
+
+
+def _structure(text: str, max_tokens: int) -> str:
+    """JSON按结构收缩；非JSON按行保留首尾；仍超出预算时退回 head_tail"""
+    try:
+        value = json.loads(text)
+    except ValueError:
+        value = None
+
+    if isinstance(value, (dict, list)):
+        for max_items, max_chars in _SHRINK_LEVELS:
+            compact = json.dumps(_shrink(value, max_items, max_chars), ensure_ascii=False)
+            if estimate_tokens(compact) <= max_tokens:
+                return compact
+        return _head_tail(compact, max_tokens)
+
+    lines = text.splitlines()
+    if len(lines) > 1:
+        # 预算的2/3给开头的行，其余给结尾的行
+        head = _take_lines(lines, max_tokens * 2 // 3)
+        tail = _take_lines(lines[len(head):][::-1], max_tokens - max_tokens * 2 // 3)[::-1]
+        if head:
+            omitted = len(lines) - len(head) - len(tail)
+            return "\n".join(head + [f"…[省略 {omitted} 行，共 {len(lines)} 行]…"] + tail)
+    return _head_tail(text, max_tokens)
+
+
+def _take_lines(lines: List[str], max_tokens: int) -> List[str]:
+    """从头取行，直到用完 max_tokens"""
+    taken: List[str] = []
+    used = 0
+    for line in lines:
+        used += estimate_tokens(line) + 1
+        if used > max_tokens:
+            break
+        taken.append(line)
+    return taken
+
+
+class ResultStore:
+    """被压缩结果的完整内容，按总大小淘汰最早的；每个结果绑定所属会话（owner）"""
+
+    def __init__(self, max_bytes: int = RESULT_STORE_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self._results: "OrderedDict[str, Tuple[Optional[str], str]]" = OrderedDict()  # ref -> (owner, text)
+        self._bytes = 0
+
+    def put(self, text: str, owner: Optional[str] = None) -> str:
+        """保存完整内容，返回引用ID"""
+        ref = f"res_{uuid.uuid4().hex[:16]}"
+        self._results[ref] = (owner, text)
+        self._bytes += len(text)
+        while self._bytes > self.max_bytes and len(self._results) > 1:
+            _, (_, evicted) = self._results.popitem(last=False)
+            self._bytes -= len(evicted)
+        return ref
+
+    def get(self, ref: str, owner: Optional[str] = None) -> Optional[str]:
+        """读取完整内容；不存在或不属于 owner 时返回None"""
+        entry = self._results.get(ref)
+        if entry is None or entry[0] != owner:
+            return None
+        return entry[1]
+
+
+class ResultBudget:
+    """工具结果送回LLM前的预算阶段"""
+
+    def __init__(
+        self,
+        max_tokens: int = RESULT_BUDGET_TOKENS,
+        strategy: str = RESULT_BUDGET_STRATEGY,
+        store: Optional[ResultStore] = None
+    ):
+        if strategy not in STRATEGIES:
+            raise ValueError(f"不支持的结果压缩策略: {strategy}")
+        self.max_tokens = max_tokens
+        self.strategy = strategy
+        self.store = store if store is not None else ResultStore()
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_tokens > 0
+
+    def apply(self, result: Dict[str, Any], owner: Optional[str] = None) -> Tuple[str, Optional[Dict[str, Any]]]:
+        """返回 (送回LLM的文本, 压缩信息)；未超出预算时压缩信息为None，owner 为所属会话ID"""
+        text = render_result(result)
+        if not self.enabled:
+            return text, None
+        original = estimate_tokens(text)
+        if original <= self.max_tokens:
+            return text, None
+
+        ref = self.store.put(text, owner)
+        if self.strategy == "truncate":
+            compact = text[:_fit_chars(text, self.max_tokens)]
+        elif self.strategy == "structure":
+            compact = _structure(text, self.max_tokens)
+        else:
+            compact = _head_tail(text, self.max_tokens)
+        # 说明放在开头：写入会话历史时工具结果会再按 SESSION_TOOL_RESULT_TOKENS 保留开头截断
+        compact = (
+            f"[结果过长已压缩：原文约 {original} tokens，共 {len(text)} 字符；"
+            f"完整内容可调用 {READ_RESULT_TOOL}(ref=\"{ref}\", offset=...) 分段读取]\n"
+        ) + compact
+        sent = estimate_tokens(compact)
+        return compact, {"ref": ref, "strategy": self.strategy, "original_tokens": original, "tokens": sent}
+
+    def read(self, ref: str, offset: int = 0, owner: Optional[str] = None) -> str:
+        """read_tool_result：从 offset 起读取至多一个预算的完整内容（只能读取 owner 会话的结果）"""
+        text = self.store.get(ref, owner)
+        if text is None:
+            return f"结果 {ref} 不存在或已过期"
+        offset = max(0, offset)
+        rest = text[offset:]
+        end = offset + (_fit_chars(rest, self.max_tokens) if self.enabled else len(rest))
+        chunk = text[offset:end]
+        if end < len(text):
+            chunk += f"\n[第 {offset}-{end} 字符，共 {len(text)} 字符；继续读取请用 offset={end}]"
+        return chunk
@@ -0,0 +1,301 @@
+"""会话模块 - 服务端保存多轮对话历史，并按token预算压缩
+
+发给LLM的消息为: 系统提示词（附早期对话摘要，如有）→ 历史轮次 → 本轮消息。
+历史只在末尾追加；超出预算时一次性丢弃（或摘要）最早的若干轮，降到预算的 SESSION_COMPACT_RATIO，
+因此前缀在多数轮次间保持不变，服务商侧的 prompt 缓存可以持续命中。
+"""
+import asyncio
+import json
+import logging
+import os
+import re
+import time
+import uuid
+import weakref
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Dict, Any, AsyncIterator, List, Optional
+
+from openai import AsyncOpenAI
+
+logger = logging.getLogger(__name__)
+
+# 配置（环境变量）
+SESSION_STORE = os.getenv("SESSION_STORE", "memory")  # memory 或 file:<目录>
+SESSION_MAX = int(os.getenv("SESSION_MAX", "1000"))  # 内存存储保留的会话数（LRU）
+SESSION_TOKEN_BUDGET = int(os.getenv("SESSION_TOKEN_BUDGET", "16000"))  # 历史（含摘要）的token预算
+SESSION_COMPACT_RATIO = float(os.getenv("SESSION_COMPACT_RATIO", "0.5"))  # 超预算时压缩到预算的比例
+SESSION_TOOL_RESULT_TOKENS = int(os.getenv("SESSION_TOOL_RESULT_TOKENS", "2000"))  # 历史中单个工具结果的token上限
+SESSION_SUMMARIZE = os.getenv("SESSION_SUMMARIZE", "false").lower() in ("1", "true", "yes")  # 用LLM摘要被丢弃的轮次
+
+_SESSION_ID = re.compile(r"^[0-9a-f]{32}$")
+
+SUMMARY_PROMPT = (
+    "请把下面的对话压缩为简洁的要点摘要，保留用户的目标、已确认的事实、工具调用得到的关键结果和未完成的事项。"
+    "如果给出了之前的摘要，把它合并进新摘要。只输出摘要。"
+)
+
+
+def estimate_tokens(text: str) -> int:
+    """粗略估算token数：ASCII约4字符一个token，其余（如中文）约1字符一个token"""
+    chars = len(text)
+    non_ascii = (len(text.encode("utf-8")) - chars) // 2  # 中文等在UTF-8中占3字节
+    return (chars - non_ascii) // 4 + non_ascii
+
+
+def message_tokens(message: Dict[str, Any]) -> int:
+    """估算一条消息的token数（含 tool_calls）"""
+    tokens = 4 + estimate_tokens(message.get("content") or "")
+    for tool_call in message.get("tool_calls") or []:
+        tokens += estimate_tokens(tool_call["function"]["name"]) + estimate_tokens(tool_call["function"]["arguments"])
+    return tokens
+
+
+def truncate_text(text: str, max_tokens: int) -> str:
+    """按token上限截断文本，附注原长度"""
+    tokens = estimate_tokens(text)
+    if tokens <= max_tokens:
+        return text
+    keep = int(len(text) * max_tokens / tokens)
+    return f"{text[:keep]}…[已截断，原文 {len(text)} 字符]"
+
+
+@dataclass
+class Session:
+    """一个会话：早期对话摘要 + 按轮次保存的历史消息"""
+    id: str
+    summary: Optional[str] = None
+    turns: List[List[Dict[str, Any]]] = field(default_factory=list)  # 每轮: user → (assistant tool_calls → tool)* → assistant
+    created_at: float = field(default_factory=time.time)
+    updated_at: float = field(default_factory=time.time)
+
+    def system_prompt(self, base: str) -> str:
+        """系统提示词，有摘要时附在其后（只在压缩时变化）"""
+        if not self.summary:
+            return base
+        return f"{base}\n\n之前对话的摘要：\n{self.summary}"
+
+    def history(self) -> List[Dict[str, Any]]:
+        """拼在系统提示词之后的历史消息"""
+        return [message for turn in self.turns for message in turn]
+
+    def add_turn(self, messages: List[Dict[str, Any]], tool_result_tokens: int = SESSION_TOOL_RESULT_TOKENS) -> None:
+        """追加一轮对话；过大的工具结果在写入历史时截断（之后不再改变，保持前缀稳定）"""
+        turn = []
+        for message in messages:
+            if message.get("role") == "tool":
+                message = {**message, "content": truncate_text(message["content"], tool_result_tokens)}
+            turn.append(message)
+        self.turns.append(turn)
+        self.updated_at = time.time()
+
+    def tokens(self) -> int:
+        """历史（含摘要）的估算token数"""
+        return estimate_tokens(self.summary or "") + sum(message_tokens(m) for turn in self.turns for m in turn)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "id": self.id,
+            "summary": self.summary,
+            "turns": self.turns,
+            "created_at": self.created_at,
+            "updated_at": self.updated_at
+        }
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "Session":
+        return cls(
+            id=data["id"],
+            summary=data.get("summary"),
+            turns=data.get("turns", []),
+            created_at=data.get("created_at", time.time()),
+            updated_at=data.get("updated_at", time.time())
+        )
+
+
+class SessionStore:
+    """会话存储接口"""
+
+    async def get(self, session_id: str) -> Optional[Session]:
+        """读取会话，不存在时返回None"""
+        raise NotImplementedError
+
+    async def save(self, session: Session) -> None:
+        """写入会话"""
+        raise NotImplementedError
+
+    async def delete(self, session_id: str) -> bool:
+        """删除会话，返回是否存在"""
+        raise NotImplementedError
+
+
+class MemorySessionStore(SessionStore):
+    """进程内存储，超过 max_sessions 时淘汰最久未使用的会话"""
+
+    def __init__(self, max_sessions: int = SESSION_MAX):
+        self.max_sessions = max_sessions
+        self._sessions: "OrderedDict[str, Session]" = OrderedDict()
+
+    async def get(self, session_id: str) -> Optional[Session]:
+        session = self._sessions.get(session_id)
+        if session is not None:
+            self._sessions.move_to_end(session_id)
+        return session
+
+    async def save(self, session: Session) -> None:
+        self._sessions[session.id] = session
+        self._sessions.move_to_end(session.id)
+        while len(self._sessions) > self.max_sessions:
+            evicted, _ = self._sessions.popitem(last=False)
+            logger.info(f"会话已淘汰: {evicted}")
+
+    async def delete(self, session_id: str) -> bool:
+        return self._sessions.pop(session_id, None) is not None
+
+
+class FileSessionStore(SessionStore):
+    """本地磁盘存储：每个会话一个 JSON 文件，进程重启后仍可继续对话"""
+
+    def __init__(self, directory: str):
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+
+    def _path(self, session_id: str) -> Path:
+        return self.directory / f"{session_id}.json"
+
+    async def get(self, session_id: str) -> Optional[Session]:
+        def read() -> Optional[Session]:
+            try:
+                return Session.from_dict(json.loads(self._path(session_id).read_text(encoding="utf-8")))
+            except FileNotFoundError:
+                return None
+        return await asyncio.to_thread(read)
+
+    async def save(self, session: Session) -> None:
+        def write() -> None:
+            # 先写临时文件再替换，进程中途退出不会留下半个文件
+            path = self._path(session.id)
+            tmp = path.with_suffix(".tmp")
+            tmp.write_text(json.dumps(session.to_dict(), ensure_ascii=False), encoding="utf-8")
+            os.replace(tmp, path)
+        await asyncio.to_thread(write)
+
+    async def delete(self, session_id: str) -> bool:
+        def remove() -> bool:
+            try:
+                self._path(session_id).unlink()
+                return True
+            except FileNotFoundError:
+                return False
+        return await asyncio.to_thread(remove)
+
+
+def create_store(spec: str) -> SessionStore:
+    """根据 SESSION_STORE 创建存储"""
+    if spec == "memory":
+        return MemorySessionStore()
+    if spec.startswith("file:"):
+        return FileSessionStore(spec[len("file:"):])
+    raise ValueError(f"不支持的会话存储: {spec}")
+
+
+class SessionManager:
+    """会话的加载、按预算压缩与保存；同一会话的请求串行处理"""
+
+    def __init__(
+        self,
+        store: SessionStore,
+        token_budget: int = SESSION_TOKEN_BUDGET,
+        compact_ratio: float = SESSION_COMPACT_RATIO,
+        openai_client: Optional[AsyncOpenAI] = None,
+        model: str = "gpt-4o-mini"
+    ):
+        self.store = store
+        self.token_budget = token_budget
+        self.compact_ratio = compact_ratio
+        self.openai = openai_client  # 为None时丢弃早期轮次而不摘要
+        self.model = model
+        self._locks: "weakref.WeakValueDictionary[str, asyncio.Lock]" = weakref.WeakValueDictionary()
+
+    def lock(self, session_id: str) -> asyncio.Lock:
+        """会话锁：同一会话的并发请求依次执行，避免历史交错"""
+        lock = self._locks.get(session_id)
+        if lock is None:
+            lock = asyncio.Lock()
+            self._locks[session_id] = lock
+        return lock
+
+    async def get(self, session_id: str) -> Optional[Session]:
+        """读取会话；ID格式不对（防止文件存储路径穿越）或不存在时返回None"""
+        if not _SESSION_ID.match(session_id):
+            return None
+        return await self.store.get(session_id)
+
+    async def delete(self, session_id: str) -> bool:
+        """删除会话，返回是否存在"""
+        if not _SESSION_ID.match(session_id):
+            return False
+        return await self.store.delete(session_id)
+
+    @asynccontextmanager
+    async def checkout(self, session_id: Optional[str]) -> AsyncIterator[Session]:
+        """持有会话锁时读取会话（未指定或不存在时新建），正常退出时保存
+        
+        先加锁再读取：文件存储每次读取得到独立副本，锁外读取的副本在等锁期间可能已过期。
+        """
+        lock_id = session_id or uuid.uuid4().hex
+        async with self.lock(lock_id):
+            session = await self.get(session_id) if session_id else None
+            if session is None:
+                session = Session(id=uuid.uuid4().hex if session_id else lock_id)
+            yield session
+            await self.save(session)
+
+    async def save(self, session: Session) -> None:
+        """压缩后保存"""
+        await self.compact(session)
+        await self.store.save(session)
+
+    async def compact(self, session: Session) -> None:
+        """历史超出预算时，从最早的轮次开始一次性移除到预算的 compact_ratio（至少保留最近一轮）"""
+        total = session.tokens()
+        if total <= self.token_budget:
+            return
+
+        target = int(self.token_budget * self.compact_ratio)
+        dropped: List[List[Dict[str, Any]]] = []
+        while len(session.turns) > 1 and total > target:
+            turn = session.turns.pop(0)
+            dropped.append(turn)
+            total -= sum(message_tokens(m) for m in turn)
+
+        if self.openai is not None and dropped:
+            try:
+                session.summary = await self._summarize(session.summary, dropped)
+            except Exception as e:
+                logger.warning(f"会话 {session.id} 摘要失败，直接丢弃早期轮次: {e}")
+        logger.info(f"会话 {session.id} 已压缩: 移除 {len(dropped)} 轮，剩余约 {session.tokens()} tokens")
+
+    async def _summarize(self, summary: Optional[str], turns: List[List[Dict[str, Any]]]) -> str:
+        """用LLM把之前的摘要和被移除的轮次合并为新摘要"""
+        lines = [f"之前的摘要：\n{summary}\n"] if summary else []
+        for turn in turns:
+            for message in turn:
+                if message["role"] == "tool":
+                    lines.append(f"[工具结果] {message['content']}")
+                elif message.get("tool_calls"):
+                    calls = ", ".join(f"{c['function']['name']}({c['function']['arguments']})" for c in message["tool_calls"])
+                    lines.append(f"[助手调用工具] {calls}")
+                elif message.get("content"):
+                    lines.append(f"[{'用户' if message['role'] == 'user' else '助手'}] {message['content']}")
+
+        response = await self.openai.chat.completions.create(
+            model=self.model,
+            messages=[
+                {"role": "system", "content": SUMMARY_PROMPT},
+                {"role": "user", "content": truncate_text("\n".join(lines), self.token_budget)}
+            ]
+        )
+        return response.choices[0].message.content or summary or ""
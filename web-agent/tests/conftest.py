@@ -0,0 +1,5 @@
+"""测试配置：以服务目录为模块根（与 python main.py 运行时一致）"""
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
@@ -0,0 +1,27 @@
+"""工具结果预算：被压缩结果的完整内容只能由产生它的会话读取"""
+from result_budget import ResultBudget
+
+SESSION_A = "a" * 32
+SESSION_B = "b" * 32
+
+
+def _compacted(budget: ResultBudget, owner: str) -> str:
+    _, info = budget.apply({"success": True, "result": [{"type": "text", "text": "x" * 2000}]}, owner)
+    return info["ref"]
+
+
+def test_ref_note_leads_compacted_result():
+    budget = ResultBudget(max_tokens=50)
+    text, info = budget.apply({"success": True, "result": [{"type": "text", "text": "x" * 2000}]}, SESSION_A)
+    assert text.startswith("[") and info["ref"] in text.splitlines()[0]
+
+
+def test_result_readable_only_by_owner_session():
+    budget = ResultBudget(max_tokens=50)
+    ref = _compacted(budget, SESSION_A)
+
+    assert budget.store.get(ref, SESSION_A) == "x" * 2000
+    assert budget.store.get(ref, SESSION_B) is None
+    assert budget.store.get(ref) is None
+    assert budget.read(ref, 0, SESSION_A).startswith("x")
+    assert "不存在" in budget.read(ref, 0, SESSION_B)
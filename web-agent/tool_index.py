@@ -0,0 +1,116 @@
+"""工具检索模块 - 按用户消息从大目录中选出最相关的工具（BM25，纯本地计算）
+
+索引内容：工具名（拆分 server 前缀、下划线与驼峰，加权计入）、描述、参数名与参数描述。
+目录变化时按工具内容指纹增量更新，只重建变化的工具。中文按字二元组切分，英文转小写并去掉复数 s。
+"""
+import json
+import math
+import re
+from typing import Dict, Any, List, Tuple
+
+# BM25 参数
+K1 = 1.2
+B = 0.75
+NAME_WEIGHT = 3  # 工具名中的词重复计入的次数
+
+_CAMEL = re.compile(r"([a-z0-9])([A-Z])")
+_WORD = re.compile(r"[A-Za-z]+|[0-9]+|[㐀-鿿]+")
+_STOPWORDS = frozenset(
+    "a an and are as at be by for from in into is it of on or the this that to with "
+    "please can you me my i want need use using tool".split()
+)
+
+
+def tokenize(text: str) -> List[str]:
+    """切词：英文小写词（拆驼峰、去复数 s），中文字二元组（单字保留单字）"""
+    tokens: List[str] = []
+    for word in _WORD.findall(_CAMEL.sub(r"\1 \2", text)):
+        if word[0] >= "㐀":
+            tokens.extend(word if len(word) == 1 else [word[i:i + 2] for i in range(len(word) - 1)])
+            continue
+        word = word.lower()
+        if word in _STOPWORDS:
+            continue
+        if len(word) > 3 and word.endswith("s") and not word.endswith("ss"):
+            word = word[:-1]
+        tokens.append(word)
+    return tokens
+
+
+def tool_text(tool: Dict[str, Any]) -> List[str]:
+    """工具的索引词：名称（加权）、描述、参数名与参数描述、枚举值"""
+    tokens = tokenize(tool["name"].replace("__", " ").replace("_", " ")) * NAME_WEIGHT
+    tokens += tokenize(tool.get("description") or "")
+    properties = (tool.get("inputSchema") or {}).get("properties") or {}
+    for name, schema in properties.items():
+        tokens += tokenize(name.replace("_", " "))
+        if isinstance(schema, dict):
+            tokens += tokenize(schema.get("description") or "")
+            tokens += tokenize(" ".join(str(v) for v in schema.get("enum") or []))
+    return tokens
+
+
+class ToolIndex:
+    """工具目录的 BM25 倒排索引，支持增量更新"""
+
+    def __init__(self):
+        self._fingerprints: Dict[str, str] = {}  # 工具名 -> 内容指纹
+        self._lengths: Dict[str, int] = {}  # 工具名 -> 词数
+        self._terms: Dict[str, List[str]] = {}  # 工具名 -> 包含的词（删除时只需更新这些倒排表）
+        self._postings: Dict[str, Dict[str, int]] = {}  # 词 -> {工具名: 词频}
+        self._total_length = 0
+
+    def __len__(self) -> int:
+        return len(self._lengths)
+
+    def update(self, tools: List[Dict[str, Any]]) -> Tuple[int, int]:
+        """与最新目录同步：删除已不存在或内容变化的工具，加入新工具；返回 (加入数, 删除数)"""
+        fingerprints = {tool["name"]: json.dumps(tool, sort_keys=True, ensure_ascii=False) for tool in tools}
+        removed = [name for name, fp in self._fingerprints.items() if fingerprints.get(name) != fp]
+        for name in removed:
+            self._remove(name)
+        added = 0
+        for tool in tools:
+            if tool["name"] not in self._fingerprints:
+                self._add(tool, fingerprints[tool["name"]])
+                added += 1
+        return added, len(removed)
+
+    def _add(self, tool: Dict[str, Any], fingerprint: str) -> None:
+        name = tool["name"]
+        tokens = tool_text(tool)
+        counts: Dict[str, int] = {}
+        for token in tokens:
+            counts[token] = counts.get(token, 0) + 1
+        for token, count in counts.items():
+            self._postings.setdefault(token, {})[name] = count
+        self._fingerprints[name] = fingerprint
+        self._terms[name] = list(counts)
+        self._lengths[name] = len(tokens)
+        self._total_length += len(tokens)
+
+    def _remove(self, name: str) -> None:
+        del self._fingerprints[name]
+        self._total_length -= self._lengths.pop(name)
+        for token in self._terms.pop(name):
+            posting = self._postings[token]
+            del posting[name]
+            if not posting:
+                del self._postings[token]
+
+    def search(self, query: str, k: int) -> List[Tuple[str, float]]:
+        """返回与 query 最相关的至多 k 个 (工具名, 得分)，按得分降序；没有任何词命中时为空"""
+        if not self._lengths:
+            return []
+        n = len(self._lengths)
+        avg_length = self._total_length / n
+        scores: Dict[str, float] = {}
+        for token in set(tokenize(query)):
+            posting = self._postings.get(token)
+            if not posting:
+                continue
+            idf = math.log(1 + (n - len(posting) + 0.5) / (len(posting) + 0.5))
+            for name, tf in posting.items():
+                norm = K1 * (1 - B + B * self._lengths[name] / avg_length)
+                scores[name] = scores.get(name, 0.0) + idf * tf * (K1 + 1) / (tf + norm)
+        return sorted(scores.items(), key=lambda item: (-item[1], item[0]))[:k]
@@ -0,0 +1,144 @@
+"""链路追踪模块 - 为每次对话生成 trace，汇总各跳返回的 span 并导出为 OTLP JSON
+
+trace 上下文随工具调用逐跳传递: web-agent → bridge-server（/tools/call 请求体）→
+bridge-client（WebSocket call 帧）→ 本地 MCP Server，每跳把自己的 span 随结果返回。
+三个服务各有一份追踪模块，上下文与 span 格式的互通由 mcp-bridge-server/tests/test_wire_compat.py 校验。
+"""
+import json
+import logging
+import time
+import uuid
+from contextlib import contextmanager
+from typing import Dict, Any, Iterator, List, Optional
+
+import httpx
+
+logger = logging.getLogger(__name__)
+
+SERVICE_NAME = "web-agent"
+
+# OTLP 状态码
+_STATUS_OK = 1
+_STATUS_ERROR = 2
+
+
+class Trace:
+    """一次对话的追踪，收集本服务及下游返回的span"""
+
+    def __init__(self):
+        self.trace_id = uuid.uuid4().hex
+        self.spans: List[Dict[str, Any]] = []
+
+    def add(self, spans: Optional[List[Dict[str, Any]]]) -> None:
+        """并入下游返回的span"""
+        if spans:
+            self.spans.extend(spans)
+
+
+@contextmanager
+def span(
+    trace: Optional[Trace],
+    name: str,
+    parent: Optional[Dict[str, Any]] = None,
+    **attributes: Any
+) -> Iterator[Optional[Dict[str, Any]]]:
+    """在 trace 中记录一个span（trace 为None时为空操作），parent 为父span记录"""
+    if trace is None:
+        yield None
+        return
+
+    record = {
+        "trace_id": trace.trace_id,
+        "span_id": uuid.uuid4().hex[:16],
+        "parent_span_id": parent["span_id"] if parent else None,
+        "name": name,
+        "service": SERVICE_NAME,
+        "start": time.time_ns(),
+        "attributes": attributes
+    }
+    try:
+        yield record
+    except BaseException as e:
+        record["error"] = str(e) or type(e).__name__
+        raise
+    finally:
+        record["end"] = time.time_ns()
+        trace.spans.append(record)
+
+
+def child_context(record: Optional[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+    """传给下一跳的trace上下文（未追踪时为None）"""
+    if record is None:
+        return None
+    return {"trace_id": record["trace_id"], "parent_span_id": record["span_id"]}
+
+
+def _otlp_value(value: Any) -> Dict[str, Any]:
+    """属性值转为OTLP AnyValue"""
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+
+def to_otlp(spans: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """转换为 OTLP/HTTP JSON（ExportTraceServiceRequest），按服务分组"""
+    by_service: Dict[str, List[Dict[str, Any]]] = {}
+    for record in spans:
+        otlp_span = {
+            "traceId": record["trace_id"],
+            "spanId": record["span_id"],
+            "name": record["name"],
+            "kind": 1,  # SPAN_KIND_INTERNAL
+            "startTimeUnixNano": str(record["start"]),
+            "endTimeUnixNano": str(record.get("end", record["start"])),
+            "attributes": [
+                {"key": key, "value": _otlp_value(value)}
+                for key, value in (record.get("attributes") or {}).items()
+                if value is not None
+            ],
+            "status": (
+                {"code": _STATUS_ERROR, "message": record["error"]}
+                if record.get("error") else {"code": _STATUS_OK}
+            )
+        }
+        if record.get("parent_span_id"):
+            otlp_span["parentSpanId"] = record["parent_span_id"]
+        by_service.setdefault(record.get("service", "unknown"), []).append(otlp_span)
+
+    return {
+        "resourceSpans": [
+            {
+                "resource": {"attributes": [{"key": "service.name", "value": {"stringValue": service}}]},
+                "scopeSpans": [{"scope": {"name": "mcp-bridge"}, "spans": otlp_spans}]
+            }
+            for service, otlp_spans in by_service.items()
+        ]
+    }
+
+
+class TraceExporter:
+    """导出 trace：追加写入 JSON Lines 文件，和/或 POST 到 OTLP/HTTP collector（如 http://localhost:4318/v1/traces）"""
+
+    def __init__(self, file_path: Optional[str] = None, endpoint: Optional[str] = None):
+        self.file_path = file_path
+        self.endpoint = endpoint
+        self._client = httpx.AsyncClient(timeout=5.0) if endpoint else None
+
+    async def export(self, trace: Trace) -> None:
+        """导出一次对话的全部span，失败只记录日志"""
+        if not trace.spans:
+            return
+        payload = to_otlp(trace.spans)
+        try:
+            if self.file_path:
+                with open(self.file_path, "a", encoding="utf-8") as f:
+                    f.write(json.dumps(payload, ensure_ascii=False) + "\n")
+            if self._client:
+                response = await self._client.post(self.endpoint, json=payload)
+                response.raise_for_status()
+        except Exception as e:
+            logger.error(f"导出trace失败: {e}")
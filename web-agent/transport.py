@@ -0,0 +1,186 @@
+"""传输模块 - MCPClient 与 bridge-server 之间的通信方式
+
+http   每次调用一个 HTTP 请求（连接池大小可调，可选 HTTP/2）
+ws     一条 WebSocket 长连接（bridge-server 的 /rpc），所有调用在其上并发复用
+local  同进程部署：直接调用内嵌的 bridge-server，没有网络往返和额外的 JSON 编解码
+"""
+import asyncio
+import itertools
+import json
+import logging
+from types import ModuleType
+from typing import Dict, Any, List, Optional, Tuple
+
+import httpx
+import websockets
+
+logger = logging.getLogger(__name__)
+
+
+class HttpTransport:
+    """HTTP/1.1（或HTTP/2）请求，连接池复用"""
+
+    def __init__(
+        self,
+        bridge_server_url: str,
+        max_connections: int = 100,
+        max_keepalive: int = 20,
+        http2: bool = False
+    ):
+        self.bridge_server_url = bridge_server_url.rstrip("/")
+        # HTTP/2 需要 h2 包，且 bridge-server 前需有支持 HTTP/2 的代理（uvicorn 只支持 HTTP/1.1）
+        self._client = httpx.AsyncClient(
+            timeout=60.0,
+            http2=http2,
+            limits=httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_keepalive)
+        )
+
+    async def list_tools(self, etag: Optional[str]) -> Tuple[Optional[Dict[str, Any]], Optional[str]]:
+        """获取工具目录，返回 (目录, ETag)；目录未变化时目录为None"""
+        headers = {"If-None-Match": etag} if etag else {}
+        response = await self._client.get(f"{self.bridge_server_url}/tools", headers=headers)
+        if response.status_code == 304:
+            return None, etag
+        response.raise_for_status()
+        return response.json(), response.headers.get("etag")
+
+    async def call_tool(self, body: Dict[str, Any]) -> Dict[str, Any]:
+        """调用工具，过载（429）时返回其错误信息"""
+        response = await self._client.post(f"{self.bridge_server_url}/tools/call", json=body)
+        if response.status_code == 429:
+            return response.json()
+        response.raise_for_status()
+        return response.json()
+
+    async def call_tools_batch(self, calls: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """批量调用工具"""
+        response = await self._client.post(f"{self.bridge_server_url}/tools/call/batch", json={"calls": calls})
+        response.raise_for_status()
+        return response.json().get("results", [])
+
+    async def close(self) -> None:
+        await self._client.aclose()
+
+
+class _RpcConnection:
+    """一条RPC连接及其上等待响应的请求"""
+
+    def __init__(self, ws: Any):
+        self.ws = ws
+        self.pending: Dict[int, asyncio.Future] = {}
+        self.reader = asyncio.create_task(self._read())
+
+    @property
+    def closed(self) -> bool:
+        return self.reader.done()
+
+    async def _read(self) -> None:
+        """把响应分发给对应的请求；连接断开时让所有等待中的请求失败"""
+        try:
+            async for message in self.ws:
+                data = json.loads(message)
+                future = self.pending.pop(data.get("id"), None)
+                if future is not None and not future.done():
+                    future.set_result(data)
+        except websockets.ConnectionClosed:
+            pass
+        finally:
+            for future in self.pending.values():
+                if not future.done():
+                    future.set_exception(ConnectionError("与bridge-server的RPC连接已断开"))
+            self.pending.clear()
+
+
+class WebSocketTransport:
+    """bridge-server /rpc 上的多路复用长连接，断开后在下一次调用时重连"""
+
+    def __init__(self, bridge_server_url: str, timeout: float = 60.0):
+        base = bridge_server_url.rstrip("/")
+        if base.startswith("https://"):
+            base = "wss://" + base[len("https://"):]
+        elif base.startswith("http://"):
+            base = "ws://" + base[len("http://"):]
+        self.url = f"{base}/rpc"
+        self.timeout = timeout
+        self._conn: Optional[_RpcConnection] = None
+        self._connect_lock = asyncio.Lock()
+        self._ids = itertools.count(1)
+
+    async def _connection(self) -> _RpcConnection:
+        if self._conn is not None and not self._conn.closed:
+            return self._conn
+        async with self._connect_lock:
+            if self._conn is None or self._conn.closed:
+                ws = await websockets.connect(self.url, max_size=None)
+                self._conn = _RpcConnection(ws)
+                logger.info(f"已连接bridge-server RPC: {self.url}")
+        return self._conn
+
+    async def _request(self, method: str, params: Dict[str, Any]) -> Dict[str, Any]:
+        """发送请求并等待对应id的响应"""
+        conn = await self._connection()
+        request_id = next(self._ids)
+        future = asyncio.get_running_loop().create_future()
+        conn.pending[request_id] = future
+        try:
+            await conn.ws.send(json.dumps({"id": request_id, "method": method, "params": params}, ensure_ascii=False))
+            return await asyncio.wait_for(future, self.timeout)
+        except (asyncio.TimeoutError, asyncio.CancelledError):
+            # 超时或调用方已离开（如 /chat 的SSE客户端断开）：让 bridge-server 取消该请求
+            if not conn.closed:
+                try:
+                    await conn.ws.send(json.dumps({"method": "cancel", "params": {"id": request_id}}))
+                except Exception:
+                    pass
+            raise
+        finally:
+            conn.pending.pop(request_id, None)
+
+    async def list_tools(self, etag: Optional[str]) -> Tuple[Optional[Dict[str, Any]], Optional[str]]:
+        response = await self._request("tools/list", {"etag": etag})
+        if response["status"] == 304:
+            return None, etag
+        return response["result"], response.get("etag")
+
+    async def call_tool(self, body: Dict[str, Any]) -> Dict[str, Any]:
+        response = await self._request("tools/call", body)
+        if response["status"] not in (200, 429):
+            raise RuntimeError(response["result"].get("error"))
+        return response["result"]
+
+    async def call_tools_batch(self, calls: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        response = await self._request("tools/call/batch", {"calls": calls})
+        if response["status"] != 200:
+            raise RuntimeError(response["result"].get("error"))
+        return response["result"].get("results", [])
+
+    async def close(self) -> None:
+        if self._conn is not None:
+            await self._conn.ws.close()
+
+
+class LocalTransport:
+    """同进程调用内嵌的 bridge-server（见 colocated.py）"""
+
+    def __init__(self, bridge: Dict[str, ModuleType]):
+        self.registry = bridge["registry"].registry
+        self.mcp_server = bridge["mcp_server"]
+        self.OverloadedError = bridge["admission"].OverloadedError
+
+    async def list_tools(self, etag: Optional[str]) -> Tuple[Optional[Dict[str, Any]], Optional[str]]:
+        current = self.registry.get_catalog_etag()
+        if current == etag:
+            return None, etag
+        return {"tools": self.registry.get_all_tools(), "version": self.registry.version}, current
+
+    async def call_tool(self, body: Dict[str, Any]) -> Dict[str, Any]:
+        try:
+            return await self.mcp_server.call_tool(body["name"], body["arguments"], body.get("trace"))
+        except self.OverloadedError as e:
+            return {"success": False, "error": str(e), "retry_after": e.retry_after}
+
+    async def call_tools_batch(self, calls: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        return await self.mcp_server.call_tool_batch(calls)
+
+    async def close(self) -> None:
+        pass
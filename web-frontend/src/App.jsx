@@ -5,6 +5,7 @@ function App() {
   const [input, setInput] = useState('')
   const [loading, setLoading] = useState(false)
   const [tools, setTools] = useState([])
+  const [sessionId, setSessionId] = useState(null)  // 服务端会话，后续消息带上以继续多轮对话
   const messagesEndRef = useRef(null)
 
   // 滚动到底部
@@ -39,20 +40,22 @@ function App() {
       const response = await fetch('/api/chat', {
         method: 'POST',
         headers: { 'Content-Type': 'application/json' },
-        body: JSON.stringify({ message: userMessage })
+        body: JSON.stringify({ message: userMessage, session_id: sessionId })
       })
 
       const reader = response.body.getReader()
       const decoder = new TextDecoder()
 
-      let currentAssistantMessage = null
+      // 未读完的半行留到下一块（流式增量事件很小，常被拆在两次读取之间）
+      let buffer = ''
 
       while (true) {
         const { done, value } = await reader.read()
         if (done) break
 
-        const chunk = decoder.decode(value)
-        const lines = chunk.split('\n')
+        buffer += decoder.decode(value, { stream: true })
+        const lines = buffer.split('\n')
+        buffer = lines.pop()
 
         for (const line of lines) {
           if (line.startsWith('data: ')) {
@@ -62,7 +65,9 @@ function App() {
             try {
               const event = JSON.parse(data)
 
-              if (event.type === 'tool_call') {
+              if (event.type === 'session') {
+                setSessionId(event.session_id)
+              } else if (event.type === 'tool_call') {
                 setMessages(prev => [...prev, {
                   type: 'tool_call',
                   tool: event.tool,
@@ -74,11 +79,22 @@ function App() {
                   tool: event.tool,
                   result: event.result
                 }])
+              } else if (event.type === 'message_delta') {
+                // 增量追加到正在生成的助手消息
+                setMessages(prev => {
+                  const last = prev[prev.length - 1]
+                  if (last?.type === 'assistant' && last.streaming) {
+                    return [...prev.slice(0, -1), { ...last, content: last.content + event.content }]
+                  }
+                  return [...prev, { type: 'assistant', content: event.content, streaming: true }]
+                })
               } else if (event.type === 'message') {
-                setMessages(prev => [...prev, {
-                  type: 'assistant',
-                  content: event.content
-                }])
+                // 完整回复：替换正在生成的消息
+                setMessages(prev => {
+                  const last = prev[prev.length - 1]
+                  const rest = last?.type === 'assistant' && last.streaming ? prev.slice(0, -1) : prev
+                  return [...rest, { type: 'assistant', content: event.content }]
+                })
               } else if (event.type === 'error') {
                 setMessages(prev => [...prev, {
                   type: 'error',